@@ -0,0 +1,104 @@
+"""For checking that linearized aircraft integrated together (as a batch in a scene, or as an
+ensemble in a dispersion) follow the same trajectories as when each is stepped by itself while
+flying through turbulence or a wind field. The acceleration terms (alpha_hat and beta_hat) are given nonzero
+coefficients, since they depend on the velocity relative to the air."""
+
+import os
+import copy
+import json
+import tempfile
+import multiprocessing as mp
+
+import numpy as np
+from pylot.scene import Scene
+from pylot.dispersion import run_dispersion
+from pylot.wind import write_wind_field
+
+
+def get_input(atmosphere):
+    """Returns a simulation input with four copies of the example aircraft flying through the given atmosphere."""
+
+    # Load aircraft, adding acceleration terms
+    aircraft_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples", "LinearizedModel", "basic_high_wing.json")
+    with open(aircraft_file, 'r') as aircraft_handle:
+        aircraft_dict = json.load(aircraft_handle)
+    aircraft_dict["coefficients"]["CL,a_hat"] = 1.5
+    aircraft_dict["coefficients"]["Cm,a_hat"] = -4.0
+    aircraft_dict["coefficients"]["CS,b_hat"] = 0.2
+    aircraft_dict["coefficients"]["Cn,b_hat"] = 0.1
+
+    # Spread out the aircraft
+    aircraft = []
+    for i in range(4):
+        aircraft.append({
+            "name" : "aircraft_{0}".format(i),
+            "file" : copy.deepcopy(aircraft_dict),
+            "initial_state" : {
+                "position" : [0.0, 50.0*i, -1000.0-10.0*i],
+                "velocity" : 180.0-5.0*i,
+                "orientation" : [0.0, 2.0, 0.0],
+                "control_state" : {"throttle" : 0.5, "elevator" : 1.0}
+            }
+        })
+
+    return {
+        "units" : "English",
+        "atmosphere" : atmosphere,
+        "simulation" : {"real_time" : False, "timestep" : 0.02, "final_time" : 3.0},
+        "aircraft" : aircraft
+    }
+
+
+def write_shear_field(filename):
+    """Writes a steady wind field whose head- and crosswind grow with altitude."""
+    altitudes = np.arange(0.0, 2001.0, 100.0)
+    wind = np.zeros((1, 1, len(altitudes), 3))
+    wind[0,0,:,0] = -0.02*altitudes[::-1]
+    wind[0,0,:,1] = 0.01*altitudes[::-1]
+    write_wind_field(filename, wind, 100.0, origin=[0.0, 0.0, -2000.0])
+
+
+def run_scene(input_dict, batch, dt=0.02, N_steps=150):
+    """Steps the scene with or without batching the aircraft and returns the final states."""
+
+    input_dict = copy.deepcopy(input_dict)
+    input_dict["simulation"]["batch_aircraft"] = batch
+    flags = [mp.Value('i', 0) for i in range(4)]
+    scene = Scene(input_dict, "English", *flags, False)
+    t = 0.0
+    for i in range(N_steps):
+        scene.step(t, dt)
+        t += dt
+    return np.array([aircraft.y for aircraft in scene.aircraft])
+
+
+def run_dispersions(input_dict):
+    """Runs a dispersion of the first aircraft as an ensemble and one sample at a time and returns the mean states."""
+
+    input_dict = copy.deepcopy(input_dict)
+    input_dict["aircraft"] = input_dict["aircraft"][0]
+    dispersions = {"input.aircraft.initial_state.velocity" : {"distribution" : "normal", "std" : 5.0}}
+    means = []
+    for ensemble in [True, False]:
+        results = run_dispersion(input_dict, dispersions, 16, seed=0, ensemble=ensemble, processes=2)
+        means.append(results["mean"])
+    return means
+
+
+if __name__=="__main__":
+
+    # Atmospheres to check
+    shear_file = os.path.join(tempfile.mkdtemp(), "shear.bin")
+    write_shear_field(shear_file)
+    atmospheres = [
+        ("Turbulence", {"turbulence" : {"intensity" : 5.0, "scale_length" : [1750.0, 875.0, 875.0], "airspeed" : 180.0, "duration" : 100.0, "seed" : 2}}),
+        ("Wind shear", {"wind_field" : {"file" : shear_file}})
+    ]
+
+    print("{0:<20}{1:>30}{2:>30}".format("Atmosphere", "Scene max diff", "Dispersion max diff"))
+    for name, atmosphere in atmospheres:
+        input_dict = get_input(atmosphere)
+        scene_diff = np.max(np.abs(run_scene(input_dict, True)-run_scene(input_dict, False)))
+        ensemble_mean, sample_mean = run_dispersions(input_dict)
+        dispersion_diff = np.max(np.abs(ensemble_mean-sample_mean))
+        print("{0:<20}{1:>30.3e}{2:>30.3e}".format(name, scene_diff, dispersion_diff))
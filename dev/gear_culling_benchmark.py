@@ -0,0 +1,50 @@
+"""For measuring the cost of the landing gear model in up-and-away flight and on the ground."""
+
+import os
+import json
+import timeit
+
+import numpy as np
+import pylot
+
+
+def time_per_call(fun, number=5000):
+    """Returns the average time in microseconds taken by the given function."""
+    return timeit.timeit(fun, number=number)/number*1.0e6
+
+
+if __name__=="__main__":
+
+    # Load aircraft
+    aircraft_file = os.path.join(os.path.dirname(__file__), "..", "examples", "LinearizedModel", "basic_high_wing.json")
+    input_dict = {
+        "units" : "English",
+        "aircraft" : {
+            "name" : "benchmark",
+            "file" : aircraft_file,
+            "cache_definition" : False,
+            "initial_state" : {
+                "velocity" : 175.0,
+                "position" : [0.0, 0.0, -10000.0],
+                "orientation" : [0.0, 2.0, 0.0]
+            }
+        }
+    }
+    aircraft = pylot.load_headless_aircraft(input_dict)
+    gear = aircraft._landing_gear_set
+    controls = aircraft.controls
+    u_inf = np.array([1.0, 0.0, 0.0])
+
+    # Time each condition
+    print("{0:<20}{1:>20}{2:>20}".format("Condition", "Per strut [us]", "Gear set [us]"))
+    for name, altitude in [("10,000 ft", 10000.0), ("ground roll", 0.5)]:
+        y = np.copy(aircraft.y)
+        y[8] = -altitude
+
+        per_strut = time_per_call(lambda: sum([strut.get_landing_FM(y, controls, 0.002, u_inf, 175.0) for strut in gear.landing_gear]))
+        gear_set = time_per_call(lambda: gear.get_landing_FM(y, controls, 0.002, u_inf, 175.0))
+        print("{0:<20}{1:>20.2f}{2:>20.2f}".format(name, per_strut, gear_set))
+
+    # Time full state derivative at altitude
+    aircraft.y[8] = -10000.0
+    print("dy_dt at 10,000 ft: {0:.2f} us".format(time_per_call(lambda: aircraft.dy_dt(0.0))))
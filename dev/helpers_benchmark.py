@@ -0,0 +1,44 @@
+"""For comparing the batched quaternion and frame-transform kernels in pylot.helpers against looping the scalar versions."""
+
+import timeit
+
+import numpy as np
+from pylot.helpers import Body2Fixed, Fixed2Body, Quat2Euler, Euler2Quat, NormalizeQuaternion, cross
+from pylot.helpers import Body2FixedArray, Fixed2BodyArray, Quat2EulerArray, Euler2QuatArray, NormalizeQuaternionArray, CrossArray
+
+
+def time_per_call(fun, number=20):
+    """Returns the average time in milliseconds taken by the given function."""
+    return timeit.timeit(fun, number=number)/number*1.0e3
+
+
+if __name__=="__main__":
+
+    # Generate random vectors and orientations
+    N = 10000
+    rng = np.random.default_rng(0)
+    v = rng.normal(size=(N,3))
+    w = rng.normal(size=(N,3))
+    q = NormalizeQuaternionArray(rng.normal(size=(N,4)))
+    E = Quat2EulerArray(q)
+    out3 = np.empty((N,3))
+    out4 = np.empty((N,4))
+
+    # Kernels to compare
+    cases = [
+        ("Body2Fixed", lambda: [Body2Fixed(v[i], q[i]) for i in range(N)], lambda: Body2FixedArray(v, q, out=out3)),
+        ("Fixed2Body", lambda: [Fixed2Body(v[i], q[i]) for i in range(N)], lambda: Fixed2BodyArray(v, q, out=out3)),
+        ("Quat2Euler", lambda: [Quat2Euler(q[i]) for i in range(N)], lambda: Quat2EulerArray(q, out=out3)),
+        ("Euler2Quat", lambda: [Euler2Quat(E[i]) for i in range(N)], lambda: Euler2QuatArray(E, out=out4)),
+        ("NormalizeQuaternion", lambda: [NormalizeQuaternion(q[i]) for i in range(N)], lambda: NormalizeQuaternionArray(q, out=out4)),
+        ("cross", lambda: [cross(v[i], w[i]) for i in range(N)], lambda: CrossArray(v, w, out=out3))
+    ]
+
+    # Time and check agreement
+    print("N = {0}".format(N))
+    print("{0:<22}{1:>14}{2:>14}{3:>10}{4:>14}".format("Kernel", "Loop [ms]", "Array [ms]", "Speedup", "Max diff"))
+    for name, loop, array in cases:
+        t_loop = time_per_call(loop, number=3)
+        t_array = time_per_call(array)
+        diff = np.max(np.abs(np.array(loop())-array()))
+        print("{0:<22}{1:>14.3f}{2:>14.3f}{3:>10.1f}{4:>14.2e}".format(name, t_loop, t_array, t_loop/t_array, diff))
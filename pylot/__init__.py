@@ -1,2 +1,11 @@
 from .controllers import BaseController
-from .simulator import Simulator
\ No newline at end of file
+from .simulator import Simulator
+from .trim_sweep import trim_sweep
+from .linear_propagation import LinearPropagator
+from .dispersion import run_dispersion
+from .physics import load_headless_aircraft
+from .terrain import Terrain, write_terrain
+from .scene import Scene, read_state_log
+from .turbulence import Turbulence, write_turbulence
+from .wind import WindField, write_wind_field
+from .events import Event
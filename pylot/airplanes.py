@@ -2,17 +2,25 @@
 
 import os
 import copy
+import json
+import atexit
 
 import math as m
 import numpy as np
+import multiprocessing as mp
 import machupX as mx
 import scipy.optimize as opt
 
 from abc import abstractmethod
-from pylot.helpers import import_value, Euler2Quat, Body2Fixed, NormalizeQuaternion, NormalizeQuaternionNearOne, Fixed2Body, cross
+from pylot.helpers import import_value, Euler2Quat, Quat2Euler, Body2Fixed, Body2FixedArray, Fixed2BodyArray, NormalizeQuaternion, NormalizeQuaternionNearOne, Fixed2Body, cross
 from pylot.std_atmos import statee, statsi
 from pylot.controllers import NoController, KeyboardController, JoystickController, TimeSequenceController
-from pylot.components import Engine, LandingGear
+from pylot.components import Engine, EngineBank, LandingGear, LandingGearSet
+from pylot.cache import DiskCache, hash_content, get_file_stamps
+from pylot.events import get_builtin_event
+
+# Incremented whenever the attributes stored in compiled aircraft definitions change
+_DEFINITION_CACHE_VERSION = 6
 
 class BaseAircraft:
     """A base class for aircraft to be used in the simulator.
@@ -24,13 +32,30 @@ class BaseAircraft:
 
     input_dict : dict
         Dictionary describing the airplane.
+
+    terrain : Terrain, optional
+        Terrain the aircraft flies over. Defaults to flat ground at z = 0.
+
+    turbulence : Turbulence, optional
+        Gusts the aircraft flies through. Defaults to still air.
+
+    wind_field : WindField, optional
+        Steady or time-varying wind the aircraft flies through. Defaults to still air.
     """
 
-    def __init__(self, name, input_dict, density, units, param_dict, quit_flag, view_flag, pause_flag, data_flag, enable_interface):
+    # Whether get_jacobian() is evaluated analytically (True) or using finite differences (False)
+    _analytic_jacobian = False
+
+    def __init__(self, name, input_dict, density, units, param_dict, quit_flag, view_flag, pause_flag, data_flag, enable_interface, **kwargs):
 
         # Store input
         self.name = name
         self._input_dict = input_dict
+        self._density_spec = density
+        self._terrain = kwargs.get("terrain", None)
+        self._turbulence = kwargs.get("turbulence", None)
+        self._wind_field = kwargs.get("wind_field", None)
+        self._wind = np.zeros(3)
 
         # Initialize state
         self.y = np.zeros(13)
@@ -55,6 +80,62 @@ class BaseAircraft:
                 header = "   Time[s]           u[m/s]            v[m/s]            w[m/s]            p[rad/s]          q[rad/s]          r[rad/s]          x[m]              y[m]              z[m]              eo                e1                e2                e3"
             print(header, file=self._output_handle)
 
+        # Load controls
+        controller = param_dict.get("controller", None)
+        self._initialize_controller(controller, quit_flag, view_flag, pause_flag, data_flag, enable_interface, param_dict.get("control_output", None))
+
+        # Import mass properties, components, and aerodynamic model
+        self._load_definition(param_dict.get("cache_definition", True))
+        self._hooked = False
+
+        # Set up built-in events
+        self.events = []
+        for event_name, event_dict in param_dict.get("events", {}).items():
+            self.add_event(get_builtin_event(event_name, self, **event_dict))
+
+
+    def add_event(self, event):
+        """Adds an event to be located during the integration.
+
+        Parameters
+        ----------
+        event : Event
+            Event to add. The event function is called with this aircraft.
+        """
+        self.events.append(event)
+
+
+    def _load_definition(self, use_cache):
+        # Imports the aircraft definition, reusing the compiled (unit-converted) definition
+        # stored in the disk cache if this aircraft has been loaded before
+
+        # Check for a compiled definition
+        if use_cache:
+            cache = DiskCache("definitions", max_size=500.0, max_age=30.0)
+            cache_key = hash_content(_DEFINITION_CACHE_VERSION, type(self).__name__, self._input_dict, self._units, get_file_stamps(self._input_dict))
+            compiled = cache.load(cache_key)
+            if compiled is not None:
+                self.__dict__.update(compiled)
+                return
+
+        # Import, keeping track of the attributes which make up the definition
+        prev_attributes = set(self.__dict__.keys())
+        self._import_definition()
+
+        # Store
+        if use_cache:
+            compiled = {}
+            for name, value in self.__dict__.items():
+                if name not in prev_attributes:
+                    compiled[name] = value
+            cache.save(cache_key, compiled)
+
+
+    def _import_definition(self):
+        # Imports mass properties, components, and the stall model from the aircraft definition.
+        # Derived classes add their aerodynamic model. Only the attributes set here are stored in
+        # the compiled definition.
+
         # Set mass properties
         self._CG = import_value("CG", self._input_dict, self._units, [0.0, 0.0, 0.0])
         self._W = import_value("weight", self._input_dict, self._units, None)
@@ -84,6 +165,7 @@ class BaseAircraft:
         for key, value in self._input_dict.get("engines", {}).items():
             self._engines.append(Engine(key, **value, units=self._units, CG=self._CG))
             self._num_engines += 1
+        self._engine_bank = EngineBank(self._engines)
 
         # Load landing gear
         self._landing_gear = []
@@ -91,14 +173,10 @@ class BaseAircraft:
         for key, value in self._input_dict.get("landing_gear", {}).items():
             self._landing_gear.append(LandingGear(key, **value, units=self._units, CG=self._CG))
             self._num_landing_gear += 1
+        self._landing_gear_set = LandingGearSet(self._landing_gear, self._CG)
 
         # Get position of bungee hook
         self._hook_pos = import_value("launch_hook_position", self._input_dict, self._units, [0.0, 0.0, 0.0])
-        self._hooked = False
-
-        # Load controls
-        controller = param_dict.get("controller", None)
-        self._initialize_controller(controller, quit_flag, view_flag, pause_flag, data_flag, enable_interface, param_dict.get("control_output", None))
 
         # Get stall model
         self._stall_model = self._input_dict["aero_model"].get("stall_model", "exponential")
@@ -147,6 +225,12 @@ class BaseAircraft:
         self.controller.finalize()
 
 
+    def get_coefficient_staleness(self):
+        """Returns how old (in simulation seconds) the aerodynamic coefficients in use are.
+        Aircraft which solve their aerodynamics synchronously always return 0.0."""
+        return 0.0
+
+
     def output_state(self, t):
         if self._output_state:
             s = ["{:>18.9E}".format(t)]
@@ -188,7 +272,76 @@ class BaseAircraft:
         return CL, CD, CS, Cl, Cm, Cn
 
 
-    def dy_dt(self, t):
+    def _correct_stall_derivs(self, C, alpha, beta, S_a, S_B, C_a, C_B):
+        # Gives the derivatives of the stall-corrected coefficients [CL, CD, CS, Cl, Cm, Cn] with respect to
+        # the uncorrected coefficients (diagonal, as a vector), the angle of attack, and the sideslip angle
+
+        dC_dC = np.ones(6)
+        dC_da = np.zeros(6)
+        dC_dB = np.zeros(6)
+
+        # Exponential blending model
+        if self._stall_model=="exponential":
+
+            # Blending coefficient
+            k = 100
+
+            # Get stall values and their derivatives
+            sign_a = np.sign(alpha)
+            sign_B = np.sign(beta)
+            CS_stall = 0.2*S_B*S_B*C_B*sign_B
+            C_stall = np.array([2.0*S_a*S_a*C_a*sign_a, 1-C_a*S_a*sign_a, CS_stall, -CS_stall*0.05, -0.5*S_a, CS_stall*0.1])
+            dCS_stall_dB = 0.2*sign_B*(2.0*S_B*C_B*C_B-S_B*S_B*S_B)
+            dC_stall_da = np.array([2.0*sign_a*(2.0*S_a*C_a*C_a-S_a*S_a*S_a), -sign_a*(C_a*C_a-S_a*S_a), 0.0, 0.0, -0.5*C_a, 0.0])
+            dC_stall_dB = np.array([0.0, 0.0, dCS_stall_dB, -dCS_stall_dB*0.05, 0.0, dCS_stall_dB*0.1])
+
+            # Blending functions
+            lon_1 = 1/(1+m.exp(-k*(-self._alpha_stall-alpha)))
+            lon_2 = 1/(1+m.exp(-k*(alpha-self._alpha_stall)))
+            lat_1 = 1/(1+m.exp(-k*(-self._beta_stall-beta)))
+            lat_2 = 1/(1+m.exp(-k*(beta-self._beta_stall)))
+            lon_stall_weight = lon_1+lon_2
+            lat_stall_weight = lat_1+lat_2
+            d_lon_da = k*(lon_2*(1-lon_2)-lon_1*(1-lon_1))
+            d_lat_dB = k*(lat_2*(1-lat_2)-lat_1*(1-lat_1))
+
+            # Blend
+            lon = [0, 1, 4]
+            lat = [2, 3, 5]
+            dC_dC[lon] = 1-lon_stall_weight
+            dC_dC[lat] = 1-lat_stall_weight
+            dC_da[lon] = (C_stall[lon]-C[lon])*d_lon_da+dC_stall_da[lon]*lon_stall_weight
+            dC_dB[lat] = (C_stall[lat]-C[lat])*d_lat_dB+dC_stall_dB[lat]*lat_stall_weight
+
+        return dC_dC, dC_da, dC_dB
+
+
+    def _correct_stall_batch(self, C, alpha, beta, S_a, S_B, C_a, C_B):
+        # Corrects the aerodynamic coefficients (shape (N,6), ordered [CL, CD, CS, Cl, Cm, Cn]) for stall at many conditions at once
+
+        # Exponential blending model
+        if self._stall_model=="exponential":
+
+            # Blending coefficient
+            k = 100
+
+            # Get stall values
+            CS_stall = 0.2*S_B*S_B*C_B*np.sign(beta)
+            C_stall = np.array([2.0*S_a*S_a*C_a*np.sign(alpha), 1-C_a*S_a*np.sign(alpha), CS_stall, -CS_stall*0.05, -0.5*S_a, CS_stall*0.1]).T
+
+            # Blending functions
+            with np.errstate(over='ignore'):
+                lon_stall_weight = 1/(1+np.exp(-k*(-self._alpha_stall-alpha)))+1/(1+np.exp(-k*(alpha-self._alpha_stall)))
+                lat_stall_weight = 1/(1+np.exp(-k*(-self._beta_stall-beta)))+1/(1+np.exp(-k*(beta-self._beta_stall)))
+            weight = np.array([lon_stall_weight, lon_stall_weight, lat_stall_weight, lat_stall_weight, lon_stall_weight, lat_stall_weight]).T
+
+            # Blend
+            C = C*(1-weight)+C_stall*weight
+
+        return C
+
+
+    def dy_dt(self, t, **kwargs):
         """Calculates the derivative of the state vector with respect to time
         at the current state and time.
 
@@ -197,6 +350,12 @@ class BaseAircraft:
         t : float
             Current simulation time.
 
+        frozen : bool, optional
+            If True, the controls will be held at their current values rather than
+            being updated by the controller, and no time history used by the aerodynamic
+            model will be updated. Used when the derivatives are being probed (e.g.
+            for trim or linearization) rather than integrated. Defaults to False.
+
         Returns
         -------
         ndarray
@@ -204,7 +363,7 @@ class BaseAircraft:
         """
 
         # Get forces and moments
-        FM = self.get_FM(t)
+        FM = self.get_FM(t, **kwargs)
 
         # Extract state
         u = self.y[0]
@@ -254,6 +413,438 @@ class BaseAircraft:
         return dy
 
 
+    def get_jacobian(self, t):
+        """Calculates the Jacobians of the state derivative with respect to the state
+        and the controls at the current state, controls, and time. The controls are
+        held fixed. The base implementation uses central differences.
+
+        Parameters
+        ----------
+        t : float
+            Current simulation time.
+
+        Returns
+        -------
+        A : ndarray
+            Jacobian of dy_dt with respect to the state vector, shape (13, 13).
+
+        B : ndarray
+            Jacobian of dy_dt with respect to the controls, shape (13, n_controls). The columns
+            are ordered the same as the controls in the aircraft definition.
+        """
+        return self._finite_difference_jacobian(lambda t: self.dy_dt(t, frozen=True), t)
+
+
+    def _finite_difference_jacobian(self, fun, t):
+        # Calculates the derivatives of fun(t) with respect to the state and controls using central differences
+
+        # Store current state so it can be restored
+        y0 = copy.deepcopy(self.y)
+        controls0 = copy.deepcopy(self.controls)
+        hooked = self._hooked
+
+        # Perturb states
+        f0 = fun(t)
+        df_dy = np.zeros((len(f0), 13))
+        for i in range(13):
+            h = 1e-6*max(1.0, abs(y0[i]))
+            self.y = np.copy(y0)
+            self.y[i] += h
+            f_plus = fun(t)
+            self.y[i] -= 2.0*h
+            f_minus = fun(t)
+            df_dy[:,i] = (f_plus-f_minus)/(2.0*h)
+        self.y = y0
+
+        # Perturb controls
+        df_du = np.zeros((len(f0), len(self._control_names)))
+        for i, name in enumerate(self._control_names):
+            setting = controls0.get(name, 0.0)
+            h = 1e-6*max(1.0, abs(setting))
+            self.controls = copy.copy(controls0)
+            self.controls[name] = setting+h
+            f_plus = fun(t)
+            self.controls[name] = setting-h
+            f_minus = fun(t)
+            df_du[:,i] = (f_plus-f_minus)/(2.0*h)
+
+        # Restore
+        self.controls = controls0
+        self._hooked = hooked
+
+        return df_dy, df_du
+
+
+    def linearize(self, state=None, controls=None, **kwargs):
+        """Linearizes the equations of motion about the given state and control settings,
+        giving the state-space model d(dy)/dt = A*dy + B*du. Unless the analytic Jacobian
+        is used, the derivatives are found by central differences with all perturbed
+        conditions evaluated together (see dy_dt_batch()). The controls are held fixed at
+        the given settings. The aircraft state is not changed.
+
+        Parameters
+        ----------
+        state : ndarray, optional
+            State vector to linearize about. Defaults to the current state.
+
+        controls : dict, optional
+            Control settings to linearize about. Controls not given default to 0.0.
+            Defaults to the current control settings.
+
+        reduced : bool, optional
+            If True, the orientation will be given by the Euler angles rather than the
+            quaternion, giving the 12 states [u, v, w, p, q, r, x, y, z, phi, theta, psi]
+            (angles in radians). Defaults to False.
+
+        analytic : bool, optional
+            Whether to use the analytic Jacobian if this aircraft provides one. Defaults
+            to True.
+
+        step : float, optional
+            Relative step size used for central differences. Defaults to 1e-6.
+
+        processes : int, optional
+            Number of processes used to evaluate the perturbed conditions, for aircraft
+            which evaluate them in parallel. See dy_dt_batch().
+
+        t : float, optional
+            Simulation time. Defaults to 0.0.
+
+        Returns
+        -------
+        A : ndarray
+            State matrix, shape (13, 13), or (12, 12) if reduced.
+
+        B : ndarray
+            Control matrix, shape (13, n_controls), or (12, n_controls) if reduced. The
+            columns are ordered the same as the controls in the aircraft definition, with
+            angular controls per degree.
+        """
+
+        # Get reference condition
+        if state is None:
+            y0 = np.copy(self.y)
+        else:
+            y0 = np.array(state, dtype=float)
+        if controls is None:
+            controls = self.controls
+        u0 = np.array([controls.get(name, 0.0) for name in self._control_names], dtype=float)
+        t = kwargs.get("t", 0.0)
+
+        # Use analytic Jacobian
+        if kwargs.get("analytic", True) and self._analytic_jacobian:
+            y_prev = self.y
+            controls_prev = self.controls
+            self.y = y0
+            self.controls = dict(zip(self._control_names, u0))
+            A, B = self.get_jacobian(t)
+            self.y = y_prev
+            self.controls = controls_prev
+
+        # Perturb all states and controls up and down
+        else:
+            n = len(self._control_names)
+            step = kwargs.get("step", 1e-6)
+            h_y = step*np.maximum(1.0, np.abs(y0))
+            h_u = step*np.maximum(1.0, np.abs(u0))
+            states = np.tile(y0, (2*(13+n), 1))
+            control_vals = np.tile(u0, (2*(13+n), 1))
+            i = np.arange(13)
+            states[2*i,i] += h_y
+            states[2*i+1,i] -= h_y
+            j = np.arange(n)
+            control_vals[26+2*j,j] += h_u
+            control_vals[27+2*j,j] -= h_u
+
+            # Evaluate
+            f = self.dy_dt_batch(states, control_vals, t=t, processes=kwargs.get("processes", None))
+            A = ((f[0:26:2]-f[1:26:2])/(2.0*h_y[:,np.newaxis])).T
+            B = ((f[26::2]-f[27::2])/(2.0*h_u[:,np.newaxis])).T
+
+        if kwargs.get("reduced", False):
+            return self._reduce_linear_model(y0, A, B)
+        return A, B
+
+
+    def get_modal_eigenvalues(self, **kwargs):
+        """Returns the eigenvalues of the aircraft dynamics linearized about the current
+        state and controls, along with the eigenvalues of the heave mode of the aircraft
+        resting on its landing gear (if any), so the latter are accounted for even if the
+        gear is not currently in contact with the ground.
+
+        Parameters
+        ----------
+        kwargs
+            Passed to linearize().
+
+        Returns
+        -------
+        ndarray
+            Complex eigenvalues in 1/s.
+        """
+
+        # Get rigid-body modes
+        A, B = self.linearize(reduced=True, **kwargs)
+        eigenvalues = list(np.linalg.eigvals(A))
+
+        # Get landing gear contact mode, assuming all gear share the weight
+        if self._num_landing_gear > 0:
+            k = sum([gear._k for gear in self._landing_gear])
+            c = sum([gear._c for gear in self._landing_gear])
+            eigenvalues.extend(np.roots([self._W/self._g, c, k]))
+
+        return np.array(eigenvalues, dtype=complex)
+
+
+    def _reduce_linear_model(self, y0, A, B):
+        # Transforms a linear model in terms of the quaternion to one in terms of the Euler angles
+
+        # Get derivative of the quaternion with respect to the Euler angles
+        E0 = Quat2Euler(NormalizeQuaternion(y0[9:]))
+        dq_dE = np.zeros((4,3))
+        h = 1e-6
+        for i in range(3):
+            E_plus = np.array(E0)
+            E_plus[i] += h
+            E_minus = np.array(E0)
+            E_minus[i] -= h
+            dq_dE[:,i] = (np.array(Euler2Quat(E_plus))-np.array(Euler2Quat(E_minus)))/(2.0*h)
+
+        # The rate of change of the quaternion always lies in the space spanned by the Euler angle
+        # derivatives, so the pseudoinverse maps it back exactly
+        G = np.zeros((13,12))
+        G[:9,:9] = np.eye(9)
+        G[9:,9:] = dq_dE
+        P = np.zeros((12,13))
+        P[:9,:9] = np.eye(9)
+        P[9:,9:] = np.linalg.pinv(dq_dE)
+
+        return np.matmul(P, np.matmul(A, G)), np.matmul(P, B)
+
+
+    def dy_dt_batch(self, states, controls, **kwargs):
+        """Calculates the derivative of the state vector with respect to time at many
+        states and control settings at once. The controls are held at the given values
+        and no time history is updated (as with dy_dt(t, frozen=True)).
+
+        Parameters
+        ----------
+        states : ndarray
+            Array of state vectors, shape (N, 13).
+
+        controls : ndarray
+            Array of control settings, shape (N, n_controls). The columns are ordered
+            the same as the controls in the aircraft definition.
+
+        t : float, optional
+            Simulation time. Defaults to 0.0.
+
+        processes : int, optional
+            Number of processes to use, for aircraft which evaluate the conditions in
+            parallel. Defaults to the number of CPUs.
+
+        a_hat : ndarray, optional
+            Nondimensional rate of change of the angle of attack for each condition, for
+            aircraft which use it. Defaults to the current value for the aircraft.
+
+        B_hat : ndarray, optional
+            Nondimensional rate of change of the sideslip angle for each condition, for
+            aircraft which use it. Defaults to the current value for the aircraft.
+
+        Returns
+        -------
+        ndarray
+            Time rate of change of each state variable, shape (N, 13).
+        """
+
+        # Get forces and moments
+        states = np.atleast_2d(states)
+        controls = np.atleast_2d(controls)
+        FM = self._get_FM_batch(kwargs.get("t", 0.0), states, controls, processes=kwargs.get("processes", None), a_hat=kwargs.get("a_hat", None), B_hat=kwargs.get("B_hat", None))
+
+        # Extract state
+        u, v, w, p, q, r = states[:,:6].T
+        q0, qx, qy, qz = states[:,9:].T
+
+        # Apply Newton's equations
+        dy = np.zeros(states.shape)
+
+        # Linear acceleration
+        dy[:,0] = 2*self._g*(qx*qz-qy*q0) + self._m_inv*FM[:,0] + r*v-q*w
+        dy[:,1] = 2*self._g*(qy*qz+qx*q0) + self._m_inv*FM[:,1] + p*w-r*u
+        dy[:,2] = self._g*(qz*qz+q0*q0-qx*qx-qy*qy) + self._m_inv*FM[:,2] + q*u-p*v
+
+        # Angular acceleration
+        M = np.zeros((states.shape[0], 3))
+        M[:,0] = -self._hz*q + self._hy*r + FM[:,3] + self._I_diff_yz*q*r + self._I_yz*(q*q-r*r)+self._I_xz*p*q-self._I_xy*p*r
+        M[:,1] =  self._hz*p - self._hx*r + FM[:,4] + self._I_diff_zx*p*r + self._I_xz*(r*r-p*p)+self._I_xy*q*r-self._I_yz*p*q
+        M[:,2] = -self._hy*p + self._hx*q + FM[:,5] + self._I_diff_xy*p*q + self._I_xy*(p*p-q*q)+self._I_yz*p*r-self._I_xz*q*r
+        dy[:,3:6] = np.matmul(M, self._I_inv.T)
+
+        # Translation
+        Body2FixedArray(states[:,:3], states[:,9:], out=dy[:,6:9])
+
+        # Rotation
+        dy[:,9] = 0.5*(-qx*p-qy*q-qz*r)
+        dy[:,10] = 0.5*(q0*p-qz*q+qy*r)
+        dy[:,11] = 0.5*(qz*p+q0*q-qx*r)
+        dy[:,12] = 0.5*(-qy*p+qx*q+q0*r)
+
+        return dy
+
+
+    def _get_FM_batch(self, t, states, controls, **kwargs):
+        # Gives the forces and moments at each of the given states and control settings. The base
+        # implementation evaluates get_FM() at each condition in turn.
+
+        # Store current state so it can be restored
+        y_prev = self.y
+        controls_prev = self.controls
+        hooked = self._hooked
+
+        FM = np.zeros((states.shape[0], 6))
+        for i, (y, control_vals) in enumerate(zip(states, controls)):
+            self.y = np.copy(y)
+            self.controls = dict(zip(self._control_names, control_vals))
+            FM[i] = self.get_FM(t, frozen=True)
+
+        # Restore
+        self.y = y_prev
+        self.controls = controls_prev
+        self._hooked = hooked
+
+        return FM
+
+
+    def _get_aero_FM_batch(self, states, C, rho):
+        # Corrects the given coefficients (shape (N,6)) for stall and dimensionalizes them at each of the given states
+
+        # Get aerodynamic angles
+        u = states[:,0]
+        v = states[:,1]
+        w = states[:,2]
+        V = np.sqrt(u*u+v*v+w*w)
+        a = np.arctan2(w,u)
+        B = np.arcsin(v/V)
+        C_a = np.cos(a)
+        S_a = np.sin(a)
+        C_B = np.cos(B)
+        S_B = v/V
+
+        # Correct for stall
+        C = self._correct_stall_batch(C, a, B, S_a, S_B, C_a, C_B)
+        CL, CD, CS, Cl, Cm, Cn = C.T
+
+        # Apply aerodynamic angles and dimensionalize
+        redim = 0.5*rho*V*V*self._Sw
+        FM = np.zeros((states.shape[0], 6))
+        FM[:,0] = redim*(CL*S_a-CS*C_a*S_B-CD*C_a*C_B)
+        FM[:,1] = redim*(CS*C_B-CD*S_B)
+        FM[:,2] = redim*(-CL*C_a-CS*S_a*S_B-CD*S_a*C_B)
+        FM[:,3] = redim*Cl*self._bw
+        FM[:,4] = redim*Cm*self._cw
+        FM[:,5] = redim*Cn*self._bw
+
+        return FM
+
+
+    def _component_effects_batch(self, t, states, air_states, controls, rho):
+        # Gives the forces and moments due to engines, landing gear, etc. at each of the given states and control settings
+
+        FM = np.zeros((states.shape[0], 6))
+        if self._num_engines == 0 and self._num_landing_gear == 0 and not self._hooked:
+            return FM
+
+        # Store current state so it can be restored
+        y_prev = self.y
+        controls_prev = self.controls
+        hooked = self._hooked
+
+        for i, (y, y_air, control_vals) in enumerate(zip(states, air_states, controls)):
+            self.y = y
+            self.controls = dict(zip(self._control_names, control_vals))
+            self._hooked = hooked
+            vel = y_air[:3]
+            V = m.sqrt(vel[0]*vel[0]+vel[1]*vel[1]+vel[2]*vel[2])
+            FM[i] = self._component_effects(t, rho[i], vel/V, V)
+
+        # Restore
+        self.y = y_prev
+        self.controls = controls_prev
+        self._hooked = hooked
+
+        return FM
+
+
+    def _assemble_jacobian(self, dFM_dy, dFM_du):
+        # Calculates the Jacobians of dy_dt with respect to the state and controls given the
+        # derivatives of the forces and moments with respect to the same
+
+        # Extract state
+        u, v, w, p, q, r = self.y[:6]
+        q0, qx, qy, qz = self.y[9:]
+        g = self._g
+
+        A = np.zeros((13,13))
+
+        # Linear acceleration
+        A[0,1] = r
+        A[0,2] = -q
+        A[0,4] = -w
+        A[0,5] = v
+        A[0,9:] = [-2.0*g*qy, 2.0*g*qz, -2.0*g*q0, 2.0*g*qx]
+        A[1,0] = -r
+        A[1,2] = p
+        A[1,3] = w
+        A[1,5] = -u
+        A[1,9:] = [2.0*g*qx, 2.0*g*q0, 2.0*g*qz, 2.0*g*qy]
+        A[2,0] = q
+        A[2,1] = -p
+        A[2,3] = -v
+        A[2,4] = u
+        A[2,9:] = [2.0*g*q0, -2.0*g*qx, -2.0*g*qy, 2.0*g*qz]
+        A[:3] += self._m_inv*dFM_dy[:3]
+
+        # Angular acceleration
+        dM = np.zeros((3,13))
+        dM[0,3:6] = [self._I_xz*q-self._I_xy*r,
+                     -self._hz+self._I_diff_yz*r+2.0*self._I_yz*q+self._I_xz*p,
+                     self._hy+self._I_diff_yz*q-2.0*self._I_yz*r-self._I_xy*p]
+        dM[1,3:6] = [self._hz+self._I_diff_zx*r-2.0*self._I_xz*p-self._I_yz*q,
+                     self._I_xy*r-self._I_yz*p,
+                     -self._hx+self._I_diff_zx*p+2.0*self._I_xz*r+self._I_xy*q]
+        dM[2,3:6] = [-self._hy+self._I_diff_xy*q+2.0*self._I_xy*p+self._I_yz*r,
+                     self._hx+self._I_diff_xy*p-2.0*self._I_xy*q-self._I_xz*r,
+                     self._I_yz*p-self._I_xz*q]
+        dM += dFM_dy[3:]
+        A[3:6] = np.matmul(self._I_inv, dM)
+
+        # Translation
+        A[6:9,0] = Body2Fixed([1.0, 0.0, 0.0], self.y[9:])
+        A[6:9,1] = Body2Fixed([0.0, 1.0, 0.0], self.y[9:])
+        A[6:9,2] = Body2Fixed([0.0, 0.0, 1.0], self.y[9:])
+        A[6,9:] = [2.0*( q0*u-qz*v+qy*w), 2.0*( qx*u+qy*v+qz*w), 2.0*(-qy*u+qx*v+q0*w), 2.0*(-qz*u-q0*v+qx*w)]
+        A[7,9:] = [2.0*( qz*u+q0*v-qx*w), 2.0*( qy*u-qx*v-q0*w), 2.0*( qx*u+qy*v+qz*w), 2.0*( q0*u-qz*v+qy*w)]
+        A[8,9:] = [2.0*(-qy*u+qx*v+q0*w), 2.0*( qz*u+q0*v-qx*w), 2.0*(-q0*u+qz*v-qy*w), 2.0*( qx*u+qy*v+qz*w)]
+
+        # Rotation
+        A[9,3:6] = [-0.5*qx, -0.5*qy, -0.5*qz]
+        A[9,9:] = [0.0, -0.5*p, -0.5*q, -0.5*r]
+        A[10,3:6] = [0.5*q0, -0.5*qz, 0.5*qy]
+        A[10,9:] = [0.5*p, 0.0, 0.5*r, -0.5*q]
+        A[11,3:6] = [0.5*qz, 0.5*q0, -0.5*qx]
+        A[11,9:] = [0.5*q, -0.5*r, 0.0, 0.5*p]
+        A[12,3:6] = [-0.5*qy, 0.5*qx, 0.5*q0]
+        A[12,9:] = [0.5*r, 0.5*q, -0.5*p, 0.0]
+
+        # Controls only act through the forces and moments
+        B = np.zeros((13, dFM_du.shape[1]))
+        B[:3] = self._m_inv*dFM_du[:3]
+        B[3:6] = np.matmul(self._I_inv, dFM_du[3:])
+
+        return A, B
+
+
     def _get_elevation(self, alpha, beta, phi, gamma):
         # Calculates the elevation angle, theta, based on the other known angles
 
@@ -301,8 +892,23 @@ class BaseAircraft:
         self.y[9:] = NormalizeQuaternion(self.y[9:])
 
 
-    def _trim(self, trim_dict):
-        # Trims the aircraft at the given condition
+    def _trim(self, trim_dict, initial_guess=None):
+        # Trims the aircraft at the given condition. The initial guess is [alpha, beta, <trim controls>],
+        # with the angles in radians. Returns the trim settings, the residuals, and whether the solver converged.
+
+        # Get cache entry for this aircraft and trim condition
+        use_cache = trim_dict.get("cache", True)
+        if use_cache:
+            cache = DiskCache("trim", max_size=trim_dict.get("cache_max_size", 100.0), max_age=trim_dict.get("cache_max_age", 30.0))
+            condition = {}
+            for key in ["airspeed", "position", "climb_angle", "bank_angle", "heading", "trim_controls", "fixed_controls"]:
+                condition[key] = trim_dict.get(key, None)
+            atmosphere = {"turbulence" : None, "wind_field" : None}
+            if self._turbulence is not None:
+                atmosphere["turbulence"] = self._turbulence.get_stamp()
+            if self._wind_field is not None:
+                atmosphere["wind_field"] = self._wind_field.get_stamp()
+            cache_key = hash_content(self._input_dict, self._units, self._density_spec, condition, type(self).__name__, get_file_stamps(self._input_dict), atmosphere)
 
         # Get params
         self._V0 = trim_dict["airspeed"]
@@ -333,16 +939,44 @@ class BaseAircraft:
             header.append("{0:>20}".format("Elevation [deg]"))
             print("".join(header))
 
-        # Solve for trim
-        trim_val_guess = np.zeros(6)
-        x, info_dict, ier, mesg = opt.fsolve(self._trim_residual_function, trim_val_guess, full_output=True)
-        trim_settings = x
+        # Check for a previous solution
+        cached = None
+        if use_cache and not trim_dict.get("force_retrim", False):
+            cached = cache.load(cache_key)
 
-        # Output results of trim
-        if self._trim_verbose:
-            if ier != 1:
-                print("No trim solution found. Scipy returned '{0}'.".format(mesg))
-            print("\nFinal trim residuals: {0}".format(info_dict["fvec"]))
+        if cached is not None:
+            trim_settings = cached["trim_settings"]
+            residuals = cached["residuals"]
+            converged = cached["converged"]
+
+            if self._trim_verbose:
+                print("Loaded trim solution from {0}.".format(cache.path(cache_key)))
+                print("\nFinal trim residuals: {0}".format(residuals))
+
+        else:
+
+            # Solve for trim
+            if initial_guess is None:
+                trim_val_guess = np.zeros(6)
+            else:
+                trim_val_guess = np.array(initial_guess, dtype=float)
+            if self._analytic_jacobian:
+                x, info_dict, ier, mesg = opt.fsolve(self._trim_residual_function, trim_val_guess, fprime=self._trim_jacobian, full_output=True)
+            else:
+                x, info_dict, ier, mesg = opt.fsolve(self._trim_residual_function, trim_val_guess, full_output=True)
+            trim_settings = x
+            residuals = info_dict["fvec"]
+            converged = ier == 1
+
+            # Output results of trim
+            if self._trim_verbose:
+                if not converged:
+                    print("No trim solution found. Scipy returned '{0}'.".format(mesg))
+                print("\nFinal trim residuals: {0}".format(residuals))
+
+            # Store solution
+            if use_cache and converged:
+                cache.save(cache_key, {"trim_settings" : trim_settings, "residuals" : residuals, "converged" : converged})
 
         # Parse trimmed state
         alpha = trim_settings[0]
@@ -354,6 +988,8 @@ class BaseAircraft:
         # Set state
         self._set_state_in_coordinated_turn(alpha, beta, controls)
 
+        return trim_settings, residuals, converged
+
 
     def _trim_residual_function(self, trim_vals):
         # Returns the trim residuals as a function of the control inputs
@@ -376,13 +1012,53 @@ class BaseAircraft:
         self._set_state_in_coordinated_turn(alpha, beta, controls)
 
         # Get residuals
-        dy_dt = self.dy_dt(0.0)
+        dy_dt = self.dy_dt(0.0, frozen=True)
         return dy_dt[:6]
 
 
+    def _trim_jacobian(self, trim_vals):
+        # Returns the derivatives of the trim residuals with respect to the trim values
+
+        # Set state
+        alpha = trim_vals[0]
+        beta = trim_vals[1]
+        controls = copy.deepcopy(self._fixed_controls)
+        for i, name in enumerate(self._avail_controls):
+            controls[name] = trim_vals[i+2]
+        self._set_state_in_coordinated_turn(alpha, beta, controls)
+
+        # Get derivatives of the residuals with respect to the state and controls
+        A, B = self.get_jacobian(0.0)
+
+        # Get derivatives of the state with respect to alpha and beta (the state is a simple function of these, so
+        # finite differences are cheap)
+        J = np.zeros((6,6))
+        h = 1e-7
+        dy_dalpha = (self._get_coordinated_turn_state(alpha+h, beta)-self._get_coordinated_turn_state(alpha-h, beta))/(2.0*h)
+        dy_dbeta = (self._get_coordinated_turn_state(alpha, beta+h)-self._get_coordinated_turn_state(alpha, beta-h))/(2.0*h)
+        J[:,0] = np.matmul(A[:6], dy_dalpha)
+        J[:,1] = np.matmul(A[:6], dy_dbeta)
+
+        # Controls enter directly
+        for i, name in enumerate(self._avail_controls):
+            J[:,i+2] = B[:6,self._control_names.index(name)]
+
+        return J
+
+
     def _set_state_in_coordinated_turn(self, alpha, beta, controls):
 
         # Set state
+        self.y[:] = self._get_coordinated_turn_state(alpha, beta)
+
+        # Set controls
+        self.controls = controls
+
+
+    def _get_coordinated_turn_state(self, alpha, beta):
+        # Returns the state vector in the trim condition at the given aerodynamic angles
+
+        y = np.copy(self.y)
         theta = self._get_elevation(alpha, beta, self._bank, self._climb)
         C_theta = m.cos(theta)
         S_theta = m.sin(theta)
@@ -396,14 +1072,13 @@ class BaseAircraft:
         u = self._V0*C_a*C_B/D
         v = self._V0*C_a*S_B/D
         w = self._V0*S_a*C_B/D
-        self.y[0] = u
-        self.y[1] = v
-        self.y[2] = w
-        self.y[3:6] = self._get_rotation_rates(C_phi, S_phi, C_theta, S_theta, self._g, u, w)
-        self.y[9:] = Euler2Quat([self._bank, theta, self._heading])
+        y[0] = u
+        y[1] = v
+        y[2] = w
+        y[3:6] = self._get_rotation_rates(C_phi, S_phi, C_theta, S_theta, self._g, u, w)
+        y[9:] = Euler2Quat([self._bank, theta, self._heading])
 
-        # Set controls
-        self.controls = controls
+        return y
 
 
     def _initialize_state(self, param_dict):
@@ -467,6 +1142,8 @@ class BaseAircraft:
 
         # Set state
         pos[2] = -max_height
+        if self._terrain is not None:
+            pos[2] -= self._terrain.get_height(pos[0], pos[1])
         self.y[0] = 1e-10 # To keep the get_FM methods from crashing
         self.y[1:3] = 0.0
         self.y[3:6] = 0.0
@@ -489,17 +1166,85 @@ class BaseAircraft:
         self._launch_time = import_value("launch_time", bungee_dict, self._units, 0.0)
 
 
+    def _update_wind(self, t):
+        # Finds the velocity of the air (wind plus gusts) in body-fixed coordinates at the current state and time
+        if self._turbulence is not None:
+            self._wind = self._turbulence.get_gust(t)
+        if self._wind_field is not None:
+            wind = np.array(Fixed2Body(self._wind_field.get_wind(self.y[6], self.y[7], self.y[8], t), self.y[9:]))
+            self._wind = wind if self._turbulence is None else self._wind+wind
+
+
+    def _get_air_state(self, y):
+        # Gives the given state vector with the velocity taken relative to the air, using the current wind
+        if self._turbulence is None and self._wind_field is None:
+            return y
+        y_air = np.copy(y)
+        y_air[:3] -= self._wind
+        return y_air
+
+
+    def _get_air_states(self, t, states):
+        # Gives the given state vectors with the velocities taken relative to the air at each state
+        if self._turbulence is None and self._wind_field is None:
+            return states
+        air_states = np.copy(states)
+        if self._turbulence is not None:
+            air_states[:,:3] -= self._turbulence.get_gust(t)
+        if self._wind_field is not None:
+            air_states[:,:3] -= Fixed2BodyArray(self._wind_field.get_winds(states[:,6:9], t), states[:,9:])
+        return air_states
+
+
+    def _get_wind_derivs(self, t):
+        # Gives the derivatives of the body-fixed wind with respect to the state (through the position
+        # and orientation) at the current state and time, using central differences
+
+        dwind_dy = np.zeros((3,13))
+        if self._wind_field is None:
+            return dwind_dy
+
+        y0 = self.y
+        for i in range(6, 13):
+            h = 1e-3*max(1.0, abs(y0[i])) if i < 9 else 1e-6
+            self.y = np.copy(y0)
+            self.y[i] += h
+            self._update_wind(t)
+            wind_plus = self._wind
+            self.y[i] -= 2.0*h
+            self._update_wind(t)
+            dwind_dy[:,i] = (wind_plus-self._wind)/(2.0*h)
+
+        # Restore
+        self.y = y0
+        self._update_wind(t)
+
+        return dwind_dy
+
+
     def _component_effects(self, t, rho, u_inf, V):
         # Gives the forces and moments due to engines, landing gear, etc.
 
         # Get effect of engines
-        FM = np.zeros(6)
-        for engine in self._engines:
-            FM += engine.get_thrust_FM(self.controls, rho, u_inf, V)
+        if self._num_engines > 0:
+            FM = self._engine_bank.get_thrust_FM(self.controls, rho, u_inf, V)
+        else:
+            FM = np.zeros(6)
+
+        # Get effect of landing gear and bungee
+        FM += self._contact_effects(t, rho, u_inf, V)
+
+        return FM
+
+
+    def _contact_effects(self, t, rho, u_inf, V):
+        # Gives the forces and moments due to the landing gear and the bungee
 
         # Get effect of landing_gear
-        for gear in self._landing_gear:
-            FM += gear.get_landing_FM(self.y, self.controls, rho, u_inf, V)
+        if self._num_landing_gear > 0:
+            FM = self._landing_gear_set.get_landing_FM(self.y, self.controls, rho, u_inf, V, terrain=self._terrain)
+        else:
+            FM = np.zeros(6)
 
         # Get effect of bungee
         if self._hooked and t > self._launch_time:
@@ -530,7 +1275,7 @@ class BaseAircraft:
 
     # These methods must be defined in any derived class. Any of the preceding methods can also be redefined.
     @abstractmethod
-    def get_FM(self, t):
+    def get_FM(self, t, **kwargs):
         pass
 
 
@@ -551,18 +1296,14 @@ class LinearizedAirplane(BaseAircraft):
         Dictionary describing the airplane.
     """
 
-    def __init__(self, name, input_dict, density, units, param_dict, quit_flag, view_flag, pause_flag, data_flag, enable_interface):
-        super().__init__(name, input_dict, density, units, param_dict, quit_flag, view_flag, pause_flag, data_flag, enable_interface)
+    _analytic_jacobian = True
+
+    def __init__(self, name, input_dict, density, units, param_dict, quit_flag, view_flag, pause_flag, data_flag, enable_interface, **kwargs):
+        super().__init__(name, input_dict, density, units, param_dict, quit_flag, view_flag, pause_flag, data_flag, enable_interface, **kwargs)
 
         # Initialize density
         self._get_density = self._initialize_density(density)
 
-        # Read in coefficients
-        self._import_coefficients()
-
-        # Import reference params
-        self._import_reference_params()
-
         # Initialize accelerations
         self._t_prev = 0.0
         self._a_prev = None
@@ -574,6 +1315,17 @@ class LinearizedAirplane(BaseAircraft):
         self._initialize_state(param_dict)
 
 
+    def _import_definition(self):
+        # Imports the linearized aerodynamic model along with the mass properties and components
+        super()._import_definition()
+
+        # Read in coefficients
+        self._import_coefficients()
+
+        # Import reference params
+        self._import_reference_params()
+
+
     def _initialize_density(self, density):
         # Sets up the density getter
 
@@ -655,6 +1407,93 @@ class LinearizedAirplane(BaseAircraft):
             self._control_derivs[name]["Cl"] = derivs.get("Cl", 0.0)
             self._control_derivs[name]["Cn"] = derivs.get("Cn", 0.0)
 
+        # Compile into matrix form
+        self._compile_coefficients()
+
+
+    def _compile_coefficients(self):
+        # Arranges the coefficients and control derivatives into matrices so the coefficients
+        # [CL, CD, CS, Cl, Cm, Cn] (before the drag polar is applied) are given by
+        #
+        #   C = coef_matrix*[1, alpha, beta, p_bar, q_bar, r_bar, alpha_hat, beta_hat] + control_matrix*controls
+        #
+        # The control matrix is per degree of deflection, with columns in the same order as self._control_names.
+
+        self._coef_matrix = np.array([
+            [self._CL0, self._CL_a, 0.0,        0.0,        self._CL_q, 0.0,        self._CL_a_hat, 0.0           ],
+            [self._CD0, 0.0,        0.0,        0.0,        self._CD_q, 0.0,        self._CD_a_hat, 0.0           ],
+            [0.0,       0.0,        self._CS_b, self._CS_p, 0.0,        self._CS_r, 0.0,            self._CS_b_hat],
+            [0.0,       0.0,        self._Cl_b, self._Cl_p, 0.0,        self._Cl_r, 0.0,            self._Cl_b_hat],
+            [self._Cm0, self._Cm_a, 0.0,        0.0,        self._Cm_q, 0.0,        self._Cm_a_hat, 0.0           ],
+            [0.0,       0.0,        self._Cn_b, self._Cn_p, 0.0,        self._Cn_r, 0.0,            self._Cn_b_hat]
+        ])
+
+        self._num_controls = len(self._control_names)
+        self._control_matrix = np.zeros((6, self._num_controls))
+        for i, name in enumerate(self._control_names):
+            for j, coef in enumerate(["CL", "CD", "CS", "Cl", "Cm", "Cn"]):
+                self._control_matrix[j,i] = m.radians(self._control_derivs[name][coef])
+
+        # Preallocate storage for evaluation
+        self._aero_vars = np.zeros(8)
+        self._aero_vars[0] = 1.0
+        self._control_vec = np.zeros(self._num_controls)
+        self._coefs = np.zeros(6)
+
+
+    def _get_control_vector(self, controls):
+        # Arranges the control settings in the order used by the control matrix
+        return np.array([controls.get(name, 0.0) for name in self._control_names], dtype=float)
+
+
+    def _get_coefficients(self, aero_vars, control_vals):
+        # Evaluates the coefficients [CL, CD, CS, Cl, Cm, Cn] for any number of conditions
+        # given arrays of the aerodynamic variables (shape (..., 8)) and control settings
+        # (shape (..., n_controls))
+        C = np.matmul(aero_vars, self._coef_matrix.T)+np.matmul(control_vals, self._control_matrix.T)
+        CL = C[...,0]
+        CS = C[...,2]
+        C[...,1] += self._CD1*CL+self._CD2*CL*CL+self._CD3*CS*CS
+        return C
+
+
+    def evaluate_coefficients(self, states, controls):
+        """Evaluates the nondimensional aerodynamic coefficients at many states at once.
+        Acceleration terms (alpha_hat and beta_hat) are taken to be zero. No stall
+        correction is applied.
+
+        Parameters
+        ----------
+        states : ndarray
+            Array of state vectors, shape (N, 13).
+
+        controls : ndarray
+            Array of control settings, shape (N, n_controls). The columns are ordered
+            the same as the controls in the aircraft definition.
+
+        Returns
+        -------
+        ndarray
+            Array of coefficients, shape (N, 6), ordered [CL, CD, CS, Cl, Cm, Cn].
+        """
+
+        # Get aerodynamic variables
+        states = np.atleast_2d(states)
+        u = states[:,0]
+        v = states[:,1]
+        w = states[:,2]
+        V = np.sqrt(u*u+v*v+w*w)
+        const = 0.5/V
+        aero_vars = np.zeros((states.shape[0], 8))
+        aero_vars[:,0] = 1.0
+        aero_vars[:,1] = np.arctan2(w, u)
+        aero_vars[:,2] = np.arcsin(v/V)
+        aero_vars[:,3] = self._bw*states[:,3]*const
+        aero_vars[:,4] = self._cw*states[:,4]*const
+        aero_vars[:,5] = self._bw*states[:,5]*const
+
+        return self._get_coefficients(aero_vars, np.atleast_2d(controls))
+
 
     def _import_reference_params(self):
         # Parses the reference state from the input file
@@ -906,21 +1745,21 @@ class LinearizedAirplane(BaseAircraft):
             self.controls[key] = value
 
 
-    def get_FM(self, t):
+    def get_FM(self, t, **kwargs):
         """Returns the aerodynamic forces and moments."""
-        np.set_printoptions(precision=12)
 
         # Get control state
-        self.controls = self.controller.get_control(t, self.y, self.controls)
+        frozen = kwargs.get("frozen", False)
+        if not frozen:
+            self.controls = self.controller.get_control(t, self.y, self.controls)
 
         # Declare force and moment vector
         FM = np.zeros(6)
 
-        # Get states
+        # Get states, with the velocity relative to the air
+        self._update_wind(t)
         rho = self._get_density(-self.y[8])
-        u = self.y[0]
-        v = self.y[1]
-        w = self.y[2]
+        u, v, w = self.y[0:3]-self._wind
         p = self.y[3]
         q = self.y[4]
         r = self.y[5]
@@ -932,40 +1771,39 @@ class LinearizedAirplane(BaseAircraft):
         p_bar = self._bw*p*const
         q_bar = self._cw*q*const
         r_bar = self._bw*r*const
-        u_inf = self.y[0:3]*V_inv
+        u_inf = np.array([u, v, w])*V_inv
 
         # Get accelerations
-        dt = t-self._t_prev
-        if dt>1e-10 and self._a_prev is not None and self._B_prev is not None:
-            self._a_hat = 0.5*self._cw*V_inv*(a-self._a_prev)/dt
-            self._B_hat = 0.5*self._bw*V_inv*(B-self._B_prev)/dt
+        if not frozen:
+            dt = t-self._t_prev
+            if dt>1e-10 and self._a_prev is not None and self._B_prev is not None:
+                self._a_hat = 0.5*self._cw*V_inv*(a-self._a_prev)/dt
+                self._B_hat = 0.5*self._bw*V_inv*(B-self._B_prev)/dt
 
-        # Store for next evaluation
-        self._t_prev = t
-        self._a_prev = a
-        self._B_prev = B
+            # Store for next evaluation
+            self._t_prev = t
+            self._a_prev = a
+            self._B_prev = B
 
         # Get redimensionalizer
         redim = 0.5*rho*V*V*self._Sw
 
+        # Gather aerodynamic variables and controls
+        x = self._aero_vars
+        x[1] = a
+        x[2] = B
+        x[3] = p_bar
+        x[4] = q_bar
+        x[5] = r_bar
+        x[6] = self._a_hat
+        x[7] = self._B_hat
+        for i, name in enumerate(self._control_names):
+            self._control_vec[i] = self.controls.get(name, 0.0)
+
         # Determine coefficients without knowing final values for CL and CS
-        CL = self._CL0+self._CL_a*a+self._CL_q*q_bar+self._CL_a_hat*self._a_hat
-        CS = self._CS_b*B+self._CS_p*p_bar+self._CS_r*r_bar+self._CS_b_hat*self._B_hat
-        CD = self._CD0+self._CD_q*q_bar+self._CD_a_hat*self._a_hat
-        Cl = self._Cl_b*B+self._Cl_p*p_bar+self._Cl_r*r_bar+self._Cl_b_hat*self._B_hat
-        Cm = self._Cm0+self._Cm_a*a+self._Cm_q*q_bar+self._Cm_a_hat*self._a_hat
-        Cn = self._Cn_b*B+self._Cn_p*p_bar+self._Cn_r*r_bar+self._Cn_b_hat*self._B_hat
-
-        # Determine influence of controls
-        for key, value in self.controls.items():
-            control_deriv = self._control_derivs[key]
-            control_def = m.radians(value)
-            CL += control_def*control_deriv["CL"]
-            CD += control_def*control_deriv["CD"]
-            CS += control_def*control_deriv["CS"]
-            Cl += control_def*control_deriv["Cl"]
-            Cm += control_def*control_deriv["Cm"]
-            Cn += control_def*control_deriv["Cn"]
+        np.dot(self._coef_matrix, x, out=self._coefs)
+        self._coefs += np.dot(self._control_matrix, self._control_vec)
+        CL, CD, CS, Cl, Cm, Cn = self._coefs.tolist()
 
         # Factor in drag polar terms
         CD += self._CD1*CL+self._CD2*CL*CL+self._CD3*CS*CS
@@ -994,6 +1832,187 @@ class LinearizedAirplane(BaseAircraft):
         return FM
 
 
+    def get_jacobian(self, t):
+        """Calculates the Jacobians of the state derivative with respect to the state
+        and the controls at the current state, controls, and time. The aerodynamic and
+        engine contributions are evaluated analytically; landing gear and bungee
+        contributions use central differences. The acceleration terms (alpha_hat and
+        beta_hat) are held at their current values.
+
+        Parameters
+        ----------
+        t : float
+            Current simulation time.
+
+        Returns
+        -------
+        A : ndarray
+            Jacobian of dy_dt with respect to the state vector, shape (13, 13).
+
+        B : ndarray
+            Jacobian of dy_dt with respect to the controls (per degree of deflection or
+            unit of throttle), shape (13, n_controls). The columns are ordered the same
+            as the controls in the aircraft definition.
+        """
+
+        # Get states, with the velocity relative to the air
+        self._update_wind(t)
+        rho = self._get_density(-self.y[8])
+        vel = self.y[0:3]-self._wind
+        u, v, w = vel
+        p = self.y[3]
+        q = self.y[4]
+        r = self.y[5]
+        V = m.sqrt(u*u+v*v+w*w)
+        V_inv = 1.0/V
+        a = m.atan2(w,u)
+        B = m.asin(v/V)
+        const = 0.5*V_inv
+        u_inf = vel*V_inv
+
+        # Get derivatives of the aerodynamic angles with respect to the velocity
+        uw2_inv = 1.0/(u*u+w*w)
+        da_dvel = np.array([-w*uw2_inv, 0.0, u*uw2_inv])
+        C_B = m.cos(B)
+        dB_dvel = (np.array([0.0, 1.0, 0.0])-v*V_inv*u_inf)*V_inv/C_B
+
+        # Aerodynamic variables and their derivatives with respect to the state
+        x = np.copy(self._aero_vars)
+        x[1] = a
+        x[2] = B
+        x[3] = self._bw*p*const
+        x[4] = self._cw*q*const
+        x[5] = self._bw*r*const
+        x[6] = self._a_hat
+        x[7] = self._B_hat
+        dx_dy = np.zeros((8,13))
+        dx_dy[1,:3] = da_dvel
+        dx_dy[2,:3] = dB_dvel
+        dx_dy[3:6,:3] = -np.outer(x[3:6], u_inf*V_inv)
+        dx_dy[3,3] = self._bw*const
+        dx_dy[4,4] = self._cw*const
+        dx_dy[5,5] = self._bw*const
+
+        # Coefficients before the drag polar is applied
+        control_vec = self._get_control_vector(self.controls)
+        C = np.matmul(self._coef_matrix, x)+np.matmul(self._control_matrix, control_vec)
+        dC_dy = np.matmul(self._coef_matrix, dx_dy)
+        dC_du = np.copy(self._control_matrix)
+
+        # Factor in drag polar terms
+        polar = np.eye(6)
+        polar[1,0] += self._CD1+2.0*self._CD2*C[0]
+        polar[1,2] += 2.0*self._CD3*C[2]
+        C[1] += self._CD1*C[0]+self._CD2*C[0]*C[0]+self._CD3*C[2]*C[2]
+        dC_dy = np.matmul(polar, dC_dy)
+        dC_du = np.matmul(polar, dC_du)
+
+        # Correct for stall
+        C_a = m.cos(a)
+        S_a = w/u*C_a
+        S_B = v/V
+        dC_dC, dC_da, dC_dB = self._correct_stall_derivs(C, a, B, S_a, S_B, C_a, C_B)
+        C = np.array(self._correct_stall(*C, a, B, S_a, S_B, C_a, C_B))
+        dC_dy = dC_dC[:,np.newaxis]*dC_dy
+        dC_dy[:,:3] += np.outer(dC_da, da_dvel)+np.outer(dC_dB, dB_dvel)
+        dC_du = dC_dC[:,np.newaxis]*dC_du
+        CL, CD, CS, Cl, Cm, Cn = C
+
+        # Nondimensional forces and moments and their derivatives
+        f = np.array([CL*S_a-CS*C_a*S_B-CD*C_a*C_B,
+                      CS*C_B-CD*S_B,
+                      -CL*C_a-CS*S_a*S_B-CD*S_a*C_B,
+                      Cl*self._bw,
+                      Cm*self._cw,
+                      Cn*self._bw])
+        df_dC = np.zeros((6,6))
+        df_dC[0,:3] = [S_a, -C_a*C_B, -C_a*S_B]
+        df_dC[1,:3] = [0.0, -S_B, C_B]
+        df_dC[2,:3] = [-C_a, -S_a*C_B, -S_a*S_B]
+        df_dC[3,3] = self._bw
+        df_dC[4,4] = self._cw
+        df_dC[5,5] = self._bw
+        df_da = np.array([CL*C_a+CS*S_a*S_B+CD*S_a*C_B, 0.0, CL*S_a-CS*C_a*S_B-CD*C_a*C_B, 0.0, 0.0, 0.0])
+        df_dB = np.array([-CS*C_a*C_B+CD*C_a*S_B, -CS*S_B-CD*C_B, -CS*S_a*C_B+CD*S_a*S_B, 0.0, 0.0, 0.0])
+        df_dy = np.matmul(df_dC, dC_dy)
+        df_dy[:,:3] += np.outer(df_da, da_dvel)+np.outer(df_dB, dB_dvel)
+        df_du = np.matmul(df_dC, dC_du)
+
+        # Get redimensionalizer and its derivatives
+        redim = 0.5*rho*V*V*self._Sw
+        h = 1e-3*max(1.0, abs(self.y[8]))
+        drho_dz = (self._get_density(-self.y[8]-h)-self._get_density(-self.y[8]+h))/(2.0*h)
+        dredim_dy = np.zeros(13)
+        dredim_dy[:3] = rho*self._Sw*vel
+        dredim_dy[8] = 0.5*V*V*self._Sw*drho_dz
+
+        # Dimensionalize
+        dFM_dy = np.outer(f, dredim_dy)+redim*df_dy
+        dFM_du = redim*df_du
+
+        # Get effect of engines
+        if self._num_engines > 0:
+            dFM_dvel, dFM_drho, dFM_dtau = self._engine_bank.get_thrust_FM_derivs(self.controls, rho, u_inf, V)
+            dFM_dy[:,:3] += dFM_dvel
+            dFM_dy[:,8] += dFM_drho*drho_dz
+            for i, control in enumerate(self._engine_bank.control_names):
+                if control in self._control_names:
+                    dFM_du[:,self._control_names.index(control)] += dFM_dtau[:,i]
+
+        # Get effect of the wind varying with position and orientation. The aerodynamic and engine
+        # forces depend on the velocity only through the velocity relative to the air.
+        if self._wind_field is not None:
+            dFM_dy -= np.matmul(dFM_dy[:,:3], self._get_wind_derivs(t))
+
+        # Get effect of landing gear and bungee
+        if len(self._landing_gear) > 0 or self._hooked:
+            dFM_dy_contact, dFM_du_contact = self._finite_difference_jacobian(self._get_contact_FM, t)
+            dFM_dy += dFM_dy_contact
+            dFM_du += dFM_du_contact
+
+        return self._assemble_jacobian(dFM_dy, dFM_du)
+
+
+    def _get_contact_FM(self, t):
+        # Gives the forces and moments due to the landing gear and bungee at the current state
+        self._update_wind(t)
+        vel = self.y[:3]-self._wind
+        V = np.linalg.norm(vel)
+        return self._contact_effects(t, self._get_density(-self.y[8]), vel/V, V)
+
+
+    def _get_FM_batch(self, t, states, controls, **kwargs):
+        # Gives the forces and moments at each of the given states and control settings. The acceleration
+        # terms (alpha_hat and beta_hat) are held at their current values unless given.
+
+        # Get aerodynamic variables, with the velocities relative to the air
+        air_states = self._get_air_states(t, states)
+        u = air_states[:,0]
+        v = air_states[:,1]
+        w = air_states[:,2]
+        V = np.sqrt(u*u+v*v+w*w)
+        const = 0.5/V
+        aero_vars = np.zeros((states.shape[0], 8))
+        aero_vars[:,0] = 1.0
+        aero_vars[:,1] = np.arctan2(w, u)
+        aero_vars[:,2] = np.arcsin(v/V)
+        aero_vars[:,3] = self._bw*states[:,3]*const
+        aero_vars[:,4] = self._cw*states[:,4]*const
+        aero_vars[:,5] = self._bw*states[:,5]*const
+        a_hat = kwargs.get("a_hat", None)
+        B_hat = kwargs.get("B_hat", None)
+        aero_vars[:,6] = self._a_hat if a_hat is None else a_hat
+        aero_vars[:,7] = self._B_hat if B_hat is None else B_hat
+
+        # Get forces and moments
+        rho = np.array([self._get_density(-z) for z in states[:,8]])
+        C = self._get_coefficients(aero_vars, controls)
+        FM = self._get_aero_FM_batch(air_states, C, rho)
+        FM += self._component_effects_batch(t, states, air_states, controls, rho)
+
+        return FM
+
+
     def get_graphics_info(self):
         """Returns the .obj, .vs, .fs, and texture .jpg files for the aircraft."""
 
@@ -1029,8 +2048,8 @@ class MachUpXAirplane(BaseAircraft):
         Dictionary describing the airplane.
     """
 
-    def __init__(self, name, input_dict, density, units, param_dict, quit_flag, view_flag, pause_flag, data_flag, enable_interface):
-        super().__init__(name, input_dict, density, units, param_dict, quit_flag, view_flag, pause_flag, data_flag, enable_interface)
+    def __init__(self, name, input_dict, density, units, param_dict, quit_flag, view_flag, pause_flag, data_flag, enable_interface, **kwargs):
+        super().__init__(name, input_dict, density, units, param_dict, quit_flag, view_flag, pause_flag, data_flag, enable_interface, **kwargs)
 
         # Determine MachUpX solver params
         solver_params = self._input_dict["aero_model"].get("machupX_solver_params", {})
@@ -1057,46 +2076,194 @@ class MachUpXAirplane(BaseAircraft):
                 }
             }
         }
+        self._scene_dict = scene_dict
         self._mx_scene = mx.Scene(scene_dict)
 
         # Get reference params
         self._Sw, self._cw, self._bw = self._mx_scene.get_aircraft_reference_geometry(name)
 
         # Set initial state
+        self._async_solve = False
         self._initialize_state(param_dict)
 
+        # Hand the aerodynamics off to a separate process, if desired
+        if self._input_dict["aero_model"].get("asynchronous_solve", False):
+            self._start_async_solver()
+
+
+    def _start_async_solver(self):
+        # Starts the worker process which owns a copy of the MachUpX scene and solves
+        # for the aerodynamic coefficients while the physics loop integrates
+
+        # Get initial coefficients synchronously so the integration has something to start with
+        self._update_machupx_state()
+        self._async_coefs = self._mx_scene.solve_forces(dimensional=False, body_frame=True, wind_frame=True)[self.name]["total"]
+        self._t_coefs = 0.0
+        self._t_request = 0.0
+        self._solve_latency = 0.0
+        self._y_request = np.copy(self.y)
+        self._solve_pending = False
+        self.coefficient_staleness = 0.0
+
+        # Kick off worker
+        self._solver_conn, worker_conn = mp.Pipe()
+        self._solver_process = mp.Process(target=machupx_solver, args=(self._scene_dict, self.name, worker_conn))
+        self._solver_process.start()
+        self._async_solve = True
+
+
+    def _get_async_coefficients(self, t):
+        # Returns the most recent coefficients from the solver process and requests a new
+        # solution at the state the aircraft is predicted to have once that solution is ready
+
+        # Collect a finished solution
+        if self._solve_pending and self._solver_conn.poll():
+            self._t_coefs, self._async_coefs = self._solver_conn.recv()
+            self._solve_pending = False
+            self._solve_latency = max(t-self._t_request, 0.0)
+
+        # Request a new solution, extrapolating the state forward by the time the last solution took
+        if not self._solve_pending:
+            dt = t-self._t_request
+            if dt > 1e-10:
+                y_pred = self.y+(self.y-self._y_request)*(self._solve_latency/dt)
+            else:
+                y_pred = np.copy(self.y)
+            y_pred[9:] = NormalizeQuaternion(y_pred[9:])
+            self._solver_conn.send((t+self._solve_latency, self._get_machupx_state(self._get_air_state(y_pred)), copy.copy(self.controls)))
+            self._t_request = t
+            self._y_request = np.copy(self.y)
+            self._solve_pending = True
+
+        # Positive staleness means the coefficients describe a past state
+        self.coefficient_staleness = t-self._t_coefs
+
+        return self._async_coefs
+
+
+    def get_coefficient_staleness(self):
+        """Returns how far in the past (in simulation seconds) the state was at which the
+        aerodynamic coefficients currently in use were calculated. Negative values mean
+        the coefficients were calculated for a predicted future state. Always 0.0 unless
+        "asynchronous_solve" is enabled."""
+        if self._async_solve:
+            return self.coefficient_staleness
+        else:
+            return 0.0
+
+
+    def evaluate_coefficients(self, states, controls, processes=None):
+        """Evaluates the nondimensional aerodynamic coefficients predicted by MachUpX at
+        many states at once. The conditions are spread across a pool of processes, each
+        of which holds a single MachUpX scene for this aircraft geometry. Pools are shared
+        between all aircraft with the same geometry. No stall correction is applied.
+
+        Parameters
+        ----------
+        states : ndarray
+            Array of state vectors, shape (N, 13).
+
+        controls : ndarray
+            Array of control settings, shape (N, n_controls). The columns are ordered
+            the same as the controls in the aircraft definition.
+
+        processes : int, optional
+            Number of processes to use. If 1, the conditions will be solved serially using
+            this aircraft's scene. Defaults to the number of CPUs.
+
+        Returns
+        -------
+        ndarray
+            Array of coefficients, shape (N, 6), ordered [CL, CD, CS, Cl, Cm, Cn].
+        """
+
+        # Check inputs
+        states = np.atleast_2d(states)
+        controls = np.atleast_2d(controls)
+        N = states.shape[0]
+        if controls.shape[0] != N:
+            raise ValueError("Got {0} states but {1} control settings.".format(N, controls.shape[0]))
+
+        # Solve serially using our own scene
+        if processes == 1 or N == 1:
+            coefs = _solve_machupx_conditions(self._mx_scene, self.name, states, controls, self._control_names)
+            self._update_machupx_state()
+            return coefs
+
+        # Split into chunks so each process gets a few conditions at a time
+        if processes is None:
+            processes = mp.cpu_count()
+        pool = get_machupx_pool(self._scene_dict, self.name, processes)
+        N_chunks = min(N, 4*processes)
+        chunks = [(s, c, self._control_names) for s, c in zip(np.array_split(states, N_chunks), np.array_split(controls, N_chunks))]
+
+        return np.concatenate(pool.map(_solve_machupx_chunk, chunks))
+
+
+    def _get_FM_batch(self, t, states, controls, **kwargs):
+        # Gives the forces and moments at each of the given states and control settings, with the
+        # MachUpX solutions spread across a pool of processes
+
+        air_states = self._get_air_states(t, states)
+        rho = np.array([self._mx_scene._get_density(y[6:9]) for y in states])
+        C = self.evaluate_coefficients(air_states, controls, processes=kwargs.get("processes", None))
+        FM = self._get_aero_FM_batch(air_states, C, rho)
+        FM += self._component_effects_batch(t, states, air_states, controls, rho)
+
+        return FM
+
+
+    def finalize(self):
+        super().finalize()
+
+        # Shut down solver process
+        if self._async_solve:
+            self._solver_conn.send(None)
+            self._solver_process.join()
+            self._async_solve = False
+
+
+    def _get_machupx_state(self, y):
+        # Turns the given state vector into a MachUpX state dict
+        return {
+            "position" : list(y[6:9]),
+            "velocity" : list(y[0:3]),
+            "orientation" : list(y[9:]),
+            "angular_rates" : list(y[3:6])
+        }
+
 
     def _update_machupx_state(self):
-        # Passes the sim object state to MachUpX
+        # Passes the sim object state to MachUpX, with the velocity relative to the air
 
         # Set MachUpX state
-        mx_state = {
-            "position" : list(self.y[6:9]),
-            "velocity" : list(self.y[0:3]),
-            "orientation" : list(self.y[9:]),
-            "angular_rates" : list(self.y[3:6])
-        }
-        self._mx_scene.set_aircraft_state(state=mx_state, aircraft=self.name)
+        self._mx_scene.set_aircraft_state(state=self._get_machupx_state(self._get_air_state(self.y)), aircraft=self.name)
 
         # Update controls
         self._mx_scene.set_aircraft_control_state(control_state=self.controls, aircraft=self.name)
 
 
-    def get_FM(self, t):
+    def get_FM(self, t, **kwargs):
 
         # Initialize
         FM = np.zeros(6)
-        self.controls = self.controller.get_control(t, self.y, self.controls)
-        self._update_machupx_state()
+        frozen = kwargs.get("frozen", False)
+        if not frozen:
+            self.controls = self.controller.get_control(t, self.y, self.controls)
+        self._update_wind(t)
+
+        # Probing the derivatives requires the coefficients at exactly the current state
+        async_solve = self._async_solve and not frozen
+        if not async_solve:
+            self._update_machupx_state()
 
         # Get redimensionalizer
         rho = self._mx_scene._get_density(self.y[6:9])
-        u = self.y[0]
-        v = self.y[1]
-        w = self.y[2]
+        vel = self.y[0:3]-self._wind
+        u, v, w = vel
         V = m.sqrt(u*u+v*v+w*w)
         redim = 0.5*rho*V*V*self._Sw
-        u_inf = self.y[0:3]/V
+        u_inf = vel/V
         a = m.atan2(w,u)
         B = m.asin(u_inf[1])
         C_B = m.cos(B)
@@ -1105,7 +2272,10 @@ class MachUpXAirplane(BaseAircraft):
         S_a = w/u*C_a
 
         # Get MachUpX predicted coefficients
-        coefs = self._mx_scene.solve_forces(dimensional=False, body_frame=True, wind_frame=True)[self.name]["total"]
+        if async_solve:
+            coefs = self._get_async_coefficients(t)
+        else:
+            coefs = self._mx_scene.solve_forces(dimensional=False, body_frame=True, wind_frame=True)[self.name]["total"]
 
         # Correct for stall
         CL, CD, CS, Cl, Cm, Cn = self._correct_stall(coefs["CL"], coefs["CD"], coefs["CS"], coefs["Cl"], coefs["Cm"], coefs["Cn"], a, B, S_a, S_B, C_a, C_B)
@@ -1185,3 +2355,100 @@ class MachUpXAirplane(BaseAircraft):
         info["l_ref_lat"] = self._bw
 
         return info
+
+
+def machupx_solver(scene_dict, aircraft_name, connection):
+    """Solves for the aerodynamic coefficients of an aircraft on a separate process.
+    Waits for (time, state, controls) requests on the connection and sends back
+    (time, coefficients). Exits when None is received."""
+
+    # Create our own copy of the scene
+    import machupX as mx
+    scene = mx.Scene(scene_dict)
+
+    while True:
+
+        # Wait for a request
+        try:
+            request = connection.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+
+        # Solve
+        t, state, controls = request
+        scene.set_aircraft_state(state=state, aircraft=aircraft_name)
+        scene.set_aircraft_control_state(control_state=controls, aircraft=aircraft_name)
+        coefs = scene.solve_forces(dimensional=False, body_frame=True, wind_frame=True)[aircraft_name]["total"]
+
+        # Send back only what the physics needs
+        connection.send((t, {key : coefs[key] for key in ["CL", "CD", "CS", "Cl", "Cm", "Cn"]}))
+
+
+def _solve_machupx_conditions(scene, aircraft_name, states, controls, control_names):
+    # Solves for the coefficients at each given state and control setting using the given scene
+
+    coefs = np.zeros((states.shape[0], 6))
+    for i, (y, control_vals) in enumerate(zip(states, controls)):
+        state = {
+            "position" : list(y[6:9]),
+            "velocity" : list(y[0:3]),
+            "orientation" : list(y[9:]),
+            "angular_rates" : list(y[3:6])
+        }
+        scene.set_aircraft_state(state=state, aircraft=aircraft_name)
+        scene.set_aircraft_control_state(control_state=dict(zip(control_names, control_vals)), aircraft=aircraft_name)
+        solution = scene.solve_forces(dimensional=False, body_frame=True, wind_frame=True)[aircraft_name]["total"]
+        coefs[i] = [solution["CL"], solution["CD"], solution["CS"], solution["Cl"], solution["Cm"], solution["Cn"]]
+
+    return coefs
+
+
+# Scene owned by each process in a MachUpX pool
+_pool_scene = None
+_pool_aircraft_name = None
+
+# Pools of MachUpX processes, one per aircraft geometry
+_machupx_pools = {}
+
+
+def _initialize_machupx_pool_process(scene_dict, aircraft_name):
+    # Creates the scene for a single process in the pool
+    global _pool_scene, _pool_aircraft_name
+    import machupX as mx
+    _pool_scene = mx.Scene(scene_dict)
+    _pool_aircraft_name = aircraft_name
+
+
+def _solve_machupx_chunk(args):
+    # Solves a chunk of conditions on a process in the pool
+    states, controls, control_names = args
+    return _solve_machupx_conditions(_pool_scene, _pool_aircraft_name, states, controls, control_names)
+
+
+def get_machupx_pool(scene_dict, aircraft_name, processes=None):
+    """Returns a pool of processes, each of which holds a MachUpX scene created from
+    the given scene dict. Pools are created once per aircraft geometry and reused."""
+
+    # Identify the geometry
+    key = (json.dumps(scene_dict, sort_keys=True, default=str), aircraft_name, processes)
+
+    # Create the pool if it doesn't exist
+    pool = _machupx_pools.get(key, None)
+    if pool is None:
+        pool = mp.Pool(processes, initializer=_initialize_machupx_pool_process, initargs=(scene_dict, aircraft_name))
+        _machupx_pools[key] = pool
+
+    return pool
+
+
+def close_machupx_pools():
+    """Shuts down all MachUpX process pools."""
+    for pool in _machupx_pools.values():
+        pool.terminate()
+        pool.join()
+    _machupx_pools.clear()
+
+
+atexit.register(close_machupx_pools)
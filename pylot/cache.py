@@ -0,0 +1,191 @@
+"""Defines an on-disk cache for results which are expensive to compute (e.g. trim solutions)."""
+
+import os
+import json
+import time
+import pickle
+import hashlib
+
+
+def get_cache_dir():
+    """Returns the root directory of the Pylot cache. This is given by the environment
+    variable PYLOT_CACHE_DIR, if set, and ~/.cache/pylot otherwise."""
+    return os.environ.get("PYLOT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "pylot"))
+
+
+def hash_content(*args):
+    """Returns a hash of the given JSON-like objects. Dictionaries are hashed
+    independent of key order.
+
+    Parameters
+    ----------
+    args
+        Objects to hash. Objects which are not JSON serializable are hashed by their
+        string representation.
+
+    Returns
+    -------
+    str
+        Hexadecimal digest.
+    """
+    hasher = hashlib.sha256()
+    for arg in args:
+        hasher.update(json.dumps(arg, sort_keys=True, default=str).encode())
+    return hasher.hexdigest()
+
+
+def get_file_stamps(obj):
+    """Returns the path, modification time, and size of each existing file referenced
+    by a string in the given JSON-like object. Including these when hashing an input
+    means the hash changes when a referenced file (e.g. a data table) is modified.
+
+    Parameters
+    ----------
+    obj
+        Object to search for file paths.
+
+    Returns
+    -------
+    list
+        [path, modification time, size] for each file referenced.
+    """
+
+    # Search containers
+    if isinstance(obj, dict):
+        obj = list(obj.values())
+    if isinstance(obj, (list, tuple)):
+        stamps = []
+        for item in obj:
+            stamps += get_file_stamps(item)
+        return stamps
+
+    # Check for a file
+    if isinstance(obj, str) and os.path.isfile(obj):
+        stat = os.stat(obj)
+        return [[os.path.abspath(obj), stat.st_mtime, stat.st_size]]
+    return []
+
+
+class DiskCache:
+    """A directory of pickled results, each stored under a key. Entries are evicted
+    when they exceed the maximum age or when the total size of the cache exceeds the
+    maximum size, least-recently-used first.
+
+    Parameters
+    ----------
+    namespace : str
+        Name of the subdirectory of the cache directory to store entries in.
+
+    max_size : float, optional
+        Maximum total size of the entries in megabytes. Defaults to no limit.
+
+    max_age : float, optional
+        Maximum age of an entry since it was last used in days. Defaults to no limit.
+    """
+
+    def __init__(self, namespace, **kwargs):
+
+        # Store params
+        self._dir = os.path.join(get_cache_dir(), namespace)
+        self._max_size = kwargs.get("max_size", None)
+        self._max_age = kwargs.get("max_age", None)
+
+
+    def path(self, key, ext=".pkl"):
+        """Returns the path to the file storing the entry with the given key."""
+        return os.path.join(self._dir, key+ext)
+
+
+    def load(self, key):
+        """Returns the entry stored under the given key, or None if there is no such entry."""
+
+        # Check for entry
+        filename = self.path(key)
+        try:
+            entry_file = open(filename, 'rb')
+        except OSError:
+            return None
+
+        # Unpickle. Entries which are corrupt or were stored by another version of Pylot may raise
+        # almost anything (e.g. a class which no longer exists), so any failure is treated as a miss.
+        try:
+            with entry_file:
+                value = pickle.load(entry_file)
+        except Exception:
+            self._remove(filename)
+            return None
+
+        # Mark as used
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+
+        return value
+
+
+    def save(self, key, value):
+        """Stores the given value under the given key, then evicts any expired entries."""
+
+        # Write to a temporary file first so other processes never see a partial entry
+        try:
+            os.makedirs(self._dir, exist_ok=True)
+            filename = self.path(key)
+            temp_filename = "{0}.{1}.tmp".format(filename, os.getpid())
+            with open(temp_filename, 'wb') as entry_file:
+                pickle.dump(value, entry_file)
+            os.replace(temp_filename, filename)
+        except OSError:
+            return
+
+        self.evict()
+
+
+    def evict(self):
+        """Removes entries exceeding the maximum age, then the least-recently-used entries
+        until the cache is within the maximum size."""
+
+        if self._max_size is None and self._max_age is None:
+            return
+
+        # Get entries
+        try:
+            entries = []
+            for filename in os.listdir(self._dir):
+                path = os.path.join(self._dir, filename)
+                stat = os.stat(path)
+                entries.append([stat.st_mtime, stat.st_size, path])
+        except OSError:
+            return
+        entries.sort()
+
+        # Remove old entries
+        if self._max_age is not None:
+            cutoff = time.time()-self._max_age*86400.0
+            while len(entries) > 0 and entries[0][0] < cutoff:
+                self._remove(entries.pop(0)[2])
+
+        # Remove least-recently-used entries
+        if self._max_size is not None:
+            total_size = sum([entry[1] for entry in entries])
+            while len(entries) > 0 and total_size > self._max_size*1.0e6:
+                mtime, size, path = entries.pop(0)
+                self._remove(path)
+                total_size -= size
+
+
+    def clear(self):
+        """Removes all entries."""
+        try:
+            for filename in os.listdir(self._dir):
+                self._remove(os.path.join(self._dir, filename))
+        except OSError:
+            pass
+
+
+    def _remove(self, path):
+        # Deletes the given file, ignoring files already removed by another process
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -1,4 +1,4 @@
-from .helpers import import_value, Body2Fixed, Fixed2Body, Quat2Euler, cross
+from .helpers import import_value, Body2Fixed, Fixed2Body, Quat2Euler, Quat2Matrix, cross
 from .std_atmos import statee, statsi
 import numpy as np
 import math as m
@@ -109,6 +109,60 @@ class Engine:
         return FM
 
 
+    def get_thrust_FM_derivs(self, controls, rho, u_inf, V):
+        """Returns the derivatives of the forces and moments due to this engine.
+
+        Parameters
+        ----------
+        controls : dict
+            Dictionary of control settings.
+
+        rho : float
+            Air density.
+
+        u_inf : ndarray
+            Freestream direction vector.
+
+        V : float
+            Airspeed.
+
+        Returns
+        -------
+        dFM_dvel : ndarray
+            Derivatives of the forces and moments with respect to the body-fixed velocity components, shape (6,3).
+
+        dFM_drho : ndarray
+            Derivatives of the forces and moments with respect to air density.
+
+        dFM_dtau : ndarray
+            Derivatives of the forces and moments with respect to the throttle setting.
+        """
+
+        # Get throttle setting
+        tau = controls.get(self._control, 0.0)
+
+        # Thrust and its derivatives
+        density_ratio = (rho/self._rho0)**self._a
+        T_V = self._T0+self._T1*V+self._T2*V*V
+        dT_dV = tau*density_ratio*(self._T1+2.0*self._T2*V)
+        dT_drho = tau*self._a*density_ratio/rho*T_V
+        dT_dtau = density_ratio*T_V
+
+        # Drag is -0.5*rho*V*drag_param*velocity
+        dF_dvel = np.outer(self._direction, dT_dV*u_inf)-0.5*rho*self._drag_param*(V*np.eye(3)+np.outer(V*u_inf, u_inf))
+        dF_drho = dT_drho*self._direction-0.5*V*V*self._drag_param*u_inf
+        dF_dtau = dT_dtau*self._direction
+
+        # Add moments
+        dFM_dvel = np.zeros((6,3))
+        dFM_dvel[:3] = dF_dvel
+        dFM_dvel[3:] = np.cross(self._r, dF_dvel, axisb=0).T
+        dFM_drho = np.concatenate((dF_drho, cross(self._r, dF_drho)))
+        dFM_dtau = np.concatenate((dF_dtau, cross(self._r, dF_dtau)))
+
+        return dFM_dvel, dFM_drho, dFM_dtau
+
+
     def get_unit_thrust_moment(self):
         """Returns the thrust moment vector assuming a thrust magnitude of unity.
         """
@@ -133,6 +187,165 @@ class Engine:
             return np.zeros(3)
 
 
+class EngineBank:
+    """All the engines of an aircraft. The engine parameters are stored as arrays so the
+    total thrust force and moment can be found for all engines at once.
+
+    Parameters
+    ----------
+    engines : list
+        Engine objects making up the bank.
+    """
+
+    def __init__(self, engines):
+
+        # Stack engine params
+        self.engines = list(engines)
+        self.num_engines = len(self.engines)
+        self._direction = np.array([engine._direction for engine in self.engines], dtype=float).reshape((self.num_engines, 3))
+        self._r = np.array([engine._r for engine in self.engines], dtype=float).reshape((self.num_engines, 3))
+        self._unit_moment = np.cross(self._r, self._direction)
+
+        # Matrices taking the cross product of each engine position with a vector
+        self._r_cross = np.zeros((self.num_engines, 3, 3))
+        self._r_cross[:,0,1] = -self._r[:,2]
+        self._r_cross[:,0,2] = self._r[:,1]
+        self._r_cross[:,1,0] = self._r[:,2]
+        self._r_cross[:,1,2] = -self._r[:,0]
+        self._r_cross[:,2,0] = -self._r[:,1]
+        self._r_cross[:,2,1] = self._r[:,0]
+        self._T0 = np.array([engine._T0 for engine in self.engines], dtype=float)
+        self._T1 = np.array([engine._T1 for engine in self.engines], dtype=float)
+        self._T2 = np.array([engine._T2 for engine in self.engines], dtype=float)
+        self._a = np.array([engine._a for engine in self.engines], dtype=float)
+        self._rho0 = np.array([engine._rho0 for engine in self.engines], dtype=float)
+
+        # If all the engines have the same density exponent and reference density, the density ratio need only be found once
+        self._shared_density_ratio = self.num_engines > 0 and (self._a == self._a[0]).all() and (self._rho0 == self._rho0[0]).all()
+
+        # Get drag
+        self._drag_params = np.array([engine._drag_param for engine in self.engines], dtype=float)
+        self._drag_param = np.sum(self._drag_params)
+
+        # Get controls. Engines on the same control share a column of the selection matrix.
+        self.control_names = []
+        for engine in self.engines:
+            if engine._control not in self.control_names:
+                self.control_names.append(engine._control)
+        self._control_index = np.array([self.control_names.index(engine._control) for engine in self.engines], dtype=int)
+        self._control_selection = np.zeros((len(self.control_names), self.num_engines))
+        self._control_selection[self._control_index, np.arange(self.num_engines)] = 1.0
+
+
+    def _get_density_ratio(self, rho):
+        # Returns the density correction to the thrust of each engine
+        if self._shared_density_ratio:
+            return (rho/self._rho0[0])**self._a[0]
+        else:
+            return (rho/self._rho0)**self._a
+
+
+    def get_thrust_FM(self, controls, rho, u_inf, V):
+        """Returns the total forces and moments due to thrust from all engines.
+
+        Parameters
+        ----------
+        controls : dict
+            Dictionary of control settings.
+
+        rho : float
+            Air density.
+
+        u_inf : ndarray
+            Freestream direction vector.
+
+        V : float
+            Airspeed.
+
+        Returns
+        -------
+        FM : ndarray
+            Forces and moments due to thrust.
+        """
+
+        FM = np.zeros(6)
+
+        # Get throttle settings
+        tau = np.array([controls.get(name, 0.0) for name in self.control_names])[self._control_index]
+
+        # Calculate thrust magnitudes
+        T = tau*self._get_density_ratio(rho)*(self._T0+self._T1*V+self._T2*V*V)
+
+        # Get force on each engine, adding drag
+        F = T[:,np.newaxis]*self._direction+np.outer(self._drag_params, -0.5*rho*V*V*u_inf)
+
+        # Sum forces and moments engine by engine, so symmetric engines cancel exactly
+        FM[:3] = F.sum(axis=0)
+        FM[3:] = np.matmul(self._r_cross, F[:,:,np.newaxis]).sum(axis=0)[:,0]
+
+        return FM
+
+
+    def get_thrust_FM_derivs(self, controls, rho, u_inf, V):
+        """Returns the derivatives of the total forces and moments due to all engines.
+
+        Parameters
+        ----------
+        controls : dict
+            Dictionary of control settings.
+
+        rho : float
+            Air density.
+
+        u_inf : ndarray
+            Freestream direction vector.
+
+        V : float
+            Airspeed.
+
+        Returns
+        -------
+        dFM_dvel : ndarray
+            Derivatives of the forces and moments with respect to the body-fixed velocity components, shape (6,3).
+
+        dFM_drho : ndarray
+            Derivatives of the forces and moments with respect to air density.
+
+        dFM_dtau : ndarray
+            Derivatives of the forces and moments with respect to each of the controls in
+            control_names, shape (6,N_controls).
+        """
+
+        # Get throttle settings
+        tau = np.array([controls.get(name, 0.0) for name in self.control_names])[self._control_index]
+
+        # Thrust and its derivatives
+        density_ratio = self._get_density_ratio(rho)
+        T_V = self._T0+self._T1*V+self._T2*V*V
+        dT_dV = tau*density_ratio*(self._T1+2.0*self._T2*V)
+        dT_drho = tau*self._a*density_ratio/rho*T_V
+        dT_dtau = density_ratio*T_V
+
+        # Drag is -0.5*rho*V*drag_param*velocity
+        dD_dvel = -0.5*rho*(V*np.eye(3)+np.outer(V*u_inf, u_inf))
+        dD_drho = -0.5*V*V*u_inf
+
+        # Velocity derivatives
+        dFM_dvel = np.zeros((6,3))
+        dFM_dvel[:3] = np.outer(np.matmul(dT_dV, self._direction), u_inf)+self._drag_param*dD_dvel
+        dFM_dvel[3:] = np.outer(np.matmul(dT_dV, self._unit_moment), u_inf)+np.matmul(self._r_cross, self._drag_params[:,np.newaxis,np.newaxis]*dD_dvel).sum(axis=0)
+
+        # Density derivatives
+        dFM_drho = np.concatenate((np.matmul(dT_drho, self._direction)+self._drag_param*dD_drho,
+                                   np.matmul(dT_drho, self._unit_moment)+np.matmul(self._r_cross, np.outer(self._drag_params, dD_drho)[:,:,np.newaxis]).sum(axis=0)[:,0]))
+
+        # Control derivatives
+        dT_dtau = self._control_selection*dT_dtau
+        dFM_dtau = np.concatenate((np.matmul(dT_dtau, self._direction), np.matmul(dT_dtau, self._unit_moment)), axis=1).T
+
+        return dFM_dvel, dFM_drho, dFM_dtau
+
+
 class LandingGear:
     """A single landing gear for an aircraft
 
@@ -239,3 +452,193 @@ class LandingGear:
         FM[3:] = cross(self._pos-self._aircraft_CG, FM[:3])
 
         return FM
+
+
+class LandingGearSet:
+    """All the landing gear of an aircraft. The struts are stored as arrays so the
+    contact forces on every strut can be found at once using a single rotation matrix.
+
+    Parameters
+    ----------
+    landing_gear : list
+        LandingGear objects making up the set.
+
+    CG : vector
+        Location of the aircraft CG in body-fixed coordinates.
+    """
+
+    def __init__(self, landing_gear, CG):
+
+        # Stack strut params
+        self.landing_gear = list(landing_gear)
+        self.num_gear = len(self.landing_gear)
+        self._pos = np.array([gear._pos for gear in self.landing_gear], dtype=float).reshape((self.num_gear, 3))
+        self._r_CG = self._pos-np.asarray(CG, dtype=float)
+        self._k = np.array([gear._k for gear in self.landing_gear], dtype=float)
+        self._c = np.array([gear._c for gear in self.landing_gear], dtype=float)
+        self._u_f_roll = np.array([gear._u_f_roll for gear in self.landing_gear], dtype=float)
+        self._u_f_slid = np.array([gear._u_f_slid for gear in self.landing_gear], dtype=float)
+
+        # No strut tip can be farther below the body-fixed origin than this, whatever the orientation
+        if self.num_gear > 0:
+            self._tip_radius = np.max(np.linalg.norm(self._pos, axis=1))
+        else:
+            self._tip_radius = -np.inf
+
+        # Get drag
+        self._drag_params = np.array([gear._drag_param for gear in self.landing_gear], dtype=float)
+
+        # Get steering
+        self._steered = []
+        for i, gear in enumerate(self.landing_gear):
+            if gear._steer_cntrl is not None:
+                self._steered.append((i, gear._steer_cntrl, gear._steer_orient))
+
+
+    def get_clearance(self, y, terrain=None):
+        """Returns the height of the lowest strut tip above the ground, which is negative
+        if a strut has reached the ground.
+
+        Parameters
+        ----------
+        y : list
+            State vector of aircraft.
+
+        terrain : Terrain, optional
+            Terrain the aircraft is over. Defaults to flat ground at z = 0.
+        """
+
+        R = Quat2Matrix(y[9:])
+        z_tip = np.matmul(self._pos, R[2])+y[8]
+        if terrain is None:
+            return -np.max(z_tip)
+        x_tip = np.matmul(self._pos, R[0])+y[6]
+        y_tip = np.matmul(self._pos, R[1])+y[7]
+        h, n = terrain.get_heights_and_normals(x_tip, y_tip)
+        return -np.max(z_tip+h)
+
+
+    def get_landing_FM(self, y, controls, rho, u_inf, V, terrain=None):
+        """Returns the total forces and moments generated by the landing gear.
+
+        Parameters
+        ----------
+        y : list
+            State vector of aircraft.
+
+        controls : dict
+            Control settings.
+
+        rho : float
+            Air density.
+
+        u_inf : vector
+            Freestream direction in body-fixed coordinates.
+
+        V : float
+            Freestream velocity.
+
+        terrain : Terrain, optional
+            Terrain the aircraft is over. Defaults to flat ground at z = 0.
+
+        Returns
+        -------
+        FM : ndarray
+            Forces and moments due to landing interactions.
+        """
+
+        FM = np.zeros(6)
+
+        # Get drag on each strut
+        F = np.outer(self._drag_params, -0.5*rho*V*V*u_inf)
+
+        # Determine how low the aircraft must be for a strut to possibly reach the ground
+        if terrain is None:
+            z_min = -self._tip_radius
+        else:
+            z_min = -self._tip_radius-terrain.max_elevation
+
+        # Determine which struts are interacting with the ground. The rotation is only needed
+        # if the aircraft is low enough for a strut to possibly reach the ground.
+        if y[8] > z_min:
+            q = y[9:]
+            R = Quat2Matrix(q)
+            z_tip = np.matmul(self._pos, R[2])+y[8]
+
+            # Get ground height and normal below each tip
+            if terrain is None:
+                depth = z_tip
+            else:
+                x_tip = np.matmul(self._pos, R[0])+y[6]
+                y_tip = np.matmul(self._pos, R[1])+y[7]
+                h, n = terrain.get_heights_and_normals(x_tip, y_tip)
+                depth = -n[:,2]*(z_tip+h)
+
+            in_contact = depth > 0.0
+            if in_contact.any():
+
+                # Determine velocity of the tips in Earth-fixed coordinates
+                p, q_rate, r = y[3:6]
+                x, y_pos, z = self._pos.T
+                v_tip = np.empty((self.num_gear, 3))
+                v_tip[:,0] = q_rate*z-r*y_pos+y[0]
+                v_tip[:,1] = r*x-p*z+y[1]
+                v_tip[:,2] = p*y_pos-q_rate*x+y[2]
+                v_tip_f = np.matmul(v_tip, R.T)
+
+                # Determine how fast the depth is changing
+                if terrain is None:
+                    velocity = v_tip_f[:,2]
+                else:
+                    velocity = -np.sum(v_tip_f*n, axis=1)
+
+                # Determine normal force exerted by the shocks (zero for struts off the ground)
+                N = (depth*self._k+velocity*self._c*(velocity > 0.0))*in_contact
+
+                # Determine the direction the wheels are pointing
+                psi = np.full(self.num_gear, Quat2Euler(q)[2])
+                for i, control, orient in self._steered:
+                    psi[i] += orient*m.radians(controls.get(control, 0.0))
+                C_psi = np.cos(psi)
+                S_psi = np.sin(psi)
+                u_roll = np.zeros((self.num_gear, 3))
+                u_roll[:,0] = C_psi
+                u_roll[:,1] = S_psi
+                u_slid = np.zeros((self.num_gear, 3))
+                u_slid[:,0] = -S_psi
+                u_slid[:,1] = C_psi
+
+                # Tilt the rolling and sliding directions into the slope of the terrain
+                if terrain is not None:
+                    u_roll -= np.sum(u_roll*n, axis=1)[:,np.newaxis]*n
+                    u_roll /= np.linalg.norm(u_roll, axis=1)[:,np.newaxis]
+                    u_slid -= np.sum(u_slid*n, axis=1)[:,np.newaxis]*n
+                    u_slid /= np.linalg.norm(u_slid, axis=1)[:,np.newaxis]
+
+                # Determine rolling and sliding velocities
+                v_roll = np.sum(v_tip_f*u_roll, axis=1)
+                v_slid = np.sum(v_tip_f*u_slid, axis=1)
+
+                # Determine forces on the wheels
+                F_roll = self._u_f_roll*N*np.sign(v_roll)
+                F_slid = self._u_f_slid*N*np.sign(v_slid)
+                F_f = -F_roll[:,np.newaxis]*u_roll-F_slid[:,np.newaxis]*u_slid
+                if terrain is None:
+                    F_f[:,2] -= N
+                else:
+                    F_f += N[:,np.newaxis]*n
+
+                # Add the ground forces in body-fixed coordinates
+                F += np.matmul(F_f, R)
+
+        # Sum forces and moments strut by strut, so symmetric gear cancels exactly
+        Fx, Fy, Fz = F.T
+        x, y_pos, z = self._r_CG.T
+        FM[0] = Fx.sum()
+        FM[1] = Fy.sum()
+        FM[2] = Fz.sum()
+        FM[3] = (y_pos*Fz-z*Fy).sum()
+        FM[4] = (z*Fx-x*Fz).sum()
+        FM[5] = (x*Fy-y_pos*Fx).sum()
+
+        return FM
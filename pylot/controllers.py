@@ -469,6 +469,11 @@ class TimeSequenceController(BaseController):
         self._t_end = np.max(self._control_data[:,0])
 
 
+    def get_end_time(self):
+        """Returns the last time given in the control file."""
+        return self._t_end
+
+
     def get_control(self, t, state_vec, prev_controls):
         """Returns the controls based on the inputted state.
 
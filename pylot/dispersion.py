@@ -0,0 +1,496 @@
+"""Runs Monte Carlo dispersions of a simulation over uncertain aircraft parameters, initial states, and control inputs."""
+
+import copy
+import json
+
+import numpy as np
+import multiprocessing as mp
+
+from pylot.physics import load_headless_aircraft, get_integrator
+from pylot.controllers import TimeSequenceController
+from pylot.helpers import NormalizeQuaternionArray
+from pylot.termination import TerminationCriteria, TERMINATION_REASONS
+
+
+def run_dispersion(input_val, dispersions, N_samples, **kwargs):
+    """Runs the simulation described by the input many times with parameters drawn
+    from the given distributions and gives statistics of the state over time. The
+    statistics are accumulated as each run finishes, so the individual trajectories
+    are never all held in memory.
+
+    If the aircraft uses the linearized aerodynamic model, only its initial condition
+    and control tape are dispersed, and the controller is a control tape (or none),
+    the runs are integrated together as one ensemble. Otherwise, the runs are spread
+    across a pool of processes.
+
+    Parameters
+    ----------
+    input_val : dict or str
+        Simulation input (or path to the input JSON). The graphics are not used. The
+        timestep is given by "timestep" under "simulation" (not in real time) and
+        "final_time" must be given.
+
+    dispersions : dict
+        Distributions to draw parameters from. The keys are paths to numeric values.
+        Paths beginning with "input." are within the simulation input, paths
+        beginning with "definition." are within the aircraft definition, and paths
+        "tape.<CONTROL_NAME>" are constant offsets added to that control in the control
+        tape. Keys and list indices are separated by "." (e.g.
+        "input.aircraft.initial_state.velocity.0" or "definition.inertia.Ixx"). Each
+        value is a dict with the key "distribution" ("normal", "uniform", or "choice")
+        and the parameters "std" (normal), "low" and "high" (uniform), or "values"
+        (choice). The optional key "mode" determines how the draw is applied and can
+        be "offset" (added to the nominal value, the default), "scale" (multiplies the
+        nominal value), or "absolute" (replaces the nominal value).
+
+    N_samples : int
+        Number of runs.
+
+    seed : int, optional
+        Seed for drawing the parameters. Defaults to 0.
+
+    percentiles : list, optional
+        Percentiles of each state to estimate at each output time. Defaults to [5, 50, 95].
+
+    output_interval : float, optional
+        Time between outputs. Rounded to a multiple of the timestep. Defaults to the timestep.
+
+    processes : int, optional
+        Number of processes to use if the runs cannot be integrated as an ensemble.
+        Defaults to the number of CPUs.
+
+    batch_size : int, optional
+        Number of runs to integrate together at a time as an ensemble. Defaults to 256.
+
+    ensemble : bool, optional
+        Whether the runs may be integrated as an ensemble. Defaults to True.
+
+    Returns
+    -------
+    dict
+        "time" : output times, shape (N_times,). "mean", "std", "min", "max" : statistics
+        of the 13-element state vector at each output time, shape (N_times, 13).
+        "percentiles" : dict of the requested percentiles, each shape (N_times, 13).
+        "samples" : dict of the drawn values for each dispersion, each shape (N_samples,).
+        "diverged" : whether each run failed (these are excluded from the statistics).
+        "termination" : reason each run ended, "final_time" or one of the failures in
+        pylot.termination.FAILURE_REASONS (e.g. "crash"). Failed runs are ended as soon
+        as they fail, according to the criteria given in the "simulation" object.
+    """
+
+    # Load input
+    if isinstance(input_val, str):
+        with open(input_val, 'r') as input_handle:
+            input_dict = json.load(input_handle)
+    else:
+        input_dict = copy.deepcopy(input_val)
+
+    # Load aircraft definition
+    if not isinstance(input_dict["aircraft"], dict):
+        raise IOError("Dispersions can only be run for a single aircraft.")
+    aircraft_file = input_dict["aircraft"]["file"]
+    if isinstance(aircraft_file, str):
+        with open(aircraft_file, 'r') as aircraft_file_handle:
+            aircraft_dict = json.load(aircraft_file_handle)
+    else:
+        aircraft_dict = copy.deepcopy(aircraft_file)
+
+    # Get timing
+    sim_dict = input_dict.setdefault("simulation", {})
+    for key in ["enable_graphics", "real_time", "auto_timestep"]:
+        sim_dict[key] = False
+    dt = sim_dict.get("timestep", 0.05)
+    t_start = sim_dict.get("start_time", 0.0)
+    t_final = sim_dict.get("final_time", None)
+    if t_final is None or not np.isfinite(t_final):
+        raise IOError("A final time must be given to run dispersions.")
+    stride = max(1, int(round(kwargs.get("output_interval", dt)/dt)))
+    N_steps = int(round((t_final-t_start)/dt))
+    times = t_start+dt*np.arange(0, N_steps+1, stride)
+
+    # Output files would be overwritten by each run
+    for key in ["state_output", "control_output"]:
+        input_dict["aircraft"].pop(key, None)
+
+    # Draw samples
+    rng = np.random.default_rng(kwargs.get("seed", 0))
+    samples = {}
+    for path in sorted(dispersions.keys()):
+        samples[path] = _draw(rng, dispersions[path], N_samples)
+
+    # Dispersed trims shouldn't fill up the trim cache
+    if "trim" in input_dict["aircraft"]:
+        input_dict["aircraft"]["trim"].setdefault("cache", False)
+
+    # Neither should dispersed aircraft definitions
+    if any([path.startswith("definition.") for path in dispersions.keys()]):
+        input_dict["aircraft"].setdefault("cache_definition", False)
+
+    # Set up statistics
+    stats = _RunningStatistics((len(times), 13), kwargs.get("percentiles", [5, 50, 95]))
+    diverged = np.zeros(N_samples, dtype=bool)
+    termination = ["final_time"]*N_samples
+
+    # Run as an ensemble
+    if kwargs.get("ensemble", True) and _can_run_as_ensemble(input_dict, aircraft_dict, dispersions):
+        batch_size = kwargs.get("batch_size", 256)
+        aircraft = load_headless_aircraft(input_dict)
+        for i0 in range(0, N_samples, batch_size):
+            indices = range(i0, min(i0+batch_size, N_samples))
+            trajectories, reasons = _run_ensemble(aircraft, input_dict, dispersions, samples, indices, t_start, dt, N_steps, stride)
+            for i, trajectory, reason in zip(indices, trajectories, reasons):
+                diverged[i] = not stats.add(trajectory)
+                termination[i] = reason
+        aircraft.finalize()
+
+    # Run in parallel
+    else:
+        processes = kwargs.get("processes", None)
+        if processes is None:
+            processes = mp.cpu_count()
+        args = ((i, input_dict, aircraft_dict, dispersions, samples, t_start, dt, N_steps, stride) for i in range(N_samples))
+        # The results are added in sample order, since the percentile estimates depend on the order, so seeded runs repeat exactly
+        with mp.Pool(processes) as pool:
+            for i, trajectory, reason in pool.imap(_run_sample, args):
+                diverged[i] = not stats.add(trajectory)
+                termination[i] = reason
+
+    # Gather results
+    results = stats.get_results()
+    results["time"] = times
+    results["samples"] = samples
+    results["diverged"] = diverged
+    results["termination"] = termination
+    return results
+
+
+def _draw(rng, spec, N_samples):
+    # Draws samples from the given distribution
+
+    distribution = spec.get("distribution", "normal")
+    if distribution == "normal":
+        return rng.normal(spec.get("mean", 0.0), spec["std"], N_samples)
+    elif distribution == "uniform":
+        return rng.uniform(spec["low"], spec["high"], N_samples)
+    elif distribution == "choice":
+        return rng.choice(np.asarray(spec["values"], dtype=float), N_samples)
+    else:
+        raise IOError("{0} is not a valid distribution.".format(distribution))
+
+
+def _apply(value, draw, mode):
+    # Applies a drawn value to the nominal value
+    if mode == "offset":
+        return value+draw
+    elif mode == "scale":
+        return value*draw
+    elif mode == "absolute":
+        return draw
+    else:
+        raise IOError("{0} is not a valid dispersion mode.".format(mode))
+
+
+def _set_path(root, path, draw, mode):
+    # Applies a drawn value to the value at the given path (keys and list indices separated by ".")
+
+    keys = path.split(".")
+    container = root
+    for key in keys[:-1]:
+        container = container[int(key)] if isinstance(container, list) else container[key]
+    last = int(keys[-1]) if isinstance(container, list) else keys[-1]
+    nominal = container[last] if mode != "absolute" else 0.0
+    container[last] = float(_apply(nominal, draw, mode))
+
+
+def _get_sample_dicts(input_dict, aircraft_dict, dispersions, samples, i):
+    # Returns the input, aircraft definition, and tape offsets for the given sample
+
+    input_dict = copy.deepcopy(input_dict)
+    aircraft_dict = copy.deepcopy(aircraft_dict)
+    tape_offsets = {}
+    for path, spec in dispersions.items():
+        root, _, subpath = path.partition(".")
+        mode = spec.get("mode", "offset")
+        if root == "input":
+            _set_path(input_dict, subpath, samples[path][i], mode)
+        elif root == "definition":
+            _set_path(aircraft_dict, subpath, samples[path][i], mode)
+        elif root == "tape":
+            tape_offsets[subpath] = samples[path][i]
+        else:
+            raise IOError("{0} is not a valid dispersion path. Paths must begin with 'input', 'definition', or 'tape'.".format(path))
+
+    # Point the input to the dispersed aircraft definition
+    input_dict["aircraft"]["file"] = aircraft_dict
+
+    return input_dict, tape_offsets
+
+
+def _can_run_as_ensemble(input_dict, aircraft_dict, dispersions):
+    # Determines whether the runs differ only in ways the ensemble integration can handle
+
+    if aircraft_dict["aero_model"]["type"] != "linearized_coefficients":
+        return False
+    if input_dict["simulation"].get("integrator", "RK4") != "RK4":
+        return False
+    if "elastic_launch" in input_dict["aircraft"]:
+        return False
+    controller = input_dict["aircraft"].get("controller", None)
+    if controller is not None and ".csv" not in controller:
+        return False
+    for path in dispersions.keys():
+        if path.startswith("tape."):
+            continue
+        if not any([path.startswith("input.aircraft."+key+".") for key in ["trim", "initial_state", "landed"]]):
+            return False
+    return True
+
+
+def _run_sample(args):
+    # Runs the simulation for a single sample and returns the state at each output time and the reason it ended
+
+    i, input_dict, aircraft_dict, dispersions, samples, t_start, dt, N_steps, stride = args
+
+    # Load aircraft
+    input_dict, tape_offsets = _get_sample_dicts(input_dict, aircraft_dict, dispersions, samples, i)
+    aircraft = load_headless_aircraft(input_dict)
+    _offset_tape(aircraft.controller, tape_offsets)
+    integrator = get_integrator(aircraft, input_dict["simulation"].get("integrator", "RK4"))
+    termination = TerminationCriteria(input_dict["simulation"], input_dict.get("units", "English"), terrain=aircraft._terrain)
+
+    # Integrate, stopping if the run fails. The rest of the trajectory is left as NaN so it is excluded from the statistics.
+    trajectory = np.full(((N_steps//stride)+1, 13), np.nan)
+    trajectory[0] = aircraft.y
+    t = t_start
+    reason = "final_time"
+    with np.errstate(all='ignore'):
+        for j in range(1, N_steps+1):
+            integrator.step(t, dt, store=True)
+            aircraft.normalize()
+            t = t_start+j*dt
+            failure = termination.check(aircraft)
+            if failure is not None:
+                reason = failure
+                break
+            if j%stride == 0:
+                trajectory[j//stride] = aircraft.y
+
+    aircraft.finalize()
+    return i, trajectory, reason
+
+
+def _offset_tape(controller, tape_offsets):
+    # Adds the given offsets to the controls in the control tape
+    for name, offset in tape_offsets.items():
+        if not isinstance(controller, TimeSequenceController):
+            raise IOError("Control tape offsets can only be used with a time-sequence control file.")
+        controller._control_data[:,controller._column_mapping[name]] += offset
+
+
+def _run_ensemble(aircraft, input_dict, dispersions, samples, indices, t_start, dt, N_steps, stride):
+    # Integrates the given samples together and returns the state of each at each output time and the reason each ended
+
+    # Get initial states and controls
+    N = len(indices)
+    names = aircraft._control_names
+    y = np.zeros((N, 13))
+    u0 = np.zeros((N, len(names)))
+    offsets = np.zeros((N, len(names)))
+    for n, i in enumerate(indices):
+        sample_input, tape_offsets = _get_sample_dicts(input_dict, {}, dispersions, samples, i)
+        aircraft._initialize_state(sample_input["aircraft"])
+        y[n] = aircraft.y
+        u0[n] = [aircraft.controls.get(name, 0.0) for name in names]
+        for name, offset in tape_offsets.items():
+            offsets[n,names.index(name)] = offset
+
+    # Get control tape
+    controller = aircraft.controller
+    if isinstance(controller, TimeSequenceController):
+        tape_t = controller._control_data[:,0]
+        tape = [controller._control_data[:,controller._column_mapping[name]] for name in names]
+    else:
+        tape = None
+
+    def get_controls(t):
+        # Holds the initial controls before the tape starts and the final controls after it ends
+        if tape is None or t < tape_t[0]:
+            return u0
+        return np.array([np.interp(t, tape_t, column) for column in tape]).T+offsets
+
+    # Track the aerodynamic angles for the acceleration terms, as LinearizedAirplane.get_FM() does
+    history = {"t" : t_start, "a" : None, "B" : None, "a_hat" : np.zeros(N), "B_hat" : np.zeros(N)}
+
+    # Only the runs which have not failed are integrated
+    active = np.arange(N)
+
+    def dy_dt(t, y):
+        air = aircraft._get_air_states(t, y)
+        V = np.linalg.norm(air[:,:3], axis=1)
+        a = np.arctan2(air[:,2], air[:,0])
+        B = np.arcsin(air[:,1]/V)
+        dt_prev = t-history["t"]
+        if dt_prev > 1e-10 and history["a"] is not None:
+            history["a_hat"] = 0.5*aircraft._cw/V*(a-history["a"])/dt_prev
+            history["B_hat"] = 0.5*aircraft._bw/V*(B-history["B"])/dt_prev
+        history["t"] = t
+        history["a"] = a
+        history["B"] = B
+        return aircraft.dy_dt_batch(y, get_controls(t)[active], t=t, a_hat=history["a_hat"], B_hat=history["B_hat"])
+
+    # Integrate using RK4
+    termination = TerminationCriteria(input_dict["simulation"], input_dict.get("units", "English"), terrain=aircraft._terrain)
+    codes = np.full(N, TERMINATION_REASONS.index("final_time"))
+    trajectories = np.full((N, (N_steps//stride)+1, 13), np.nan)
+    trajectories[:,0] = y
+    t = t_start
+    with np.errstate(all='ignore'):
+        for j in range(1, N_steps+1):
+            k0 = dy_dt(t, y)
+            k1 = dy_dt(t+0.5*dt, y+0.5*dt*k0)
+            k2 = dy_dt(t+0.5*dt, y+0.5*dt*k1)
+            k3 = dy_dt(t+dt, y+dt*k2)
+            y = y+0.16666666666666666666667*(k0+2*k1+2*k2+k3)*dt
+            NormalizeQuaternionArray(y[:,9:], out=y[:,9:])
+            t = t_start+j*dt
+
+            # Drop the runs which have failed, along with their histories
+            failures = termination.check_states(y, aircraft._get_air_states(t, y))
+            if np.any(failures):
+                failed = failures > 0
+                codes[active[failed]] = failures[failed]
+                active = active[~failed]
+                y = y[~failed]
+                for key in ["a", "B", "a_hat", "B_hat"]:
+                    if history[key] is not None:
+                        history[key] = history[key][~failed]
+                if len(active) == 0:
+                    break
+
+            if j%stride == 0:
+                trajectories[active,j//stride] = y
+
+    return trajectories, [TERMINATION_REASONS[code] for code in codes]
+
+
+class _RunningStatistics:
+    # Accumulates the mean, standard deviation, extremes, and percentiles (using the P-squared
+    # algorithm of Jain and Chlamtac) of arrays of the given shape, one sample at a time
+
+    def __init__(self, shape, percentiles):
+
+        self._n = 0
+        self._mean = np.zeros(shape)
+        self._M2 = np.zeros(shape)
+        self._min = np.full(shape, np.inf)
+        self._max = np.full(shape, -np.inf)
+        self._percentiles = list(percentiles)
+        self._estimators = [_P2Quantile(0.01*p, shape) for p in self._percentiles]
+
+
+    def add(self, x):
+        # Adds a sample. Samples which are not finite are rejected.
+
+        if not np.all(np.isfinite(x)):
+            return False
+
+        # Update moments
+        self._n += 1
+        delta = x-self._mean
+        self._mean += delta/self._n
+        self._M2 += delta*(x-self._mean)
+
+        # Update extremes
+        np.minimum(self._min, x, out=self._min)
+        np.maximum(self._max, x, out=self._max)
+
+        # Update percentiles
+        for estimator in self._estimators:
+            estimator.add(x)
+
+        return True
+
+
+    def get_results(self):
+        # Returns the statistics
+
+        results = {}
+        results["mean"] = np.copy(self._mean)
+        results["std"] = np.sqrt(self._M2/max(self._n-1, 1))
+        results["min"] = np.copy(self._min)
+        results["max"] = np.copy(self._max)
+        results["percentiles"] = {}
+        for p, estimator in zip(self._percentiles, self._estimators):
+            results["percentiles"][p] = estimator.get_value()
+        return results
+
+
+class _P2Quantile:
+    # Estimates a quantile of each element of arrays of the given shape without storing the samples
+
+    def __init__(self, p, shape):
+
+        self._p = p
+        self._n = 0
+        self._q = np.zeros(shape+(5,)) # Marker heights
+        self._pos = np.tile(np.arange(1.0, 6.0), shape+(1,)) # Marker positions
+        self._desired = np.tile(np.array([1.0, 1.0+2.0*p, 1.0+4.0*p, 3.0+2.0*p, 5.0]), shape+(1,))
+        self._increment = np.array([0.0, 0.5*p, p, 0.5*(1.0+p), 1.0])
+
+
+    def add(self, x):
+
+        # Store the first five samples
+        if self._n < 5:
+            self._q[...,self._n] = x
+            self._n += 1
+            if self._n == 5:
+                self._q.sort(axis=-1)
+            return
+        self._n += 1
+        q = self._q
+        pos = self._pos
+
+        # Find the cell containing the sample, extending the extremes if needed
+        np.minimum(q[...,0], x, out=q[...,0])
+        np.maximum(q[...,4], x, out=q[...,4])
+        k = np.sum(x[...,np.newaxis] >= q[...,1:4], axis=-1)
+
+        # Shift positions of the markers above the sample
+        pos[...,1:] += (np.arange(1, 5) > k[...,np.newaxis])
+        self._desired += self._increment
+
+        # Adjust the middle markers
+        for i in range(1, 4):
+            d = self._desired[...,i]-pos[...,i]
+            move = ((d >= 1.0) & (pos[...,i+1]-pos[...,i] > 1.0)) | ((d <= -1.0) & (pos[...,i-1]-pos[...,i] < -1.0))
+            if not np.any(move):
+                continue
+            s = np.sign(d)
+
+            # Try the parabolic formula
+            n_m, n_i, n_p = pos[...,i-1], pos[...,i], pos[...,i+1]
+            q_m, q_i, q_p = q[...,i-1], q[...,i], q[...,i+1]
+            with np.errstate(all='ignore'):
+                parabolic = q_i+s/(n_p-n_m)*((n_i-n_m+s)*(q_p-q_i)/(n_p-n_i)+(n_p-n_i-s)*(q_i-q_m)/(n_i-n_m))
+
+            # Otherwise, use linear interpolation
+            q_s = np.where(s > 0.0, q_p, q_m)
+            n_s = np.where(s > 0.0, n_p, n_m)
+            with np.errstate(all='ignore'):
+                linear = q_i+s*(q_s-q_i)/(n_s-n_i)
+            new_q = np.where((q_m < parabolic) & (parabolic < q_p), parabolic, linear)
+
+            q[...,i] = np.where(move, new_q, q_i)
+            pos[...,i] = np.where(move, n_i+s, n_i)
+
+
+    def get_value(self):
+
+        # Not enough samples for the markers
+        if self._n < 5:
+            if self._n == 0:
+                return np.full(self._q.shape[:-1], np.nan)
+            return np.percentile(self._q[...,:self._n], 100.0*self._p, axis=-1)
+
+        return np.copy(self._q[...,2])
@@ -0,0 +1,159 @@
+"""Defines events, which occur when a function of the time and aircraft state crosses zero.
+The integration is stopped exactly at each event, found by root-finding on an interpolant
+of the state across the step."""
+
+import math as m
+import numpy as np
+import scipy.optimize as opt
+
+from pylot.controllers import TimeSequenceController
+
+
+class Event:
+    """An event which occurs when the given function of the time and aircraft crosses zero.
+
+    Parameters
+    ----------
+    name : str
+        Name of the event.
+
+    function : callable
+        Event function, called as function(t, aircraft). Should only depend on the time and
+        the state of the aircraft (aircraft.y) and have no side effects.
+
+    direction : int, optional
+        If 1, the event only occurs when the function goes from negative to positive. If -1,
+        only when the function goes from positive to negative. If 0, either way. Defaults to 0.
+
+    terminal : bool, optional
+        Whether the simulation should stop when this event occurs. Defaults to False.
+
+    action : callable, optional
+        Called as action(t, aircraft) when the event occurs, after the aircraft has been
+        moved to the time of the event. Defaults to no action.
+    """
+
+    def __init__(self, name, function, **kwargs):
+
+        # Store params
+        self.name = name
+        self._function = function
+        self.direction = kwargs.get("direction", 0)
+        self.terminal = kwargs.get("terminal", False)
+        self.action = kwargs.get("action", None)
+
+
+    def __call__(self, t, aircraft):
+        return self._function(t, aircraft)
+
+
+    def crossed(self, g0, g1):
+        """Returns whether the event function crossed zero in the direction of this event
+        given its values at the start and end of a step."""
+        if g0 > 0.0 and g1 <= 0.0:
+            return self.direction <= 0
+        if g0 < 0.0 and g1 >= 0.0:
+            return self.direction >= 0
+        return False
+
+
+def get_builtin_event(name, aircraft, **kwargs):
+    """Returns one of the built-in events for the given aircraft.
+
+    Parameters
+    ----------
+    name : str
+        "touchdown" (the lowest landing gear tip reaches the ground), "crash" (the aircraft
+        origin reaches the ground), "stall" (the angle of attack exceeds the stall angle), or
+        "end_of_tape" (the time passes the end of the time-sequence control file).
+
+    aircraft : BaseAircraft
+        Aircraft the event is for.
+
+    terminal : bool, optional
+        Whether the simulation should stop when this event occurs. Defaults to True for
+        "crash" and "end_of_tape" and False otherwise.
+
+    Returns
+    -------
+    Event
+    """
+
+    # Touchdown
+    if name == "touchdown":
+        if aircraft._num_landing_gear == 0:
+            raise IOError("The touchdown event requires {0} to have landing gear.".format(aircraft.name))
+        return Event(name, _gear_clearance, direction=-1, terminal=kwargs.get("terminal", False))
+
+    # Crash
+    elif name == "crash":
+        return Event(name, _origin_clearance, direction=-1, terminal=kwargs.get("terminal", True))
+
+    # Stall
+    elif name == "stall":
+        alpha_stall = m.radians(aircraft._input_dict["aero_model"].get("stall_angle_of_attack", 15.0))
+        return Event(name, lambda t, ac: _get_alpha(ac)-alpha_stall, direction=1, terminal=kwargs.get("terminal", False))
+
+    # End of control file
+    elif name == "end_of_tape":
+        if not isinstance(aircraft.controller, TimeSequenceController):
+            raise IOError("The end_of_tape event requires {0} to use a time-sequence control file.".format(aircraft.name))
+        t_end = aircraft.controller.get_end_time()
+        return Event(name, lambda t, ac: t-t_end, direction=1, terminal=kwargs.get("terminal", True))
+
+    else:
+        raise IOError("{0} is not a valid event.".format(name))
+
+
+def _gear_clearance(t, aircraft):
+    # Height of the lowest landing gear tip above the ground
+    return aircraft._landing_gear_set.get_clearance(aircraft.y, terrain=aircraft._terrain)
+
+
+def _origin_clearance(t, aircraft):
+    # Height of the aircraft origin above the ground
+    y = aircraft.y
+    if aircraft._terrain is None:
+        return -y[8]
+    return -y[8]-aircraft._terrain.get_height(y[6], y[7])
+
+
+def _get_alpha(aircraft):
+    # Angle of attack relative to the air
+    u, v, w = aircraft._get_air_state(aircraft.y)[:3]
+    return m.atan2(w, u)
+
+
+def hermite_interpolate(t, t0, y0, f0, t1, y1, f1):
+    """Returns the state at the given time within a step using cubic Hermite interpolation
+    between the states and derivatives at either end of the step."""
+    h = t1-t0
+    s = (t-t0)/h
+    s2 = s*s
+    s3 = s2*s
+    return (2.0*s3-3.0*s2+1.0)*y0+(s3-2.0*s2+s)*h*f0+(3.0*s2-2.0*s3)*y1+(s3-s2)*h*f1
+
+
+def find_event_time(event, aircraft, t0, y0, f0, t1, y1, f1, xtol=1e-9):
+    """Finds the time within a step at which the given event occurs, using Brent's method
+    on the event function evaluated along the interpolated state. The event function must
+    have crossed zero over the step. The aircraft state is left unchanged.
+
+    Returns
+    -------
+    float
+        Time of the event.
+    """
+
+    y_prev = aircraft.y
+
+    def residual(t):
+        aircraft.y = hermite_interpolate(t, t0, y0, f0, t1, y1, f1)
+        return event(t, aircraft)
+
+    try:
+        t_event = opt.brentq(residual, t0, t1, xtol=xtol)
+    finally:
+        aircraft.y = y_prev
+
+    return t_event
@@ -10,9 +10,24 @@ import pygame.image
 import pygame.font
 import pygame.draw
 import os
+import re
+import json
 
 from PIL import Image
 
+from pylot.cache import DiskCache, hash_content, get_file_stamps
+
+
+# Increment when the layout of the cached vertex data or images changes
+_MESH_CACHE_VERSION = 1
+_TEXTURE_CACHE_VERSION = 1
+
+# Textures already uploaded by this process, by file, so meshes using the same image share one texture object
+_textures = {}
+
+# Shader programs already linked by this process, by the paths and sources of their shaders
+_programs = {}
+
 
 def _load_shader(shader_file):
     shader_source = ""
@@ -24,27 +39,235 @@ def _load_shader(shader_file):
 def compile_shader(vs, fs):
     vert_shader = _load_shader(vs)
     frag_shader = _load_shader(fs)
+    return _link_program(vert_shader, frag_shader)
 
+def _link_program(vert_shader, frag_shader):
     shader = OpenGL.GL.shaders.compileProgram(OpenGL.GL.shaders.compileShader(vert_shader, GL_VERTEX_SHADER),
                                               OpenGL.GL.shaders.compileShader(frag_shader, GL_FRAGMENT_SHADER))
     return shader
 
+
+def get_program(vs, fs):
+    """Returns the shader program for the given vertex and fragment shader files. The program
+    is compiled and linked the first time the pair is requested and shared by everything
+    using it afterwards. Programs are identified by the paths and sources of the shaders, so
+    a shader which is edited while running is compiled again."""
+
+    vert_shader = _load_shader(vs)
+    frag_shader = _load_shader(fs)
+    key = (os.path.abspath(vs), os.path.abspath(fs), vert_shader, frag_shader)
+    program = _programs.get(key, None)
+    if program is None:
+        program = ShaderProgram(_link_program(vert_shader, frag_shader))
+        _programs[key] = program
+    return program
+
+
+class ShaderProgram:
+    """A linked shader program, which may be shared by many meshes. Since the values of uniforms
+    belong to the program, everything sharing it sets the uniforms it uses each time it draws.
+    The locations of the uniforms are looked up once and kept. Get programs using get_program().
+
+    Parameters
+    ----------
+    program : int
+        Program object.
+    """
+
+    def __init__(self, program):
+        self.program = program
+        self._locations = {}
+
+
+    def get_location(self, name):
+        """Returns the location of the named uniform."""
+        location = self._locations.get(name, None)
+        if location is None:
+            location = glGetUniformLocation(self.program, name)
+            self._locations[name] = location
+        return location
+
+
+    def set_matrix(self, name, matrix):
+        """Sets the named 4x4 matrix uniform. The program must be in use."""
+        glUniformMatrix4fv(self.get_location(name), 1, GL_FALSE, matrix)
+
+
 def load_texture(path):
+    """Returns the texture object for the given image file. The image is uploaded along with
+    each of its mip levels the first time it is requested, and the same texture object is
+    returned for later requests. Images with an alpha channel keep it."""
+
+    # Check for a texture already uploaded
+    key = os.path.abspath(path)
+    if key in _textures:
+        return _textures[key]
+
+    levels = load_mipmaps(path)
+
     texture = glGenTextures(1)
     glBindTexture(GL_TEXTURE_2D, texture)
     # Set the texture wrapping parameters
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-    # Set texture filtering parameters
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+    # Set texture filtering parameters, blending between mip levels when minified
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-    # load image
-    image = Image.open(path)
-    img_data = np.array(list(image.getdata()), np.uint8)
-    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB, image.width, image.height, 0, GL_RGB, GL_UNSIGNED_BYTE, img_data)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, len(levels)-1)
+    # Upload each level. Rows of RGB images are not padded to four bytes.
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+    image_format = GL_RGBA if levels[0].shape[2] == 4 else GL_RGB
+    for level, image in enumerate(levels):
+        glTexImage2D(GL_TEXTURE_2D, level, image_format, image.shape[1], image.shape[0], 0, image_format, GL_UNSIGNED_BYTE, image)
     glEnable(GL_TEXTURE_2D)
+
+    _textures[key] = texture
     return texture
 
+
+def load_mipmaps(path):
+    """Returns the pixels of the given image file and each of its mip levels (each half the
+    size of the last, down to a single pixel) as arrays of shape (height, width, channels).
+    Images with an alpha channel have four channels and others have three. The first time a
+    file is loaded, the levels are stored in the Pylot cache under the file's path,
+    modification time, and size, so later loads read them directly rather than decoding and
+    resizing the image."""
+
+    # Check the cache
+    cache = DiskCache("textures", max_size=1000.0, max_age=30.0)
+    cache_file = cache.path(hash_content(_TEXTURE_CACHE_VERSION, get_file_stamps(path)), ext=".bin")
+    header, data = _read_cache_file(cache_file, np.uint8)
+    if header is not None:
+        levels = []
+        offset = 0
+        for shape in header["shapes"]:
+            size = shape[0]*shape[1]*shape[2]
+            levels.append(data[offset:offset+size].reshape(shape))
+            offset += size
+        return levels
+
+    # Decode straight into arrays, keeping the alpha channel if there is one
+    image = Image.open(path)
+    if "A" in image.getbands() or "transparency" in image.info:
+        image = image.convert("RGBA")
+    else:
+        image = image.convert("RGB")
+    levels = [np.asarray(image)]
+    while image.width > 1 or image.height > 1:
+        image = image.resize((max(image.width//2, 1), max(image.height//2, 1)), Image.BOX)
+        levels.append(np.asarray(image))
+
+    # Store
+    header = {
+        "source" : os.path.abspath(path),
+        "shapes" : [list(level.shape) for level in levels]
+    }
+    _write_cache_file(cache, cache_file, header, np.concatenate([level.ravel() for level in levels]))
+
+    return levels
+
+
+def load_obj(filename):
+    """Returns the vertex data of the given OBJ file, laid out for the vertex buffer as all the
+    vertex positions followed by all the texture coordinates and all the normals, along with the
+    byte offsets of the texture coordinates and normals. The first time a file is loaded, the
+    vertex data are stored in the Pylot cache under the file's path, modification time, and size,
+    so later loads read them directly rather than parsing the text."""
+
+    # Check the cache
+    cache = DiskCache("meshes", max_size=500.0, max_age=30.0)
+    cache_file = cache.path(hash_content(_MESH_CACHE_VERSION, get_file_stamps(filename)), ext=".bin")
+    header, model = _read_cache_file(cache_file, np.float32)
+    if header is not None:
+        return model, header["texture_offset"], header["normal_offset"]
+
+    # Parse
+    model, texture_offset, normal_offset = _parse_obj(filename)
+
+    # Store
+    header = {
+        "source" : os.path.abspath(filename),
+        "texture_offset" : texture_offset,
+        "normal_offset" : normal_offset
+    }
+    _write_cache_file(cache, cache_file, header, model)
+
+    return model, texture_offset, normal_offset
+
+
+def _parse_obj(filename):
+    # Parses the vertex positions, texture coordinates, normals, and triangular faces of an OBJ file. Each
+    # kind of line is found in the whole text at once and converted by NumPy, rather than line by line.
+
+    with open(filename, 'r') as obj_handle:
+        text = obj_handle.read()
+
+    # Get coordinates
+    vert_coords = _read_records(text, "v", 3, np.float32)
+    text_coords = _read_records(text, "vt", 2, np.float32)
+    norm_coords = _read_records(text, "vn", 3, np.float32)
+
+    # Get the indices of the first three vertices of each face as rows of (vertex, texture, normal)
+    faces = " ".join(re.findall(r"^f[ \t]+(\S+[ \t]+\S+[ \t]+\S+)", text, re.M))
+    indices = np.fromstring(faces.replace("//", "/0/").replace("/", " "), dtype=int, sep=" ").reshape((-1,3))-1
+
+    # Vertices without texture coordinates are left out of the texture block
+    text_index = indices[:,1]
+    text_index = text_index[text_index >= 0]
+
+    # Lay out each block
+    model = np.concatenate((vert_coords[indices[:,0]].ravel(), text_coords[text_index].ravel(), norm_coords[indices[:,2]].ravel()))
+    texture_offset = indices.shape[0]*12
+    normal_offset = texture_offset+text_index.shape[0]*8
+    return model, texture_offset, normal_offset
+
+
+def _read_records(text, keyword, N, dtype):
+    # Reads the first N values of every line of the OBJ text beginning with the given keyword into an array with N columns
+    records = re.findall(r"^{0}[ \t]+(\S+(?:[ \t]+\S+){{{1}}})".format(keyword, N-1), text, re.M)
+    return np.fromstring(" ".join(records), dtype=dtype, sep=" ").reshape((-1,N))
+
+
+def _read_cache_file(filename, dtype):
+    # Reads a file written by _write_cache_file(), returning its header and data, or None for both if the
+    # file does not exist or is incomplete
+
+    try:
+        with open(filename, 'rb') as cache_handle:
+            header = json.loads(cache_handle.readline().decode())
+            data = np.fromfile(cache_handle, dtype=dtype)
+    except (OSError, ValueError):
+        return None, None
+    if data.shape[0] != header.get("size", -1):
+        return None, None
+
+    # Mark as used
+    try:
+        os.utime(filename)
+    except OSError:
+        pass
+
+    return header, data
+
+
+def _write_cache_file(cache, filename, header, data):
+    # Writes a JSON header line followed by the raw data to a file in the given cache, then evicts any expired
+    # entries. The file is written to a temporary file first so other processes never see a partial file.
+
+    header["size"] = data.shape[0]
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        temp_filename = "{0}.{1}.tmp".format(filename, os.getpid())
+        with open(temp_filename, 'wb') as cache_handle:
+            cache_handle.write((json.dumps(header)+"\n").encode())
+            np.ascontiguousarray(data).tofile(cache_handle)
+        os.replace(temp_filename, filename)
+    except OSError:
+        return
+
+    cache.evict()
+
+
 def create_from_inverse_of_quaternion(quat):
     return np.array([[1.0 - 2.0 * (quat[1]**2 + quat[2]**2), 2.0 * (quat[0] * quat[1] + quat[3] * quat[2]),2.0 * (quat[0] * quat[2] - quat[3] * quat[1]),0.],
                      [2.0 * (quat[0] * quat[1] - quat[3] * quat[2]),1.0 - 2.0 * ((quat[0]**2) + quat[2]**2),2.0 * (quat[1] * quat[2] + quat[3] * quat[0]),0.],
@@ -120,67 +343,17 @@ def vector_normalise(vec):
 
 class Mesh:
     def __init__(self, filename, vertexshadername, fragmentshadername, texturename, width, height):
-        self.vert_coords = []
-        self.text_coords = []
-        self.norm_coords = []
-        self.vert_index = []
-        self.text_index = []
-        self.norm_index = []
-        self.model = []
         self.position = [0.,0.,0.]
         self.orientation = [0.,0.,0.,1.]
 
-        for line in open(filename, 'r'):
-            if line.startswith('#'):continue
-            values = line.split()
-            if not values: continue
-            if values[0] == 'v':
-                self.vert_coords.append(values[1:4])
-            if values[0] == 'vt':
-                self.text_coords.append(values[1:3])
-            if values[0] == 'vn':
-                self.norm_coords.append(values[1:4])
-            if values[0] == 'f':
-                vi = []
-                ti = []
-                ni = []
-                for v in values[1:4]:
-                    w = v.split('/')
-                    vi.append(int(w[0])-1)
-                    try:
-                        ti.append(int(w[1])-1)
-                    except ValueError:
-                        pass
-                    ni.append(int(w[2])-1)
-                self.vert_index.append(vi)
-                self.text_index.append(ti)
-                self.norm_index.append(ni)
-        self.vert_index = [y for x in self.vert_index for y in x]
-        self.text_index = [y for x in self.text_index for y in x]
-        self.norm_index = [y for x in self.norm_index for y in x]
-
-
-        for i in self.vert_index:
-            self.model.extend(self.vert_coords[i])
-        for i in self.text_index:
-            self.model.extend(self.text_coords[i])
-        for i in self.norm_index:
-            self.model.extend(self.norm_coords[i])
-        self.model = np.array(self.model, dtype = 'float32')
-        self.texture_offset = len(self.vert_index)*12
-        self.normal_offset = (self.texture_offset+len(self.text_index)*8)
-
-        self.shader = compile_shader(vertexshadername, fragmentshadername)
-        self.model_loc = glGetUniformLocation(self.shader, "model")
-        self.view_loc = glGetUniformLocation(self.shader, "view")
-        self.proj_loc = glGetUniformLocation(self.shader, "proj")
-        self.orientation_loc = glGetUniformLocation(self.shader, "orientation")
-
-        self.projection_matrix = matrix44.create_perspective_projection_matrix(60.0, width/height,0.1,100000)
+        self.model, self.texture_offset, self.normal_offset = load_obj(filename)
+        self.num_vertices = self.texture_offset//12
 
-        glUseProgram(self.shader)
-        glUniformMatrix4fv(self.proj_loc,1,GL_FALSE,self.projection_matrix)
-        glUseProgram(0)
+        self.program = get_program(vertexshadername, fragmentshadername)
+        self.shader = self.program.program
+
+        self.projection_matrix = _as_uniform(matrix44.create_perspective_projection_matrix(60.0, width/height,0.1,100000))
+        self.view_matrix = _as_uniform(np.identity(4))
 
         self.texture = load_texture(texturename)
 
@@ -208,54 +381,118 @@ class Mesh:
         """Sets mesh position."""
 
         self.position = position
-        self.model_matrix = create_from_translation(self.position)
-        glUseProgram(self.shader)
-        glUniformMatrix4fv(self.model_loc,1,GL_FALSE,self.model_matrix)
-        glUseProgram(0)
+        self.model_matrix = _as_uniform(create_from_translation(self.position))
 
 
     def set_orientation(self,orientation):
         """Sets mesh orientation."""
 
         self.orientation = orientation
-        self.orientation_matrix = create_from_inverse_of_quaternion(self.orientation)
-        glUseProgram(self.shader)
-        glUniformMatrix4fv(self.orientation_loc,1, GL_FALSE, self.orientation_matrix)
-        glUseProgram(0)
+        self.orientation_matrix = _as_uniform(create_from_inverse_of_quaternion(self.orientation))
 
     def set_orientation_z(self,rotation):
         """Sets mesh orientation."""
         
-        self.orientation_matrix = create_from_z_rotation(-np.radians(rotation))
-        glUseProgram(self.shader)
-        glUniformMatrix4fv(self.orientation_loc,1, GL_FALSE, self.orientation_matrix)
-        glUseProgram(0)
+        self.orientation_matrix = _as_uniform(create_from_z_rotation(-np.radians(rotation)))
 
     def change_projection_matrix(self, fov, aspect_ratio, near, far):
         """Changes mesh projection matrix."""
         
-        self.projection_matrix = matrix44.create_perspective_projection_matrix(fov,aspect_ratio,near,far)
-        glUseProgram(self.shader)
-        glUniformMatrix4fv(self.proj_loc,1,GL_FALSE,self.projection_matrix)
-        glUseProgram(0)
+        self.projection_matrix = _as_uniform(matrix44.create_perspective_projection_matrix(fov,aspect_ratio,near,far))
 
     def set_view(self,view):
         """Sets mesh view."""
 
+        self.view_matrix = _as_uniform(view)
+
+    def render(self):
+        """Renders mesh. The matrices of this mesh are given to the shader program here, since
+        the program may be shared with other meshes."""
+
+        glBindVertexArray(self.vao)
         glUseProgram(self.shader)
-        glUniformMatrix4fv(self.view_loc,1,GL_FALSE,view)
+        self.program.set_matrix("model", self.model_matrix)
+        self.program.set_matrix("orientation", self.orientation_matrix)
+        self.program.set_matrix("view", self.view_matrix)
+        self.program.set_matrix("proj", self.projection_matrix)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glDrawArrays(GL_TRIANGLES, 0, self.num_vertices)
+        glBindTexture(GL_TEXTURE_2D, 0)
         glUseProgram(0)
+        glBindVertexArray(0)
+
+
+class InstancedMesh(Mesh):
+    """A mesh drawn many times in a single draw call, each copy (instance) with its own
+    position and orientation. The geometry, texture, and shader program are only loaded once.
+    The vertex shader must take the transform of each instance (the product of its model and
+    orientation matrices) as a mat4 attribute at location 3, as field_instanced.vs does.
+
+    Parameters
+    ----------
+    filename, vertexshadername, fragmentshadername, texturename, width, height
+        As for Mesh.
+
+    positions : list
+        Position of each instance.
+
+    orientations : list, optional
+        Orientation (quaternion, as given to Mesh.set_orientation()) of each instance.
+        Defaults to no rotation.
+    """
+
+    def __init__(self, filename, vertexshadername, fragmentshadername, texturename, width, height, positions, orientations=None):
+        super().__init__(filename, vertexshadername, fragmentshadername, texturename, width, height)
+
+        # Add the transforms to the vertex array, one matrix per instance taking up four attribute locations
+        self.instance_vbo = glGenBuffers(1)
+        glBindVertexArray(self.vao)
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_vbo)
+        for i in range(4):
+            glVertexAttribPointer(3+i,4,GL_FLOAT,GL_FALSE,64,ctypes.c_void_p(16*i))
+            glEnableVertexAttribArray(3+i)
+            glVertexAttribDivisor(3+i,1)
+        glBindVertexArray(0)
+
+        self.set_instances(positions, orientations)
+
+
+    def set_instances(self, positions, orientations=None):
+        """Sets the position and orientation of each instance. The number of instances may change."""
+
+        # Get the transform of each instance. Translating after rotating only sets the bottom row.
+        positions = np.asarray(positions, dtype=float).reshape((-1,3))
+        if orientations is None:
+            transforms = np.tile(np.identity(4), (positions.shape[0],1,1))
+        else:
+            transforms = np.array([create_from_inverse_of_quaternion(orientation) for orientation in orientations])
+        transforms[:,3,:3] = positions
+        self.instance_data = _as_uniform(transforms)
+        self.num_instances = positions.shape[0]
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_vbo)
+        glBufferData(GL_ARRAY_BUFFER, self.instance_data.nbytes, self.instance_data, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
 
     def render(self):
-        """Renders mesh."""
+        """Renders all instances."""
 
         glBindVertexArray(self.vao)
         glUseProgram(self.shader)
+        self.program.set_matrix("view", self.view_matrix)
+        self.program.set_matrix("proj", self.projection_matrix)
         glBindTexture(GL_TEXTURE_2D, self.texture)
-        glDrawArrays(GL_TRIANGLES, 0, len(self.vert_index))
+        glDrawArraysInstanced(GL_TRIANGLES, 0, self.num_vertices, self.num_instances)
         glBindTexture(GL_TEXTURE_2D, 0)
         glUseProgram(0)
         glBindVertexArray(0)
+
+
+def _as_uniform(matrix):
+    # Converts a matrix to the form passed to the shaders, so it is not converted each time it is drawn
+    return np.ascontiguousarray(matrix, dtype=np.float32)
+
 		
 class Text:
     def __init__(self, size):
@@ -343,6 +580,8 @@ class FlightData:
         #bottom data
         self.text.draw(0.1,-0.75,"Graphics Time Step: " +str(flight_data["Graphics Time Step"])+" sec")
         self.text.draw(-0.6,-0.75,"Physics Time Step: " +str(round(flight_data["Physics Time Step"],6))+" sec")
+        if flight_data.get("Aero Staleness", 0.0) != 0.0:
+            self.text.draw(-0.6,-0.81,"Aero Staleness: " +str(round(flight_data["Aero Staleness"],6))+" sec")
 
 class HeadsUp:
     def __init__(self, width, height, objects_path, shaders_path, textures_path, screen):
@@ -491,10 +730,9 @@ class Frame:
         self.external_aspect_ratio = x/y
 
         aspect_ratio = float(width/height)
-        self.shader = compile_shader(os.path.join(shaders_path, "blank.vs"), os.path.join(shaders_path, "blank.fs"))
-        self.model_loc = glGetUniformLocation(self.shader, "model")
-        self.proj_loc = glGetUniformLocation(self.shader, "proj")
-        self.projection = matrix44.create_perspective_projection_matrix(45.0, aspect_ratio, 0.1, 100.0)
+        self.program = get_program(os.path.join(shaders_path, "blank.vs"), os.path.join(shaders_path, "blank.fs"))
+        self.shader = self.program.program
+        self.projection = _as_uniform(matrix44.create_perspective_projection_matrix(45.0, aspect_ratio, 0.1, 100.0))
 
         # plane VAO
         self.vao = glGenVertexArrays(1)
@@ -534,11 +772,7 @@ class Frame:
         glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, self.depth_buff)
         glBindFramebuffer(GL_FRAMEBUFFER, 0)
 
-        position_matrix = create_from_translation(position)
-        glUseProgram(self.shader)
-        glUniformMatrix4fv(self.model_loc, 1, GL_FALSE, position_matrix)
-        glUniformMatrix4fv(self.proj_loc,1,GL_FALSE,self.projection)
-        glUseProgram(0)
+        self.position_matrix = _as_uniform(create_from_translation(position))
 
 
     def start_draw_to_frame(self,opacity):
@@ -555,6 +789,8 @@ class Frame:
         glBindVertexArray(self.vao)
         glBindTexture(GL_TEXTURE_2D, self.texture)
         glUseProgram(self.shader)
+        self.program.set_matrix("model", self.position_matrix)
+        self.program.set_matrix("proj", self.projection)
         glDrawElements(GL_TRIANGLES, len(self.plane_indices), GL_UNSIGNED_INT, None)
         glUseProgram(0)		
         glBindVertexArray(0)
@@ -82,6 +82,27 @@ def Body2Fixed(v, q):
     v2 = v[2]
     return [(qxx+q00-qyy-qzz)*v0 + (qxy-q0z)*v1 + (qxz+q0y)*v2, (qxy+q0z)*v0 + (qyy+q00-qxx-qzz)*v1 + (qyz-q0x)*v2, (qxz-q0y)*v0 + (qyz+q0x)*v1 + (qzz+q00-qxx-qyy)*v2]
 
+def Quat2Matrix(q):
+    """Returns the matrix rotating vectors from body-fixed to Earth-fixed coordinates. Its
+    transpose rotates from Earth-fixed to body-fixed coordinates."""
+    q0 = q[0]
+    q1 = q[1]
+    q2 = q[2]
+    q3 = q[3]
+    q00 = q0*q0
+    qxx = q1*q1
+    qyy = q2*q2
+    qzz = q3*q3
+    q0x = 2*q0*q1
+    q0y = 2*q0*q2
+    q0z = 2*q0*q3
+    qxy = 2*q1*q2
+    qxz = 2*q1*q3
+    qyz = 2*q2*q3
+    return np.array([[qxx+q00-qyy-qzz, qxy-q0z, qxz+q0y],
+                     [qxy+q0z, qyy+q00-qxx-qzz, qyz-q0x],
+                     [qxz-q0y, qyz+q0x, qzz+q00-qxx-qyy]])
+
 def Fixed2Body(v, q):
     q0 = q[0]
     q1 = q[1]
@@ -102,6 +123,130 @@ def Fixed2Body(v, q):
     v2 = v[2]
     return [(qxx+q00-qyy-qzz)*v0 + (qxy+q0z)*v1 + (qxz-q0y)*v2, (qxy-q0z)*v0 + (qyy+q00-qxx-qzz)*v1 + (qyz+q0x)*v2, (qxz+q0y)*v0 + (qyz-q0x)*v1 + (qzz+q00-qxx-qyy)*v2]
 
+def _get_output(out, shape):
+    # Returns the output buffer for an array kernel, allocating it if none was given
+    if out is None:
+        return np.empty(shape)
+    return out
+
+
+def Euler2QuatArray(E, out=None):
+    """Converts each set of Euler angles in E (shape (N,3)) to a quaternion. The
+    quaternions are written to out (shape (N,4)) if given. Gives the same results
+    as Euler2Quat()."""
+    E = np.asarray(E)
+    out = _get_output(out, E.shape[:-1]+(4,))
+    half_E = 0.5*E
+    C = np.cos(half_E)
+    S = np.sin(half_E)
+    C_phi, C_theta, C_psi = C[...,0], C[...,1], C[...,2]
+    S_phi, S_theta, S_psi = S[...,0], S[...,1], S[...,2]
+    CphCth = C_phi*C_theta
+    SthSps = S_theta*S_psi
+    SthCps = S_theta*C_psi
+    SphCth = S_phi*C_theta
+    out[...,0] = CphCth*C_psi+S_phi*SthSps
+    out[...,1] = SphCth*C_psi-C_phi*SthSps
+    out[...,2] = C_phi*SthCps+SphCth*S_psi
+    out[...,3] = CphCth*S_psi-S_phi*SthCps
+    return out
+
+
+def NormalizeQuaternionArray(q, out=None):
+    """Normalizes each quaternion in q (shape (N,4)). The results are written to out
+    (which may be q itself) if given. Gives the same results as NormalizeQuaternion()."""
+    q = np.asarray(q)
+    out = _get_output(out, q.shape)
+    np.divide(q, np.sqrt(np.sum(q*q, axis=-1))[...,np.newaxis], out=out)
+    return out
+
+
+def Quat2EulerArray(q, out=None):
+    """Converts each quaternion in q (shape (N,4)) to Euler angles. The angles are
+    written to out (shape (N,3)) if given. Gives the same results as Quat2Euler(),
+    including at gimbal lock."""
+    q = np.asarray(q)
+    out = _get_output(out, q.shape[:-1]+(3,))
+    q0, q1, q2, q3 = q[...,0], q[...,1], q[...,2], q[...,3]
+    x = q0*q2-q1*q3
+    q02 = q0*q0
+    qx2 = q1*q1
+    qy2 = q2*q2
+    qz2 = q3*q3
+    out[...,0] = np.arctan2(2*(q0*q1+q2*q3), q02+qz2-qx2-qy2)
+    out[...,1] = np.arcsin(2*x)
+    out[...,2] = np.arctan2(2*(q0*q3+q1*q2), q02+qx2-qy2-qz2)
+
+    # Handle gimbal lock
+    locked = (x == 0.5) | (x == -0.5)
+    if locked.any():
+        out[locked,0] = 2.*np.arcsin(q1[locked]*1.4142135623730951)
+        out[locked,1] = pi*x[locked]
+        out[locked,2] = 0.
+    return out
+
+
+def _rotate_array(v, q, sign, out):
+    # Rotates each vector in v by the corresponding quaternion in q. A sign of 1 gives
+    # Body2Fixed() and -1 gives Fixed2Body().
+    v = np.asarray(v)
+    q = np.asarray(q)
+    out = _get_output(out, np.broadcast_shapes(v.shape, q.shape[:-1]+(3,)))
+    q0, q1, q2, q3 = q[...,0], q[...,1], q[...,2], q[...,3]
+    q00 = q0*q0
+    qxx = q1*q1
+    qyy = q2*q2
+    qzz = q3*q3
+    q0x = sign*2*q0*q1
+    q0y = sign*2*q0*q2
+    q0z = sign*2*q0*q3
+    qxy = 2*q1*q2
+    qxz = 2*q1*q3
+    qyz = 2*q2*q3
+    v0 = v[...,0]
+    v1 = v[...,1]
+    v2 = v[...,2]
+    out0 = (qxx+q00-qyy-qzz)*v0 + (qxy-q0z)*v1 + (qxz+q0y)*v2
+    out1 = (qxy+q0z)*v0 + (qyy+q00-qxx-qzz)*v1 + (qyz-q0x)*v2
+    out[...,2] = (qxz-q0y)*v0 + (qyz+q0x)*v1 + (qzz+q00-qxx-qyy)*v2
+    out[...,0] = out0
+    out[...,1] = out1
+    return out
+
+
+def Body2FixedArray(v, q, out=None):
+    """Rotates each vector in v (shape (N,3)) from body-fixed to Earth-fixed coordinates
+    using the corresponding quaternion in q (shape (N,4), or (4,) to use the same
+    quaternion for all). The results are written to out (shape (N,3)) if given. Gives
+    the same results as Body2Fixed()."""
+    return _rotate_array(v, q, 1.0, out)
+
+
+def Fixed2BodyArray(v, q, out=None):
+    """Rotates each vector in v (shape (N,3)) from Earth-fixed to body-fixed coordinates
+    using the corresponding quaternion in q (shape (N,4), or (4,) to use the same
+    quaternion for all). The results are written to out (shape (N,3)) if given. Gives
+    the same results as Fixed2Body()."""
+    return _rotate_array(v, q, -1.0, out)
+
+
+def CrossArray(v0, v1, out=None):
+    """Calculates the cross product of each pair of vectors in v0 and v1 (shape (N,3),
+    or (3,) to use the same vector for all). The results are written to out (shape
+    (N,3)) if given. Gives the same results as cross()."""
+    v0 = np.asarray(v0)
+    v1 = np.asarray(v1)
+    out = _get_output(out, np.broadcast_shapes(v0.shape, v1.shape))
+    v00, v01, v02 = v0[...,0], v0[...,1], v0[...,2]
+    v10, v11, v12 = v1[...,0], v1[...,1], v1[...,2]
+    out0 = v01*v12-v11*v02
+    out1 = v10*v02-v00*v12
+    out[...,2] = v00*v11-v10*v01
+    out[...,0] = out0
+    out[...,1] = out1
+    return out
+
+
 def check_filepath(input_filename, correct_ext):
     # Check correct file extension and that file exists
     if correct_ext not in input_filename:
@@ -109,75 +254,94 @@ def check_filepath(input_filename, correct_ext):
     if not os.path.exists(input_filename):
         raise IOError("Cannot find file {0}.".format(input_filename))
 
-def convert_units(in_value, units, system):
-    # Converts the given value from the specified units to the default for the system chosen
-    if units == "-":
-        return in_value
+# Factors converting from each unit to the default for each system
+_TO_ENGLISH_DEFAULT = {
+    "ft" : 1.0,
+    "in" : 0.083333333,
+    "m" : 3.28084,
+    "cm" : 0.0328084,
+    "ft/s" : 1.0,
+    "m/s" : 3.28084,
+    "mph" : 1.466666666,
+    "kph" : 0.9113444,
+    "kn" : 1.687811,
+    "ft^2" : 1.0,
+    "m^2" : 10.76391,
+    "slug/ft^3" : 1.0,
+    "kg/m^3" : 0.0019403203,
+    "lbf" : 1.0,
+    "N" : 0.22480894244319,
+    "deg" : 1.0,
+    "rad" : 57.29578,
+    "deg/s" : 0.01745329,
+    "rad/s" : 1.0,
+    "slug ft^2" : 1.0,
+    "kg m^2" : 0.7375621419,
+    "slug ft^2/s" : 1.0,
+    "kg m^2/s" : 0.7375621419,
+    "lbf/ft" : 1.0,
+    "N/m" : 0.0685217659
+}
 
-    to_english_default = {
-        "ft" : 1.0,
-        "in" : 0.083333333,
-        "m" : 3.28084,
-        "cm" : 0.0328084,
-        "ft/s" : 1.0,
-        "m/s" : 3.28084,
-        "mph" : 1.466666666,
-        "kph" : 0.9113444,
-        "kn" : 1.687811,
-        "ft^2" : 1.0,
-        "m^2" : 10.76391,
-        "slug/ft^3" : 1.0,
-        "kg/m^3" : 0.0019403203,
-        "lbf" : 1.0,
-        "N" : 0.22480894244319,
-        "deg" : 1.0,
-        "rad" : 57.29578,
-        "deg/s" : 0.01745329,
-        "rad/s" : 1.0,
-        "slug ft^2" : 1.0,
-        "kg m^2" : 0.7375621419,
-        "slug ft^2/s" : 1.0,
-        "kg m^2/s" : 0.7375621419,
-        "lbf/ft" : 1.0,
-        "N/m" : 0.0685217659
-    }
-
-    to_si_default = {
-        "ft" : 0.3048,
-        "in" : 0.0254,
-        "m" : 1.0,
-        "cm" : 0.01,
-        "ft/s" : 0.3048,
-        "m/s" : 1.0,
-        "mph" : 0.44704,
-        "kph" : 0.277777777,
-        "kn" : 0.514444444,
-        "ft^2" : 0.09290304,
-        "m^2" : 1.0,
-        "slug/ft^3" : 515.378819,
-        "kg/m^3" : 1.0,
-        "lbf" : 4.4482216,
-        "N" : 1.0,
-        "deg" : 1.0,
-        "rad" : 57.29578,
-        "deg/s" : 0.01745329,
-        "rad/s" : 1.0,
-        "slug ft^2" : 1.355817961,
-        "kg m^2" : 1.0,
-        "slug ft^2/s" : 1.355817961,
-        "kg m^2/s" : 1.0,
-        "lbf/ft" : 14.593902928003786,
-        "N/m" : 1.0
-    }
+_TO_SI_DEFAULT = {
+    "ft" : 0.3048,
+    "in" : 0.0254,
+    "m" : 1.0,
+    "cm" : 0.01,
+    "ft/s" : 0.3048,
+    "m/s" : 1.0,
+    "mph" : 0.44704,
+    "kph" : 0.277777777,
+    "kn" : 0.514444444,
+    "ft^2" : 0.09290304,
+    "m^2" : 1.0,
+    "slug/ft^3" : 515.378819,
+    "kg/m^3" : 1.0,
+    "lbf" : 4.4482216,
+    "N" : 1.0,
+    "deg" : 1.0,
+    "rad" : 57.29578,
+    "deg/s" : 0.01745329,
+    "rad/s" : 1.0,
+    "slug ft^2" : 1.355817961,
+    "kg m^2" : 1.0,
+    "slug ft^2/s" : 1.355817961,
+    "kg m^2/s" : 1.0,
+    "lbf/ft" : 14.593902928003786,
+    "N/m" : 1.0
+}
+
+
+def get_unit_factor(units, system):
+    # Returns the factor converting the specified units to the default for the system chosen
+    if units == "-":
+        return 1.0
     try:
         if system == "English":
-            return in_value*to_english_default[units.strip(' \t\r\n')]
+            return _TO_ENGLISH_DEFAULT[units.strip(' \t\r\n')]
         else:
-            return in_value*to_si_default[units.strip(' \t\r\n')]
+            return _TO_SI_DEFAULT[units.strip(' \t\r\n')]
     except KeyError:
         raise IOError("Improper units specified; {0} is not an allowable unit definition.".format(units))
 
 
+def convert_units(in_value, units, system):
+    # Converts the given value from the specified units to the default for the system chosen
+    if units == "-":
+        return in_value
+    return in_value*get_unit_factor(units, system)
+
+
+def convert_array_units(in_values, units, system):
+    # Converts the given array from the specified units to the default for the system chosen. The units
+    # may be a single string or one string per column.
+    if isinstance(units, str):
+        factors = get_unit_factor(units, system)
+    else:
+        factors = np.array([get_unit_factor(unit, system) for unit in units])
+    return np.asarray(in_values, dtype=float)*factors
+
+
 def import_value(key, dict_of_vals, system, default_value):
     # Imports value from a dictionary. Handles importing arrays from files and 
     # unit conversions. If default_value is -1, then this value must be 
@@ -216,11 +380,11 @@ def import_value(key, dict_of_vals, system, default_value):
             return_value = ("elliptic", root_chord)
         
         elif isinstance(val[-1], str): # Float or vector with units
-            converted_val = vectorized_convert_units(val[:-1], val[-1], system)
+            converted_val = convert_array_units(val[:-1], val[-1], system)
 
-            try:
+            if converted_val.size == 1:
                 return_value = converted_val.item() # Float
-            except ValueError:
+            else:
                 return_value = converted_val # Vector or quaternion
 
         elif len(val) == 3 or len(val) == 4: # Vector or quaternion without units
@@ -237,7 +401,7 @@ def import_value(key, dict_of_vals, system, default_value):
             val = np.asarray(val)
             units = val[-1,:]
             data = val[:-1,:].astype(float)
-            return_value = vectorized_convert_units(data, units, system)
+            return_value = convert_array_units(data, units, system)
 
         else: # Array without units
             #TODO: Allow this to handle arrays specifying a distribution of airfoils
@@ -246,9 +410,6 @@ def import_value(key, dict_of_vals, system, default_value):
     return return_value
 
 
-vectorized_convert_units = np.vectorize(convert_units)
-
-
 def cross(v0, v1):
     """Calculates the cross product of v0 and v1."""
     v00, v01, v02 = v0
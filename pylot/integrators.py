@@ -5,6 +5,57 @@ import copy
 import numpy as np
 
 
+def max_stable_timestep(amplification, eigenvalues):
+    """Finds the largest timestep for which an integrator is stable for each of the
+    given modes.
+
+    Parameters
+    ----------
+    amplification : callable
+        Gives the magnitude of the largest root of the integrator's characteristic
+        equation for the test equation y' = lambda*y as a function of z = lambda*dt.
+        The integrator is stable where this is no greater than 1.
+
+    eigenvalues : ndarray
+        Eigenvalues of the modes to consider. Modes which grow physically (positive
+        real part) or are constant are ignored.
+
+    Returns
+    -------
+    float
+        Largest stable timestep. Infinite if no mode limits the timestep.
+    """
+
+    dt_max = np.inf
+    for eigenvalue in eigenvalues:
+
+        # Ignore physically unstable and rigid-body modes
+        if eigenvalue.real > 0.0 or abs(eigenvalue) < 1e-10:
+            continue
+
+        # Step out along the ray until the integrator becomes unstable
+        dt_stable = 0.0
+        dt = 0.1/abs(eigenvalue)
+        while amplification(dt*eigenvalue) <= 1.0+1e-9:
+            dt_stable = dt
+            dt *= 1.1
+            if dt > 1e3/abs(eigenvalue):
+                break
+        else:
+
+            # Bisect to find the boundary
+            dt_unstable = dt
+            for i in range(50):
+                dt = 0.5*(dt_stable+dt_unstable)
+                if amplification(dt*eigenvalue) <= 1.0+1e-9:
+                    dt_stable = dt
+                else:
+                    dt_unstable = dt
+            dt_max = min(dt_max, dt_stable)
+
+    return dt_max
+
+
 class RK4Integrator:
     """Performs Runge-Kutta integration for the given aircraft.
 
@@ -59,6 +110,24 @@ class RK4Integrator:
         return k0
 
 
+    def reset(self):
+        """Discards any information kept from previous steps. Called when the state is
+        changed other than by stepping (e.g. when an event is located within a step)."""
+        pass
+
+
+    def max_stable_timestep(self, eigenvalues):
+        """Returns the largest timestep for which this integrator is stable for the
+        given eigenvalues of the linearized dynamics."""
+        return max_stable_timestep(self._amplification, eigenvalues)
+
+
+    @staticmethod
+    def _amplification(z):
+        # Magnitude of the amplification factor for the test equation
+        return abs(1.0+z*(1.0+z*(0.5+z*(0.16666666666666666+z*0.041666666666666664))))
+
+
 class ABM4Integrator:
     """Performs multi-step Adams-Bashforth-Moulton integration for the given aircraft.
 
@@ -130,4 +199,99 @@ class ABM4Integrator:
             # Store derivatives for next step
             self._f = np.roll(self._f, 1, axis=0)
             self._f[0] = f0
-        
\ No newline at end of file
+
+
+    def reset(self):
+        """Discards the stored derivatives, which assume evenly spaced steps, so the
+        integration starts over using RK4. Called when the state is changed other than
+        by stepping (e.g. when an event is located within a step)."""
+        self._n_stored = 0
+
+
+    def max_stable_timestep(self, eigenvalues):
+        """Returns the largest timestep for which this integrator is stable for the
+        given eigenvalues of the linearized dynamics."""
+        return min(max_stable_timestep(self._amplification, eigenvalues), self._RK4.max_stable_timestep(eigenvalues))
+
+
+    @staticmethod
+    def _amplification(z):
+        # Largest root of the characteristic equation of the predictor-corrector pair for the test equation
+        a = 0.375*z*z
+        roots = np.roots([1.0,
+                          -(1.0+1.1666666666666667*z+2.2916666666666665*a),
+                          2.4583333333333335*a+0.20833333333333334*z,
+                          -(1.5416666666666667*a+0.041666666666666664*z),
+                          0.375*a])
+        return np.max(np.abs(roots))
+        
+
+class ROS2Integrator:
+    """Performs linearly-implicit, 2nd-order Rosenbrock integration for the given aircraft
+    (the L-stable ROS2 method of Verwer et al.). Uses the Jacobian of the aircraft
+    dynamics, so it remains stable with timesteps much longer than the time constants
+    of the fast modes (e.g. the roll mode or stiff landing gear).
+
+    Parameters
+    ----------
+    aircraft : BaseAircraft
+        Aircraft to integrate the state of.
+    """
+
+    # Method parameter
+    _gamma = 1.0+1.0/np.sqrt(2.0)
+
+
+    def __init__(self, aircraft):
+
+        # Store aircraft
+        self._aircraft = aircraft
+
+
+    def step(self, t, dt, **kwargs):
+        """Steps the Rosenbrock integration forward.
+
+        Parameters
+        ----------
+        t : float
+            Initial time.
+
+        dt : float
+            Time step.
+
+        """
+
+        # Store the current state
+        y0 = copy.deepcopy(self._aircraft.y)
+
+        # Get the derivative and the Jacobian at the current state
+        f0 = self._aircraft.dy_dt(t)
+        A, _ = self._aircraft.get_jacobian(t)
+        W = np.eye(13)-self._gamma*dt*A
+
+        # First stage
+        k1 = np.linalg.solve(W, f0)
+
+        # Second stage
+        self._aircraft.y = y0+dt*k1
+        f1 = self._aircraft.dy_dt(t+dt)
+        k2 = np.linalg.solve(W, f1-2.0*k1)
+
+        # Calculate y
+        self._aircraft.y = y0+dt*(1.5*k1+0.5*k2)
+
+        # Return the first derivative
+        return f0
+
+
+    def reset(self):
+        """Discards any information kept from previous steps. Called when the state is
+        changed other than by stepping (e.g. when an event is located within a step)."""
+        pass
+
+
+    def max_stable_timestep(self, eigenvalues):
+        """Returns the largest timestep for which this integrator is stable for the
+        given eigenvalues of the linearized dynamics. This integrator is L-stable, so
+        this is always infinite."""
+        return np.inf
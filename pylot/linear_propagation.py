@@ -0,0 +1,213 @@
+"""Defines fast propagation of small perturbations about a reference condition using the linearized dynamics."""
+
+import numpy as np
+import scipy.linalg as la
+
+from pylot.helpers import Quat2Euler, NormalizeQuaternion, Euler2QuatArray, Quat2EulerArray, NormalizeQuaternionArray
+
+
+class LinearPropagator:
+    """Propagates many small perturbations about a reference condition (e.g. trim) at once
+    using the discretized linear model of the aircraft. The transition and input matrices
+    are found once, assuming the controls are held constant over each timestep.
+
+    Parameters
+    ----------
+    aircraft : BaseAircraft
+        Aircraft to propagate perturbations of.
+
+    dt : float
+        Timestep.
+
+    state : ndarray, optional
+        Reference state vector. Defaults to the current state of the aircraft.
+
+    controls : dict, optional
+        Reference control settings. Defaults to the current control settings of the aircraft.
+
+    reduced : bool, optional
+        If True, perturbations will be given in terms of the 12 states
+        [u, v, w, p, q, r, x, y, z, phi, theta, psi] (angles in radians). Otherwise they
+        are given in terms of the 13-element state vector. Defaults to True.
+
+    kwargs
+        Passed to BaseAircraft.linearize().
+    """
+
+    def __init__(self, aircraft, dt, state=None, controls=None, **kwargs):
+
+        # Store reference condition
+        self._aircraft = aircraft
+        self._dt = dt
+        if state is None:
+            self._y_ref = np.copy(aircraft.y)
+        else:
+            self._y_ref = np.array(state, dtype=float)
+        if controls is None:
+            controls = aircraft.controls
+        self._u_ref = np.array([controls.get(name, 0.0) for name in aircraft._control_names], dtype=float)
+        self._reduced = kwargs.pop("reduced", True)
+        if self._reduced:
+            self._E_ref = np.array(Quat2Euler(NormalizeQuaternion(self._y_ref[9:])))
+
+        # Get linear model
+        self.A, self.B = aircraft.linearize(self._y_ref, dict(zip(aircraft._control_names, self._u_ref)), reduced=self._reduced, **kwargs)
+        self._n_states, self._n_controls = self.B.shape
+
+        # Discretize using the exponential of the augmented matrix
+        M = np.zeros((self._n_states+self._n_controls, self._n_states+self._n_controls))
+        M[:self._n_states,:self._n_states] = self.A*dt
+        M[:self._n_states,self._n_states:] = self.B*dt
+        E = la.expm(M)
+        self.Phi = E[:self._n_states,:self._n_states]
+        self.Gamma = E[:self._n_states,self._n_states:]
+
+
+    def propagate(self, dx0, du=None, N_steps=None):
+        """Propagates the given perturbations.
+
+        Parameters
+        ----------
+        dx0 : ndarray
+            Initial perturbations from the reference state, shape (N_cases, n_states).
+
+        du : ndarray, optional
+            Perturbations from the reference control settings at each timestep, shape
+            (N_cases, N_steps, n_controls) or (N_steps, n_controls) to apply the same
+            control history to every case. The columns are ordered the same as the
+            controls in the aircraft definition. Defaults to no control perturbations.
+
+        N_steps : int, optional
+            Number of timesteps. Must be given if du is not.
+
+        Returns
+        -------
+        ndarray
+            Perturbations at each timestep, shape (N_cases, N_steps+1, n_states).
+        """
+
+        # Check inputs
+        dx0 = np.atleast_2d(dx0)
+        du = self._get_control_history(dx0.shape[0], du, N_steps)
+        if N_steps is None:
+            N_steps = du.shape[1]
+
+        # Propagate
+        dx = np.zeros((dx0.shape[0], N_steps+1, self._n_states))
+        dx[:,0] = dx0
+        Phi_T = self.Phi.T
+        Gamma_T = self.Gamma.T
+        for i in range(N_steps):
+            dx[:,i+1] = np.matmul(dx[:,i], Phi_T)+np.matmul(du[:,i], Gamma_T)
+
+        return dx
+
+
+    def compare_nonlinear(self, dx0, du=None, checkpoints=None, **kwargs):
+        """Propagates the given perturbations using both the linear model and the full
+        nonlinear dynamics (RK4 with the same timestep, all cases at once using
+        BaseAircraft.dy_dt_batch()) and gives the deviation between the two at the
+        checkpoints.
+
+        Parameters
+        ----------
+        dx0 : ndarray
+            Initial perturbations from the reference state, shape (N_cases, n_states).
+
+        du : ndarray, optional
+            Control perturbations. See propagate().
+
+        checkpoints : list
+            Times (measured from the start of propagation) at which to compare the two models.
+            These are rounded to the nearest timestep.
+
+        processes : int, optional
+            Passed to BaseAircraft.dy_dt_batch().
+
+        Returns
+        -------
+        deviation : ndarray
+            Linear minus nonlinear perturbations at each checkpoint, shape
+            (N_cases, N_checkpoints, n_states).
+
+        dx_nonlinear : ndarray
+            Nonlinear perturbations at each checkpoint, shape (N_cases, N_checkpoints, n_states).
+        """
+
+        # Get steps to compare at
+        dx0 = np.atleast_2d(dx0)
+        indices = np.round(np.asarray(checkpoints, dtype=float)/self._dt).astype(int)
+        N_steps = int(np.max(indices))
+        du = self._get_control_history(dx0.shape[0], du, N_steps)
+
+        # Linear solution
+        dx_linear = self.propagate(dx0, du)[:,indices]
+
+        # Nonlinear solution. The reference condition is propagated alongside (as the last case) since
+        # the position (and heading, in a turn) changes even in trim.
+        dx_nonlinear = np.zeros(dx_linear.shape)
+        y = self._to_state(np.concatenate((dx0, np.zeros((1, self._n_states)))))
+        dt = self._dt
+        t = 0.0
+        for i in range(N_steps+1):
+
+            # Store checkpoints
+            for j in np.flatnonzero(indices == i):
+                dx_nonlinear[:,j] = self._to_perturbation(y[:-1], y[-1])
+            if i == N_steps:
+                break
+
+            # Step RK4
+            u = np.tile(self._u_ref, (y.shape[0], 1))
+            u[:-1] += du[:,i]
+            k0 = self._aircraft.dy_dt_batch(y, u, t=t, **kwargs)
+            k1 = self._aircraft.dy_dt_batch(y+0.5*dt*k0, u, t=t+0.5*dt, **kwargs)
+            k2 = self._aircraft.dy_dt_batch(y+0.5*dt*k1, u, t=t+0.5*dt, **kwargs)
+            k3 = self._aircraft.dy_dt_batch(y+dt*k2, u, t=t+dt, **kwargs)
+            y = y+0.16666666666666666666667*(k0+2*k1+2*k2+k3)*dt
+            NormalizeQuaternionArray(y[:,9:], out=y[:,9:])
+            t += dt
+
+        return dx_linear-dx_nonlinear, dx_nonlinear
+
+
+    def _get_control_history(self, N_cases, du, N_steps):
+        # Arranges the control perturbations as an array of shape (N_cases, N_steps, n_controls)
+
+        if du is None:
+            if N_steps is None:
+                raise ValueError("The number of steps must be given if no control history is given.")
+            return np.zeros((N_cases, N_steps, self._n_controls))
+
+        du = np.asarray(du, dtype=float)
+        if du.ndim == 2:
+            du = np.broadcast_to(du, (N_cases,)+du.shape)
+        if N_steps is not None and du.shape[1] < N_steps:
+            raise ValueError("Control history has {0} steps but {1} steps were requested.".format(du.shape[1], N_steps))
+        return du
+
+
+    def _to_state(self, dx):
+        # Turns perturbations into full state vectors
+
+        y = np.tile(self._y_ref, (dx.shape[0], 1))
+        y[:,:9] += dx[:,:9]
+        if self._reduced:
+            Euler2QuatArray(self._E_ref+dx[:,9:], out=y[:,9:])
+        else:
+            y[:,9:] += dx[:,9:]
+            NormalizeQuaternionArray(y[:,9:], out=y[:,9:])
+        return y
+
+
+    def _to_perturbation(self, y, y_ref):
+        # Turns full state vectors into perturbations from the given reference state
+
+        if not self._reduced:
+            return y-y_ref
+
+        dx = np.zeros((y.shape[0], 12))
+        dx[:,:9] = y[:,:9]-y_ref[:9]
+        dE = Quat2EulerArray(y[:,9:])-np.array(Quat2Euler(y_ref[9:]))
+        dx[:,9:] = (dE+np.pi)%(2.0*np.pi)-np.pi
+        return dx
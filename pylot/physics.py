@@ -5,14 +5,20 @@ import copy
 import json
 
 import numpy as np
+import multiprocessing as mp
 
 from pylot.helpers import import_value
 from pylot.airplanes import MachUpXAirplane, LinearizedAirplane
-from pylot.integrators import RK4Integrator, ABM4Integrator
+from pylot.integrators import RK4Integrator, ABM4Integrator, ROS2Integrator
+from pylot.terrain import load_terrain
+from pylot.turbulence import load_turbulence
+from pylot.wind import load_wind_field
+from pylot.termination import TERMINATION_REASONS, FAILURE_REASONS
 
 
-def run_physics(input_dict, units, graphics_dict, graphics_ready_flag, game_over_flag, quit_flag, view_flag, pause_flag, data_flag, state_manager, control_manager):
-    """Runs the physics on a separate process."""
+def run_physics(input_dict, units, graphics_dict, graphics_ready_flag, game_over_flag, termination_flag, quit_flag, view_flag, pause_flag, data_flag, state_buffer, control_manager):
+    """Runs the physics on a separate process. When the run ends, the index of the reason
+    in pylot.termination.TERMINATION_REASONS is given to termination_flag."""
     # That this was a member function of Simulator, but bound methods
     # cannot be passed as the target to multiprocessing.Process() on
     # Windows. This irks me Bill...
@@ -29,17 +35,23 @@ def run_physics(input_dict, units, graphics_dict, graphics_ready_flag, game_over
     render_graphics = sim_dict.get("enable_graphics", False)
     enable_interface = sim_dict.get("enable_interface", render_graphics)
 
-    # Load aircraft
-    aircraft = load_aircraft(input_dict, units, quit_flag, view_flag, pause_flag, data_flag, enable_interface)
-
-    # Initialize integrator
-    integrator_selection = input_dict["simulation"].get("integrator", "RK4")
-    if integrator_selection=="RK4":
-        integrator = RK4Integrator(aircraft)
-    elif integrator_selection=="ABM4":
-        integrator = ABM4Integrator(aircraft)
-    else:
-        raise IOError("{0} is not a valid integrator.".format(integrator_selection))
+    # Load aircraft. Imported here since the scene uses the loaders in this module.
+    from pylot.scene import Scene
+    scene = Scene(input_dict, units, quit_flag, view_flag, pause_flag, data_flag, enable_interface)
+    aircraft = scene.player
+    integrator_selection = sim_dict.get("integrator", "RK4")
+
+    # Determine the largest timestep for which the integrator is stable
+    dt_stable = np.inf
+    max_substeps = sim_dict.get("max_substeps", 10)
+    if sim_dict.get("auto_timestep", False):
+        dt_stable = scene.get_stable_timestep(sim_dict.get("timestep_safety_factor", 0.8))
+        if not real_time and dt_stable < np.inf:
+            if "timestep" not in sim_dict:
+                dt = dt_stable
+            elif dt > dt_stable:
+                print("Timestep reduced from {0} s to {1} s to keep the {2} integrator stable.".format(dt, dt_stable, integrator_selection))
+                dt = dt_stable
 
     # Pass airplane graphics information to parent process
     if render_graphics:
@@ -51,6 +63,15 @@ def run_physics(input_dict, units, graphics_dict, graphics_ready_flag, game_over
         graphics_dict["position"] = aircraft.y[6:9]
         graphics_dict["orientation"] = aircraft.y[9:]
 
+        # Pass information for the other aircraft
+        traffic_info = []
+        for other in scene.aircraft[1:]:
+            info = other.get_graphics_info()
+            info["position"] = other.y[6:9]
+            info["orientation"] = other.y[9:]
+            traffic_info.append(info)
+        graphics_dict["traffic"] = traffic_info
+
         # Wait for graphics to load
         while not graphics_ready_flag.value:
             continue
@@ -60,51 +81,73 @@ def run_physics(input_dict, units, graphics_dict, graphics_ready_flag, game_over
 
     # If we're running real time, get an initial guess for how long each sim step is going to take
     if real_time:
-        integrator.step(t_start, 0.0, store=False)
-        aircraft.normalize()
-        aircraft.output_state(t_start)
-        aircraft.controller.output_controls(t_start, aircraft.controls)
+        scene.step(t_start, 0.0, store=False)
+        scene.output(t_start)
         t1 = time.time()
         dt = t1-t0
         t0 = t1
 
     # Otherwise, still perform the necessary output actions
     else:
-        aircraft.output_state(t_start)
-        aircraft.controller.output_controls(t_start, aircraft.controls)
+        scene.output(t_start)
 
 
     # Initialize simulation time index
     t = copy.copy(t_start)
 
-    # Simulation loop
-    while t <= t_final and not (quit_flag.value or game_over_flag.value):
-
-        # Integrate
-        integrator.step(t, dt, store=True)
+    # The state buffer holds the states of all aircraft followed by the timing information
+    N_states = 13*scene.num_aircraft
+    states = np.zeros(N_states+4)
 
-        # Normalize
-        aircraft.normalize()
-
-        # Step in time
+    # Simulation loop
+    while t <= t_final and not quit_flag.value and scene.termination_reason is None:
+
+        # Integrate, splitting the step if it is too long to be stable. If the step would need to be
+        # split too many times, only part of it is integrated and the simulation falls behind real time
+        # rather than diverging.
+        dt_step = dt
+        if dt <= dt_stable:
+            t_event = scene.step(t, dt_step, store=True)
+        else:
+            N_sub = int(np.ceil(dt/dt_stable))
+            if N_sub > max_substeps:
+                N_sub = max_substeps
+                dt_step = N_sub*dt_stable
+            dt_sub = dt_step/N_sub
+            for i in range(N_sub):
+                t_event = scene.step(t+i*dt_sub, dt_sub, store=True)
+                if t_event is not None:
+                    break
+                if scene.termination_reason is not None:
+                    t_event = t+(i+1)*dt_sub # The remaining substeps are not taken
+                    break
+
+        # Step in time by the length integrated, stopping at any event
+        if t_event is None:
+            t += dt_step
+        else:
+            t = t_event
+
+        # In real time, the next step covers the computer time taken by this one
         if real_time:
             t1 = time.time()
             dt = t1-t0
             t0 = t1
-        t += dt
 
         # Write output
-        aircraft.output_state(t)
-        aircraft.controller.output_controls(t, aircraft.controls)
+        scene.output(t)
 
         # Handle graphics only things
         if render_graphics:
 
             # Pass information to graphics
-            state_manager[:13] = aircraft.y[:]
-            state_manager[13] = dt
-            state_manager[14] = t
-            state_manager[15] = time.time()
+            scene.get_states(out=states[:N_states])
+            states[N_states] = dt
+            states[N_states+1] = t
+            states[N_states+2] = time.time()
+            states[N_states+3] = aircraft.get_coefficient_staleness()
+            with state_buffer.get_lock():
+                state_buffer[:] = states
             for key, value in aircraft.controls.items():
                 if not callable(value):
                     control_manager[key] = value
@@ -114,25 +157,46 @@ def run_physics(input_dict, units, graphics_dict, graphics_ready_flag, game_over
             while pause_flag.value and not quit_flag.value:
 
                 # The physics isn't stepping...
-                state_manager[13] = 0.0
+                with state_buffer.get_lock():
+                    state_buffer[N_states] = 0.0
 
             else:
                 if real_time:
                     t0 = time.time() # So as to not throw off the integration
 
-    # If we exit the loop due to a timeout, let the graphics know we're done
-    if t > t_final:
+    # Report why the run ended
+    reason = scene.termination_reason
+    if reason is None:
+        reason = "final_time" if t > t_final else "user_quit"
+    termination_flag.value = TERMINATION_REASONS.index(reason)
+
+    # Let the graphics know we're done. If the run failed, the graphics show the game over screen until the user quits.
+    if render_graphics and reason in FAILURE_REASONS:
+        game_over_flag.value = 1
+    else:
         quit_flag.value = 1
 
-    aircraft.finalize()
+    scene.finalize()
 
 
-def load_aircraft(input_dict, units, quit_flag, view_flag, pause_flag, data_flag, enable_interface):
-    # Loads the aircraft from the input file
+def get_aircraft_inputs(input_dict):
+    """Returns the list of aircraft objects in the input. The "aircraft" object of the
+    input may be a single aircraft or a list of them."""
+    aircraft_inputs = input_dict["aircraft"]
+    if isinstance(aircraft_inputs, dict):
+        return [aircraft_inputs]
+    return list(aircraft_inputs)
+
+
+def load_aircraft(input_dict, units, quit_flag, view_flag, pause_flag, data_flag, enable_interface, **kwargs):
+    # Loads the aircraft from the input file. For scenes, the aircraft object, terrain, turbulence, and wind field are given as kwargs.
 
     # Read in aircraft input
-    aircraft_name = input_dict["aircraft"]["name"]
-    aircraft_file = input_dict["aircraft"]["file"]
+    aircraft_input = kwargs.get("aircraft_input", None)
+    if aircraft_input is None:
+        aircraft_input = get_aircraft_inputs(input_dict)[0]
+    aircraft_name = aircraft_input["name"]
+    aircraft_file = aircraft_input["file"]
 
     if isinstance(aircraft_file, str):
         with open(aircraft_file, 'r') as aircraft_file_handle:
@@ -143,17 +207,69 @@ def load_aircraft(input_dict, units, quit_flag, view_flag, pause_flag, data_flag
     # Get density model, controller, and output file
     density = import_value("density", input_dict.get("atmosphere", {}), units, [0.0023769, "slug/ft^3"])
 
+    # Get terrain
+    if "terrain" in kwargs:
+        terrain = kwargs["terrain"]
+    else:
+        terrain = load_terrain(input_dict, units)
+
+    # Get turbulence
+    if "turbulence" in kwargs:
+        turbulence = kwargs["turbulence"]
+    else:
+        turbulence = load_turbulence(input_dict, units)
+
+    # Get wind field
+    if "wind_field" in kwargs:
+        wind_field = kwargs["wind_field"]
+    else:
+        wind_field = load_wind_field(input_dict, units)
+
     # Linear aircraft
     if aircraft_dict["aero_model"]["type"] == "linearized_coefficients":
-        aircraft = LinearizedAirplane(aircraft_name, aircraft_dict, density, units, input_dict["aircraft"], quit_flag, view_flag, pause_flag, data_flag, enable_interface)
+        aircraft = LinearizedAirplane(aircraft_name, aircraft_dict, density, units, aircraft_input, quit_flag, view_flag, pause_flag, data_flag, enable_interface, terrain=terrain, turbulence=turbulence, wind_field=wind_field)
     
     # MachUpX aircraft
     else:
-        aircraft = MachUpXAirplane(aircraft_name, aircraft_dict, density, units, input_dict["aircraft"], quit_flag, view_flag, pause_flag, data_flag, enable_interface)
+        aircraft = MachUpXAirplane(aircraft_name, aircraft_dict, density, units, aircraft_input, quit_flag, view_flag, pause_flag, data_flag, enable_interface, terrain=terrain, turbulence=turbulence, wind_field=wind_field)
 
     return aircraft
 
 
+def get_integrator(aircraft, integrator_selection):
+    """Returns an integrator of the given type ("RK4", "ABM4", or "ROS2") for the aircraft."""
+    if integrator_selection=="RK4":
+        return RK4Integrator(aircraft)
+    elif integrator_selection=="ABM4":
+        return ABM4Integrator(aircraft)
+    elif integrator_selection=="ROS2":
+        return ROS2Integrator(aircraft)
+    else:
+        raise IOError("{0} is not a valid integrator.".format(integrator_selection))
+
+
+def get_stable_timestep(aircraft, integrator, safety_factor):
+    """Returns the largest timestep for which the integrator is stable for the aircraft
+    in its current state, reduced by the given safety factor. The aircraft is linearized
+    and its fastest modes (e.g. roll subsidence, short period, landing gear) checked
+    against the stability region of the integrator."""
+
+    eigenvalues = aircraft.get_modal_eigenvalues()
+    if not np.all(np.isfinite(eigenvalues)):
+        return np.inf
+    return safety_factor*integrator.max_stable_timestep(eigenvalues)
+
+
+def load_headless_aircraft(input_dict):
+    """Loads the aircraft described by the input dict for use outside of a running
+    simulation (i.e. with no user interface and no graphics)."""
+
+    # These flags are only read by the controller, so they can just be local
+    units = input_dict.get("units", "English")
+    quit_flag, view_flag, pause_flag, data_flag = [mp.Value('i', 0) for i in range(4)]
+    return load_aircraft(input_dict, units, quit_flag, view_flag, pause_flag, data_flag, False)
+
+
 def RK4(aircraft, t, dt):
     """Performs Runge-Kutta integration for the given aircraft.
 
@@ -0,0 +1,421 @@
+"""Defines scenes containing any number of aircraft, all stepped together on one clock."""
+
+import json
+
+import numpy as np
+import scipy.optimize as opt
+
+from pylot.physics import get_aircraft_inputs, load_aircraft, get_integrator, get_stable_timestep
+from pylot.airplanes import LinearizedAirplane
+from pylot.terrain import load_terrain
+from pylot.turbulence import load_turbulence
+from pylot.wind import load_wind_field
+from pylot.cache import hash_content
+from pylot.helpers import NormalizeQuaternionArray
+from pylot.events import find_event_time
+from pylot.termination import TerminationCriteria
+
+
+# Attributes of the aircraft holding the histories used by the aerodynamic models
+_HISTORY_ATTRIBUTES = ["_t_prev", "_a_prev", "_B_prev", "_a_hat", "_B_hat"]
+
+
+class Scene:
+    """A world containing any number of aircraft, all stepped together on one clock.
+    Linearized aircraft sharing the same definition are integrated together as a batch
+    when the RK4 integrator is used. If any aircraft has events, each step is ended early
+    at the first event to occur within it. After each step, the scene checks whether the
+    run should end (e.g. because the player has crashed or the integration has diverged).
+
+    Parameters
+    ----------
+    input_dict : dict
+        Simulation input. The "aircraft" object may be a single aircraft or a list of them.
+
+    units : str
+        Unit system of the simulation.
+
+    quit_flag, view_flag, pause_flag, data_flag : multiprocessing.Value
+        Flags set by the user interface.
+
+    enable_interface : bool
+        Whether the user interface is enabled. Only the first aircraft (the player) is
+        given the interface.
+    """
+
+    def __init__(self, input_dict, units, quit_flag, view_flag, pause_flag, data_flag, enable_interface):
+
+        # Load aircraft, sharing the terrain, turbulence, and wind field
+        terrain = load_terrain(input_dict, units)
+        turbulence = load_turbulence(input_dict, units)
+        wind_field = load_wind_field(input_dict, units)
+        self.aircraft = []
+        for i, aircraft_input in enumerate(get_aircraft_inputs(input_dict)):
+            self.aircraft.append(load_aircraft(input_dict, units, quit_flag, view_flag, pause_flag, data_flag, enable_interface and i == 0, aircraft_input=aircraft_input, terrain=terrain, turbulence=turbulence, wind_field=wind_field))
+        self.num_aircraft = len(self.aircraft)
+        self.player = self.aircraft[0]
+
+        # Initialize integrators
+        sim_dict = input_dict["simulation"]
+        self._integrator_selection = sim_dict.get("integrator", "RK4")
+        self._integrators = [get_integrator(aircraft, self._integrator_selection) for aircraft in self.aircraft]
+
+        # Group linearized aircraft with the same definition into batches
+        self._batches = []
+        self._individual = list(range(self.num_aircraft))
+        if self._integrator_selection == "RK4" and sim_dict.get("batch_aircraft", True):
+            groups = {}
+            for i, aircraft in enumerate(self.aircraft):
+                if isinstance(aircraft, LinearizedAirplane) and not aircraft._hooked:
+                    key = hash_content(aircraft._input_dict, aircraft._density_spec)
+                    groups.setdefault(key, []).append(i)
+            for indices in groups.values():
+                if len(indices) > 1:
+                    self._batches.append(_LinearizedBatch([self.aircraft[i] for i in indices]))
+                    for i in indices:
+                        self._individual.remove(i)
+
+        # Gather events
+        self._events = []
+        for i, aircraft in enumerate(self.aircraft):
+            for event in aircraft.events:
+                self._events.append((i, event))
+        self._g_prev = None
+        self.event_log = []
+        self.terminal_event = None
+
+        # Get criteria for ending the run
+        self._termination = TerminationCriteria(sim_dict, units, terrain=terrain)
+        self.termination_reason = None
+
+        # Open combined state log
+        state_log = sim_dict.get("state_log", None)
+        self._log_handle = None
+        if state_log is not None:
+            self._log_handle = open(state_log, 'wb')
+            header = {
+                "aircraft" : [aircraft.name for aircraft in self.aircraft],
+                "units" : units,
+                "record_length" : 1+13*self.num_aircraft
+            }
+            self._log_handle.write((json.dumps(header)+"\n").encode())
+            self._log_record = np.zeros(1+13*self.num_aircraft)
+
+
+    def step(self, t, dt, **kwargs):
+        """Steps all aircraft forward in time. If an event occurs within the step, the step
+        is ended at the first event and the event's action is taken. If the run should end
+        after the step, termination_reason is set to the reason (see pylot.termination).
+
+        Parameters
+        ----------
+        t : float
+            Initial time.
+
+        dt : float
+            Time step.
+
+        store : bool, optional
+            Passed to the integrators of aircraft not in a batch.
+
+        Returns
+        -------
+        float or None
+            Time at which the step ended if it was ended early because of an event,
+            otherwise None.
+        """
+
+        # Store the initial states, aerodynamic histories, and event function values so events can be located
+        if len(self._events) > 0:
+            y0 = [np.copy(aircraft.y) for aircraft in self.aircraft]
+            histories = self._get_histories()
+            if self._g_prev is None:
+                self._g_prev = self._evaluate_events(t)
+
+        # The models may raise math errors if the states diverge partway through the step
+        try:
+            self._step(t, dt, **kwargs)
+        except (ValueError, OverflowError, ZeroDivisionError):
+            if not any([self._termination.diverged(aircraft.y) for aircraft in self.aircraft]):
+                raise
+            self.termination_reason = "diverged"
+            return None
+
+        # Check for events
+        t_event = None
+        if len(self._events) > 0:
+            g1 = self._evaluate_events(t+dt)
+            crossed = [k for k, (i, event) in enumerate(self._events) if event.crossed(self._g_prev[k], g1[k])]
+            if len(crossed) == 0:
+                self._g_prev = g1
+            else:
+                t_event = self._locate_events(t, dt, y0, histories, crossed, **kwargs)
+
+        # Check whether the run should end
+        self._check_termination()
+
+        return t_event
+
+
+    def _step(self, t, dt, **kwargs):
+        # Steps all aircraft forward in time
+
+        # Step aircraft individually
+        for i in self._individual:
+            self._integrators[i].step(t, dt, **kwargs)
+            self.aircraft[i].normalize()
+
+        # Step batches
+        for batch in self._batches:
+            batch.step(t, dt)
+
+
+    def _check_termination(self):
+        # Sets the reason the run should end, if any. The ground, altitude, and envelope are only checked for
+        # the player, but every aircraft is checked for divergence.
+        if self.termination_reason is not None:
+            return
+        if self.terminal_event is not None:
+            self.termination_reason = "terminal_event"
+            return
+        self.termination_reason = self._termination.check(self.player)
+        if self.termination_reason is None:
+            for aircraft in self.aircraft[1:]:
+                if self._termination.diverged(aircraft.y):
+                    self.termination_reason = "diverged"
+                    return
+
+
+    def _get_histories(self):
+        # Gives the histories used by the aerodynamic models of each aircraft (the angles used to find alpha_hat and beta_hat)
+        histories = []
+        for aircraft in self.aircraft:
+            histories.append({name : getattr(aircraft, name) for name in _HISTORY_ATTRIBUTES if hasattr(aircraft, name)})
+        return histories
+
+
+    def _set_histories(self, histories):
+        # Restores the histories given by _get_histories(), including those held by the batches
+        for aircraft, history in zip(self.aircraft, histories):
+            for name, value in history.items():
+                setattr(aircraft, name, value)
+        for batch in self._batches:
+            batch.load_histories()
+
+
+    def _evaluate_events(self, t):
+        # Gives the value of each event function at the current states
+        return [event(t, self.aircraft[i]) for i, event in self._events]
+
+
+    def _locate_events(self, t, dt, y0, histories, crossed, **kwargs):
+        # Ends the last step at the first event which occurred during it and handles the events occurring
+        # at that time. The time of each event is estimated using Hermite interpolation of the states
+        # across the step, with the derivatives at the ends of the step evaluated without updating the
+        # controls or the histories used by the aerodynamic models. The time of the first event is then
+        # refined by taking the step again with different lengths, since the dynamics may change abruptly
+        # at an event (e.g. at touchdown) and so may not be captured by the interpolation.
+
+        # Get derivatives at the ends of the step
+        y1 = [np.copy(aircraft.y) for aircraft in self.aircraft]
+        f0 = []
+        f1 = []
+        for i, aircraft in enumerate(self.aircraft):
+            aircraft.y = np.copy(y0[i])
+            f0.append(aircraft.dy_dt(t, frozen=True))
+            aircraft.y = np.copy(y1[i])
+            f1.append(aircraft.dy_dt(t+dt, frozen=True))
+
+        # Estimate when each event occurred
+        xtol = 1e-9*max(1.0, abs(t))
+        t_events = {}
+        for k in crossed:
+            i, event = self._events[k]
+            t_events[k] = find_event_time(event, self.aircraft[i], t, y0[i], f0[i], t+dt, y1[i], f1[i], xtol=xtol)
+
+        # Gives the value of the first event function after stepping from the start of the step to the given time.
+        # Each trial starts from the same states and histories, so it depends only on the end time.
+        k_first = min(t_events, key=t_events.get)
+        i_first, first_event = self._events[k_first]
+        def residual(t_end):
+            for i, aircraft in enumerate(self.aircraft):
+                aircraft.y = np.copy(y0[i])
+            self._set_histories(histories)
+            for integrator in self._integrators:
+                integrator.reset()
+            self._step(t, t_end-t, **kwargs)
+            return first_event(t_end, self.aircraft[i_first])
+
+        # Bracket the first event using its estimated time and refine
+        t_estimate = t_events[k_first]
+        if first_event.crossed(self._g_prev[k_first], residual(t_estimate)):
+            t_lower, t_upper = t, t_estimate
+        else:
+            t_lower, t_upper = t_estimate, t+dt
+        try:
+            t_events[k_first] = opt.brentq(residual, t_lower, t_upper, xtol=xtol)
+        except ValueError:
+            t_events[k_first] = t_upper # Restarting the integrator changed the end of the step enough that the event no longer occurs within it
+
+        # Step again, ending just past the first event so its function has crossed zero and it is not found again
+        t_event = min(t_events[k_first]+xtol, t+dt)
+        residual(t_event)
+        g = self._evaluate_events(t_event)
+
+        # Handle the events which have occurred. Any placed too early by the interpolation will be found again in the next step.
+        for k in sorted(t_events, key=t_events.get):
+            i, event = self._events[k]
+            if not event.crossed(self._g_prev[k], g[k]):
+                continue
+            self.event_log.append((min(t_events[k], t_event), self.aircraft[i].name, event.name))
+            if event.action is not None:
+                event.action(t_event, self.aircraft[i])
+            if event.terminal and self.terminal_event is None:
+                self.terminal_event = (self.aircraft[i], event)
+        self._g_prev = self._evaluate_events(t_event)
+
+        return t_event
+
+
+    def get_stable_timestep(self, safety_factor):
+        """Returns the largest timestep for which the integrator is stable for every
+        aircraft in the scene, reduced by the given safety factor."""
+        dt_stable = np.inf
+        for aircraft, integrator in zip(self.aircraft, self._integrators):
+            dt_stable = min(dt_stable, get_stable_timestep(aircraft, integrator, safety_factor))
+        return dt_stable
+
+
+    def get_states(self, out=None):
+        """Returns the states of all aircraft, one after another, as a flat array of
+        length 13*num_aircraft. Written to out if given."""
+        if out is None:
+            out = np.empty(13*self.num_aircraft)
+        for i, aircraft in enumerate(self.aircraft):
+            out[13*i:13*(i+1)] = aircraft.y
+        return out
+
+
+    def output(self, t):
+        """Writes the state and control output of each aircraft and the combined state log."""
+
+        for aircraft in self.aircraft:
+            aircraft.output_state(t)
+            aircraft.controller.output_controls(t, aircraft.controls)
+
+        if self._log_handle is not None:
+            self._log_record[0] = t
+            self.get_states(out=self._log_record[1:])
+            self._log_handle.write(self._log_record.tobytes())
+
+
+    def finalize(self):
+        """Closes all output and shuts down the aircraft."""
+        for aircraft in self.aircraft:
+            aircraft.finalize()
+        if self._log_handle is not None:
+            self._log_handle.close()
+
+
+def read_state_log(filename):
+    """Reads a combined state log written by a scene.
+
+    Parameters
+    ----------
+    filename : str
+        Log file, as given by "state_log" in the simulation input.
+
+    Returns
+    -------
+    dict
+        "aircraft" (names, in the order of the input), "units", "time" (shape (N_t,)),
+        and "states" (shape (N_t, N_aircraft, 13)).
+    """
+
+    with open(filename, 'rb') as log_handle:
+        header = json.loads(log_handle.readline().decode())
+        records = np.fromfile(log_handle, dtype=float)
+
+    records = records.reshape((-1, header["record_length"]))
+    return {
+        "aircraft" : header["aircraft"],
+        "units" : header["units"],
+        "time" : records[:,0],
+        "states" : records[:,1:].reshape((records.shape[0], len(header["aircraft"]), 13))
+    }
+
+
+class _LinearizedBatch:
+    # Linearized aircraft sharing a definition, integrated together using RK4. As when each aircraft
+    # is integrated by itself, the controllers and the acceleration terms (alpha_hat and beta_hat)
+    # are updated at each stage.
+
+    def __init__(self, aircraft):
+
+        # Store aircraft
+        self._aircraft = aircraft
+        self._reference = aircraft[0]
+        self._names = self._reference._control_names
+        self._controls = np.zeros((len(aircraft), len(self._names)))
+        self.load_histories()
+
+
+    def load_histories(self):
+        # Gets the histories of the aerodynamic angles from the aircraft
+        aircraft = self._aircraft
+        self._t_prev = self._reference._t_prev
+        if any([member._a_prev is None for member in aircraft]):
+            self._a_prev = None
+            self._B_prev = None
+        else:
+            self._a_prev = np.array([member._a_prev for member in aircraft])
+            self._B_prev = np.array([member._B_prev for member in aircraft])
+        self._a_hat = np.array([member._a_hat for member in aircraft], dtype=float)
+        self._B_hat = np.array([member._B_hat for member in aircraft], dtype=float)
+
+
+    def _dy_dt(self, t, y):
+        # Gives the state derivatives of all aircraft in the batch
+
+        # Update controls
+        for i, aircraft in enumerate(self._aircraft):
+            aircraft.y = y[i]
+            aircraft.controls = aircraft.controller.get_control(t, aircraft.y, aircraft.controls)
+            for j, name in enumerate(self._names):
+                self._controls[i,j] = aircraft.controls.get(name, 0.0)
+
+        # Update acceleration terms, as LinearizedAirplane.get_FM() does, with the velocities relative to the air
+        air = self._reference._get_air_states(t, y)
+        V_inv = 1.0/np.sqrt(air[:,0]*air[:,0]+air[:,1]*air[:,1]+air[:,2]*air[:,2])
+        a = np.arctan2(air[:,2], air[:,0])
+        B = np.arcsin(air[:,1]*V_inv)
+        dt = t-self._t_prev
+        if dt > 1e-10 and self._a_prev is not None:
+            self._a_hat = 0.5*self._reference._cw*V_inv*(a-self._a_prev)/dt
+            self._B_hat = 0.5*self._reference._bw*V_inv*(B-self._B_prev)/dt
+        self._t_prev = t
+        self._a_prev = a
+        self._B_prev = B
+
+        return self._reference.dy_dt_batch(y, self._controls, t=t, a_hat=self._a_hat, B_hat=self._B_hat)
+
+
+    def step(self, t, dt):
+        # Steps all aircraft in the batch forward using RK4
+
+        y0 = np.array([aircraft.y for aircraft in self._aircraft])
+        k0 = self._dy_dt(t, y0)
+        k1 = self._dy_dt(t+0.5*dt, y0+0.5*dt*k0)
+        k2 = self._dy_dt(t+0.5*dt, y0+0.5*dt*k1)
+        k3 = self._dy_dt(t+dt, y0+dt*k2)
+        y = y0+0.16666666666666666666667*(k0+2*k1+2*k2+k3)*dt
+        NormalizeQuaternionArray(y[:,9:], out=y[:,9:])
+
+        # Give the results back to the aircraft
+        for i, aircraft in enumerate(self._aircraft):
+            aircraft.y = y[i]
+            aircraft._t_prev = self._t_prev
+            aircraft._a_prev = self._a_prev[i]
+            aircraft._B_prev = self._B_prev[i]
+            aircraft._a_hat = self._a_hat[i]
+            aircraft._B_hat = self._B_hat[i]
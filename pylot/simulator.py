@@ -9,12 +9,23 @@ import time
 import pygame.display
 import pygame.image
 import os
-from .physics import run_physics, load_aircraft, RK4
+from .physics import run_physics, load_aircraft, get_aircraft_inputs, RK4
 from .helpers import Quat2Euler, Body2Fixed
+from .termination import TERMINATION_REASONS
 from pygame.locals import HWSURFACE, OPENGL, DOUBLEBUF
 from OpenGL.GL import glClear, glClearColor
 from .graphics import *
 
+
+# Shown on the game over screen for each reason a run may fail
+_GAME_OVER_MESSAGES = {
+    "crash" : "Crashed!",
+    "altitude_floor" : "Too low!",
+    "diverged" : "Diverged!",
+    "envelope" : "Out of limits!"
+}
+
+
 class Simulator:
     """A class for flight simulation using RK4 integration.
 
@@ -57,14 +68,14 @@ class Simulator:
         # Get simulation parameters
         self._render_graphics = self._input_dict["simulation"].get("enable_graphics", False)
         self._simple_graphics = self._input_dict["simulation"].get("simple_graphics", False)
-        self._quit_on_crash = self._input_dict["simulation"].get("quit_on_crash", True)
 
         # Initialize inter-process communication
         self._manager = mp.Manager()
-        self._state_manager = self._manager.list()
-        self._state_manager[:] = [0.0]*16
+        self._num_aircraft = len(get_aircraft_inputs(self._input_dict))
+        self._state_buffer = mp.Array('d', 13*self._num_aircraft+4)
         self._quit = self._manager.Value('i', 0)
         self._game_over = self._manager.Value('i', 0)
+        self._termination = self._manager.Value('i', 0)
         self._pause = self._manager.Value('i', 0)
         self._graphics_ready = self._manager.Value('i', 0)
         self._view = self._manager.Value('i', 1)
@@ -78,11 +89,12 @@ class Simulator:
                                                                      self._aircraft_graphics_info,
                                                                      self._graphics_ready,
                                                                      self._game_over,
+                                                                     self._termination,
                                                                      self._quit,
                                                                      self._view,
                                                                      self._pause,
                                                                      self._flight_data,
-                                                                     self._state_manager,
+                                                                     self._state_buffer,
                                                                      self._control_settings))
 
         # Initialize graphics
@@ -115,20 +127,18 @@ class Simulator:
         self._data = FlightData(self._units)
         self._stall_warning = Text(100)
 
-        # Initialize ground
+        # Initialize ground. The four quads are drawn as instances of one mesh.
         self._render_loading_message('terrain')
-        self._ground_quad = []
         self._quad_size = 20000
         self._ground_positions = [[0., 0., 0.],
                                   [0., self._quad_size, 0.],
                                   [self._quad_size, 0., 0.],
                                   [self._quad_size, self._quad_size, 0.]]
-        ground_orientations = [[1., 0., 0., 0.],
-                               [0., 0., 0., 1.],
-                               [0., 0., 1., 0.],
-                               [0., 1., 0., 0.]] # I'm not storing these because they don't change
-        for i in range(4):
-            self._ground_quad.append(self._create_mesh("field.obj", "field.vs", "field.fs", "field_texture.jpg", self._ground_positions[i], ground_orientations[i]))
+        self._ground_orientations = [[1., 0., 0., 0.],
+                                     [0., 0., 0., 1.],
+                                     [0., 0., 1., 0.],
+                                     [0., 1., 0., 0.]]
+        self._ground = self._create_instanced_mesh("field.obj", "field_instanced.vs", "field.fs", "field_texture.jpg", self._ground_positions, self._ground_orientations)
 
         # Initialize HUD
         self._render_loading_message('HUD')
@@ -147,8 +157,8 @@ class Simulator:
             self._bench = self._create_mesh("wood_bench.obj", "aircraft.vs", "aircraft.fs", "bench.jpg", [10.0, 25.0, 0.0], [1.0, 0.0, 0.0, 0.0])
             self._render_loading_message('trees')
 
-            # Load trees
-            self._trees = []
+            # Load trees, all drawn as instances of one mesh
+            tree_positions = []
             for i in range(10):
                 theta = np.random.rand(1)*2*np.pi
                 rho = np.random.rand(1)*70+30
@@ -158,7 +168,8 @@ class Simulator:
                         pos[1] -= 15.0 # Get yo trees offa my airstrip!
                     else:
                         pos[1] += 15.0
-                self._trees.append(self._create_mesh("spruce.obj", "field.vs", "field.fs", "tree_texture.jpg", pos, [1.0, 0.0, 0.0, 0.0]))
+                tree_positions.append([pos[0].item(), pos[1].item(), pos[2]])
+            self._trees = self._create_instanced_mesh("spruce.obj", "field_instanced.vs", "field.fs", "tree_texture.jpg", tree_positions)
 
             ## Initialize fog
             #self._render_loading_message('fog')
@@ -200,6 +211,19 @@ class Simulator:
         return mesh
 
 
+    def _create_instanced_mesh(self, obj, vs, fs, texture, positions, orientations=None):
+        # Creates a graphics object drawing many copies of a mesh at once
+
+        return InstancedMesh(os.path.join(self._objects_path, obj),
+                os.path.join(self._shaders_path, vs),
+                os.path.join(self._shaders_path, fs),
+                os.path.join(self._textures_path, texture),
+                self._width,
+                self._height,
+                positions,
+                orientations)
+
+
     def _set_graphics_paths(self):
         # Gets the absolute paths to the graphics files
 
@@ -226,6 +250,13 @@ class Simulator:
 
     def run_sim(self):
         """Runs the simulation according to the defined inputs.
+
+        Returns
+        -------
+        str
+            Reason the run ended. "final_time", "user_quit", or "terminal_event" if the run
+            finished, or "crash", "diverged", "altitude_floor", or "envelope" if it failed.
+            Also stored as the termination_reason attribute.
         """
 
         # Kick off the physics
@@ -258,6 +289,14 @@ class Simulator:
                     self._bw = self._aircraft_graphics_info["l_ref_lat"]
                     self._cw = self._aircraft_graphics_info["l_ref_lon"]
 
+                    # Initialize graphics objects for the other aircraft
+                    self._traffic_graphics = []
+                    for info in self._aircraft_graphics_info["traffic"]:
+                        traffic_graphics = Mesh(info["obj_file"], info["v_shader_file"], info["f_shader_file"], info["texture_file"], self._width, self._height)
+                        traffic_graphics.set_position(info["position"])
+                        traffic_graphics.set_orientation(info["orientation"])
+                        self._traffic_graphics.append(traffic_graphics)
+
                     break
 
                 except KeyError: # If it's not there, just keep waiting
@@ -279,6 +318,7 @@ class Simulator:
         # Wait for the physics to finish
         self._physics_process.join()
         self._physics_process.close()
+        self.termination_reason = TERMINATION_REASONS[self._termination.value]
         self._manager.shutdown()
 
         # Print quit message
@@ -289,6 +329,8 @@ class Simulator:
             print("|                   Thank you!                      |")
             print("-----------------------------------------------------")
 
+        return self.termination_reason
+
 
     def _update_graphics(self):
         # Does a step in graphics
@@ -319,26 +361,28 @@ class Simulator:
             #    self._airstrip.resize(self._width, self._height)
             #    self._bench.resize(self._width, self._height)
             #    self._tent.resize(self._width, self._height)
-            #    for tree in self._trees:
-            #        tree.resize(self._width, self._height)
-            #    for quad in self._ground_quad:
-            #        quad.resize(self._width, self._height)
+            #    self._trees.resize(self._width, self._height)
+            #    self._ground.resize(self._width, self._height)
 
         # Check for quitting
         if self._quit.value:
             return True
 
-        # Get state from state manager
-        y = np.array(copy.deepcopy(self._state_manager[:13]))
+        # Get states from the state buffer
+        with self._state_buffer.get_lock():
+            states = np.array(self._state_buffer[:])
+        N_states = 13*self._num_aircraft
+        y = states[:13]
 
         # Check to see if the physics has finished the first loop
         if (y == 0.0).all():
             return False
 
         # Get timing information from physics
-        dt_physics = self._state_manager[13]
-        t_physics = self._state_manager[14]
-        graphics_delay = time.time()-self._state_manager[15] # Included to compensate for the fact that these physics results may be old or brand new
+        dt_physics = states[N_states]
+        t_physics = states[N_states+1]
+        graphics_delay = time.time()-states[N_states+2] # Included to compensate for the fact that these physics results may be old or brand new
+        aero_staleness = states[N_states+3]
 
         # Graphics timestep
         dt_graphics = self._clock.tick(self._target_framerate)/1000.
@@ -346,15 +390,18 @@ class Simulator:
         # Update aircraft position and orientation
         self._aircraft_graphics.set_orientation(swap_quat(y[9:]))
         self._aircraft_graphics.set_position(y[6:9])
+        for i, traffic_graphics in enumerate(self._traffic_graphics):
+            traffic_graphics.set_orientation(swap_quat(states[13*(i+1)+9:13*(i+2)]))
+            traffic_graphics.set_position(states[13*(i+1)+6:13*(i+1)+9])
 
-        # Check for crashing into the ground
-        if self._quit_on_crash and y[8] > 0.0:
+        # Check whether the physics has ended the run because it failed (e.g. crashing into the ground)
+        if self._game_over.value:
 
-            # Display Game Over screen and quit physics
+            # Display Game Over screen
             glClearColor(0,0,0,1.0)
             glClear(GL_COLOR_BUFFER_BIT|GL_DEPTH_BUFFER_BIT|GL_ACCUM_BUFFER_BIT|GL_STENCIL_BUFFER_BIT)
-            self._gameover.draw(-(450/self._width),-0.05,"Crashed!",(0,255,0,1))
-            self._game_over.value = 1
+            message = _GAME_OVER_MESSAGES[TERMINATION_REASONS[self._termination.value]]
+            self._gameover.draw(-(450/self._width),-0.05,message,(0,255,0,1))
 	
         # Otherwise, render graphics
         else:
@@ -380,6 +427,11 @@ class Simulator:
                 self._aircraft_graphics.set_view(view)
                 self._aircraft_graphics.render()
 
+            # Display other aircraft
+            for traffic_graphics in self._traffic_graphics:
+                traffic_graphics.set_view(view)
+                traffic_graphics.render()
+
             # Determine aircraft displacement in quad widths
             x_pos = y[6]
             y_pos = y[7]
@@ -426,10 +478,9 @@ class Simulator:
                 self._ground_positions[2], self._ground_positions[3] = self._ground_positions[3], self._ground_positions[2]
 
             # Update ground graphics
-            for i, quad in enumerate(self._ground_quad):
-                quad.set_position(self._ground_positions[i])
-                quad.set_view(view)
-                quad.render()
+            self._ground.set_instances(self._ground_positions, self._ground_orientations)
+            self._ground.set_view(view)
+            self._ground.render()
 
             # Display scenery
             if not self._simple_graphics:
@@ -441,9 +492,8 @@ class Simulator:
                 self._tent.render()
                 self._bench.set_view(view)
                 self._bench.render()
-                for tree in self._trees:
-                    tree.set_view(view)
-                    tree.render()
+                self._trees.set_view(view)
+                self._trees.render()
 
             # Check for the aerodynamic model falling apart
             # I'm 99% confident this is caused by the numerical integrator going unstable for 
@@ -455,6 +505,7 @@ class Simulator:
             # Display flight data
             elif self._flight_data.value:
                 flight_data = self._get_flight_data(y, dt_graphics, dt_physics, t_physics)
+                flight_data["Aero Staleness"] = aero_staleness
                 self._data.render(flight_data, self._control_settings)
 
         # Update screen display
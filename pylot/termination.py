@@ -0,0 +1,176 @@
+"""Defines the criteria for ending a run early, i.e. when the aircraft hits the ground, the
+integration diverges, or the aircraft leaves its allowed envelope. These are checked by the
+physics after every step, so runs end as soon as they fail whether or not graphics are running."""
+
+import math as m
+import numpy as np
+
+from pylot.helpers import import_value, convert_array_units
+
+
+# Reasons a run may end, indexed by the code passed between processes. The first is used while
+# the run is still going and the last four are failures.
+TERMINATION_REASONS = ["none", "final_time", "user_quit", "terminal_event", "crash", "diverged", "altitude_floor", "envelope"]
+FAILURE_REASONS = ["crash", "diverged", "altitude_floor", "envelope"]
+
+
+class TerminationCriteria:
+    """Criteria for ending a run early, read from the simulation input.
+
+    Parameters
+    ----------
+    sim_dict : dict
+        "simulation" object of the input. The keys "quit_on_crash", "divergence_limit",
+        "altitude_floor", and "state_limits" are used.
+
+    units : str
+        Unit system of the simulation.
+
+    terrain : Terrain, optional
+        Terrain the aircraft are flying over. Defaults to flat ground at zero altitude.
+    """
+
+    def __init__(self, sim_dict, units, terrain=None):
+
+        # Get ground and divergence checks
+        self._terrain = terrain
+        self._quit_on_crash = sim_dict.get("quit_on_crash", True)
+        self._divergence_limit = import_value("divergence_limit", sim_dict, units, 1e6)
+
+        # Get altitude floor
+        if "altitude_floor" in sim_dict:
+            self._altitude_floor = import_value("altitude_floor", sim_dict, units, None)
+        else:
+            self._altitude_floor = -np.inf
+
+        # Get envelope. Angles are stored in radians.
+        limits_dict = sim_dict.get("state_limits", {})
+        self._airspeed_limits = self._import_limits(limits_dict, "airspeed", units, None, [0.0, np.inf])
+        self._alpha_limits = self._import_limits(limits_dict, "angle_of_attack", units, "deg", [-np.inf, np.inf])
+        self._beta_limits = self._import_limits(limits_dict, "sideslip_angle", units, "deg", [-np.inf, np.inf])
+        self._max_rate = self._import_limits(limits_dict, "angular_rate", units, "deg/s", [np.inf])[0]
+        self._alpha_limits = [m.radians(limit) for limit in self._alpha_limits]
+        self._beta_limits = [m.radians(limit) for limit in self._beta_limits]
+        self._check_envelope = len(limits_dict) > 0
+
+
+    def _import_limits(self, limits_dict, key, units, default_units, default_value):
+        # Imports a list of limits, which may have units appended. If no units are given, the default units are assumed.
+        limits = limits_dict.get(key, default_value)
+        if not isinstance(limits, list):
+            limits = [limits]
+        if isinstance(limits[-1], str):
+            return convert_array_units(limits[:-1], limits[-1], units).tolist()
+        if default_units is None:
+            return [float(limit) for limit in limits]
+        return convert_array_units(limits, default_units, units).tolist()
+
+
+    def diverged(self, y):
+        """Returns whether the given state has diverged, i.e. it is not finite or one of
+        the velocities or angular rates exceeds the divergence limit."""
+        if not np.all(np.isfinite(y)):
+            return True
+        limit = self._divergence_limit
+        for i in range(6):
+            if abs(y[i]) > limit:
+                return True
+        return False
+
+
+    def check(self, aircraft):
+        """Checks whether the run should end because of the current state of the given aircraft.
+
+        Returns
+        -------
+        str or None
+            Reason the run should end (one of FAILURE_REASONS), or None if it should continue.
+        """
+
+        # Check for divergence
+        y = aircraft.y
+        if self.diverged(y):
+            return "diverged"
+
+        # Check for hitting the ground
+        if self._quit_on_crash:
+            if self._terrain is None:
+                ground_z = 0.0
+            else:
+                ground_z = -self._terrain.get_height(y[6], y[7])
+            if y[8] > ground_z:
+                return "crash"
+
+        # Check altitude
+        if -y[8] < self._altitude_floor:
+            return "altitude_floor"
+
+        # Check envelope
+        if self._check_envelope:
+            u, v, w = aircraft._get_air_state(y)[:3]
+            V = m.sqrt(u*u+v*v+w*w)
+            if V < self._airspeed_limits[0] or V > self._airspeed_limits[1]:
+                return "envelope"
+            alpha = m.atan2(w, u)
+            beta = m.asin(v/V) if V > 0.0 else 0.0
+            if alpha < self._alpha_limits[0] or alpha > self._alpha_limits[1]:
+                return "envelope"
+            if beta < self._beta_limits[0] or beta > self._beta_limits[1]:
+                return "envelope"
+            if max(abs(y[3]), abs(y[4]), abs(y[5])) > self._max_rate:
+                return "envelope"
+
+        return None
+
+
+    def check_states(self, states, air_states):
+        """Checks many states at once, as check() does for one.
+
+        Parameters
+        ----------
+        states : ndarray
+            State vectors, shape (N, 13).
+
+        air_states : ndarray
+            State vectors with the velocities taken relative to the air, shape (N, 13).
+
+        Returns
+        -------
+        ndarray
+            Index in TERMINATION_REASONS of the reason each run should end, or 0 if it
+            should continue, shape (N,).
+        """
+
+        codes = np.zeros(states.shape[0], dtype=int)
+        finite = np.all(np.isfinite(states), axis=1)
+        with np.errstate(all='ignore'):
+
+            # Check envelope
+            if self._check_envelope:
+                u = air_states[:,0]
+                v = air_states[:,1]
+                w = air_states[:,2]
+                V = np.sqrt(u*u+v*v+w*w)
+                alpha = np.arctan2(w, u)
+                beta = np.where(V > 0.0, np.arcsin(v/V), 0.0)
+                outside = (V < self._airspeed_limits[0]) | (V > self._airspeed_limits[1])
+                outside |= (alpha < self._alpha_limits[0]) | (alpha > self._alpha_limits[1])
+                outside |= (beta < self._beta_limits[0]) | (beta > self._beta_limits[1])
+                outside |= np.max(np.abs(states[:,3:6]), axis=1) > self._max_rate
+                codes[outside] = TERMINATION_REASONS.index("envelope")
+
+            # Check altitude
+            codes[-states[:,8] < self._altitude_floor] = TERMINATION_REASONS.index("altitude_floor")
+
+            # Check for hitting the ground. The terrain is only looked up at finite positions.
+            if self._quit_on_crash:
+                ground_z = np.zeros(states.shape[0])
+                if self._terrain is not None and np.any(finite):
+                    ground_z[finite] = -self._terrain.get_heights_and_normals(states[finite,6], states[finite,7])[0]
+                codes[states[:,8] > ground_z] = TERMINATION_REASONS.index("crash")
+
+            # Check for divergence
+            diverged = ~finite | (np.max(np.abs(states[:,:6]), axis=1) > self._divergence_limit)
+            codes[diverged] = TERMINATION_REASONS.index("diverged")
+
+        return codes
@@ -0,0 +1,244 @@
+"""Defines the terrain model. Elevation is stored in square tiles of samples, each tile being
+a binary file which is memory-mapped when first touched, so very large areas can be used
+without loading them into memory."""
+
+import os
+import json
+from collections import OrderedDict
+
+import numpy as np
+
+from pylot.helpers import get_unit_factor
+
+
+# Offsets to the four corners of a cell, ordered (0, 0), (1, 0), (0, 1), (1, 1)
+_CORNER_OFFSETS = np.array([[0, 1, 0, 1],
+                            [0, 0, 1, 1]])
+
+
+def load_terrain(input_dict, units):
+    """Returns the terrain described by the "terrain" object of the input, or None if
+    there is no such object (i.e. the ground is flat at z = 0)."""
+
+    terrain_dict = input_dict.get("terrain", None)
+    if terrain_dict is None:
+        return None
+    return Terrain(terrain_dict["directory"], units, cache_size=terrain_dict.get("cache_size", 16))
+
+
+def write_terrain(directory, elevation, spacing, **kwargs):
+    """Splits the given grid of elevations into tiles and writes them, along with the
+    tile index, to the given directory.
+
+    Parameters
+    ----------
+    directory : str
+        Directory to write the terrain to. Will be created if it does not exist.
+
+    elevation : ndarray
+        Elevations (height above z = 0) at each grid point, shape (N_x, N_y). The first
+        index corresponds to the Earth-fixed x direction.
+
+    spacing : float
+        Distance between grid points.
+
+    origin : list, optional
+        Earth-fixed x and y coordinates of the first grid point. Defaults to [0.0, 0.0].
+
+    tile_samples : int, optional
+        Number of samples along each side of a tile. Neighboring tiles share their edge
+        samples. Defaults to 257.
+
+    units : str, optional
+        Units of the spacing, origin, and elevations, e.g. "ft" or "m". Defaults to "ft".
+
+    default_elevation : float, optional
+        Elevation to use outside of the tiles. Defaults to 0.0.
+    """
+
+    # Get params
+    elevation = np.asarray(elevation, dtype=np.float32)
+    N = kwargs.get("tile_samples", 257)
+    origin = kwargs.get("origin", [0.0, 0.0])
+
+    # Pad the grid so it divides evenly into tiles
+    N_tiles_x = max(int(np.ceil((elevation.shape[0]-1)/(N-1))), 1)
+    N_tiles_y = max(int(np.ceil((elevation.shape[1]-1)/(N-1))), 1)
+    pad_x = N_tiles_x*(N-1)+1-elevation.shape[0]
+    pad_y = N_tiles_y*(N-1)+1-elevation.shape[1]
+    elevation = np.pad(elevation, ((0, pad_x), (0, pad_y)), mode='edge')
+
+    # Write tiles
+    os.makedirs(directory, exist_ok=True)
+    tiles = {}
+    for i in range(N_tiles_x):
+        for j in range(N_tiles_y):
+            filename = "tile_{0}_{1}.bin".format(i, j)
+            tile = elevation[i*(N-1):(i+1)*(N-1)+1, j*(N-1):(j+1)*(N-1)+1]
+            np.ascontiguousarray(tile).tofile(os.path.join(directory, filename))
+            tiles["{0},{1}".format(i, j)] = filename
+
+    # Write index
+    index = {
+        "tile_samples" : N,
+        "spacing" : spacing,
+        "origin" : list(origin),
+        "units" : kwargs.get("units", "ft"),
+        "dtype" : "float32",
+        "min_elevation" : float(np.min(elevation)),
+        "max_elevation" : float(np.max(elevation)),
+        "default_elevation" : kwargs.get("default_elevation", 0.0),
+        "tiles" : tiles
+    }
+    with open(os.path.join(directory, "index.json"), 'w') as index_handle:
+        json.dump(index, index_handle, indent=4)
+
+
+class Terrain:
+    """Terrain described by a grid of elevations split into tiles. Heights and surface normals
+    are found by bilinear interpolation. Tiles are memory-mapped when first touched and only
+    the most recently used ones are kept open.
+
+    Parameters
+    ----------
+    directory : str
+        Directory containing the tile index ("index.json") and tiles, as written by write_terrain().
+
+    units : str
+        Unit system of the simulation.
+
+    cache_size : int, optional
+        Number of tiles to keep open. Defaults to 16.
+    """
+
+    def __init__(self, directory, units, **kwargs):
+
+        # Read index
+        self._directory = directory
+        with open(os.path.join(directory, "index.json"), 'r') as index_handle:
+            index = json.load(index_handle)
+
+        # Get geometry of tiles, converted to the simulation units
+        factor = get_unit_factor(index.get("units", "ft"), units)
+        self._N = index["tile_samples"]
+        self._dtype = np.dtype(index.get("dtype", "float32"))
+        self._spacing = index["spacing"]*factor
+        self._tile_length = (self._N-1)*self._spacing
+        self._x0, self._y0 = np.asarray(index.get("origin", [0.0, 0.0]), dtype=float)*factor
+        self._factor = factor
+        self._default_elevation = index.get("default_elevation", 0.0)*factor
+        self.max_elevation = max(index["max_elevation"]*factor, self._default_elevation)
+        self.min_elevation = min(index["min_elevation"]*factor, self._default_elevation)
+
+        # Map tile indices to filenames
+        self._tile_files = {}
+        for key, filename in index["tiles"].items():
+            i, j = key.split(",")
+            self._tile_files[(int(i), int(j))] = os.path.join(directory, filename)
+
+        # Initialize open tiles
+        self._cache_size = kwargs.get("cache_size", 16)
+        self._open_tiles = OrderedDict()
+
+
+    def __getstate__(self):
+        # Memory maps are not passed between processes; they are reopened as needed
+        state = self.__dict__.copy()
+        state["_open_tiles"] = OrderedDict()
+        return state
+
+
+    def get_height(self, x, y):
+        """Returns the elevation of the terrain at the given Earth-fixed x and y coordinates."""
+        h, n = self.get_heights_and_normals(np.array([x], dtype=float), np.array([y], dtype=float))
+        return h[0]
+
+
+    def get_height_and_normal(self, x, y):
+        """Returns the elevation of the terrain at the given Earth-fixed x and y coordinates
+        and the unit normal pointing out of the ground in Earth-fixed coordinates."""
+        h, n = self.get_heights_and_normals(np.array([x], dtype=float), np.array([y], dtype=float))
+        return h[0], n[0]
+
+
+    def get_heights_and_normals(self, x, y):
+        """Returns the elevations and unit normals (pointing out of the ground) of the terrain
+        at the given arrays of Earth-fixed x and y coordinates.
+
+        Parameters
+        ----------
+        x : ndarray
+            Earth-fixed x coordinates.
+
+        y : ndarray
+            Earth-fixed y coordinates.
+
+        Returns
+        -------
+        h : ndarray
+            Elevations.
+
+        n : ndarray
+            Unit normals in Earth-fixed coordinates, shape (N, 3).
+        """
+
+        # Locate points within tiles
+        x_t = (x-self._x0)/self._tile_length
+        y_t = (y-self._y0)/self._tile_length
+        i_tile = np.floor(x_t).astype(int)
+        j_tile = np.floor(y_t).astype(int)
+
+        # Locate points within cells of the tiles
+        s = (x_t-i_tile)*(self._N-1)
+        t = (y_t-j_tile)*(self._N-1)
+        a = np.minimum(s.astype(int), self._N-2)
+        b = np.minimum(t.astype(int), self._N-2)
+        s -= a
+        t -= b
+
+        # Get corner elevations, reading all the points within each tile at once
+        corners = np.full((x.shape[0], 4), self._default_elevation)
+        for i, j in set(zip(i_tile.tolist(), j_tile.tolist())):
+            tile = self._get_tile(i, j)
+            if tile is not None:
+                in_tile = (i_tile == i) & (j_tile == j)
+                corners[in_tile] = tile[a[in_tile,np.newaxis]+_CORNER_OFFSETS[0], b[in_tile,np.newaxis]+_CORNER_OFFSETS[1]]*self._factor
+        h00, h10, h01, h11 = corners.T
+
+        # Interpolate
+        h = h00*(1.0-s)*(1.0-t)+h10*s*(1.0-t)+h01*(1.0-s)*t+h11*s*t
+        dh_dx = ((h10-h00)*(1.0-t)+(h11-h01)*t)/self._spacing
+        dh_dy = ((h01-h00)*(1.0-s)+(h11-h10)*s)/self._spacing
+
+        # Get normals (z is down)
+        n = np.empty((x.shape[0], 3))
+        n[:,0] = -dh_dx
+        n[:,1] = -dh_dy
+        n[:,2] = -1.0
+        n /= np.sqrt(dh_dx*dh_dx+dh_dy*dh_dy+1.0)[:,np.newaxis]
+
+        return h, n
+
+
+    def _get_tile(self, i, j):
+        # Returns the samples of the given tile, or None if the tile does not exist
+
+        # Check open tiles
+        key = (i, j)
+        tile = self._open_tiles.get(key, None)
+        if tile is not None:
+            self._open_tiles.move_to_end(key)
+            return tile
+
+        # Check the tile exists
+        filename = self._tile_files.get(key, None)
+        if filename is None:
+            return None
+
+        # Open, closing the least recently used tile if there are too many open. Indexing a plain
+        # array view of the map is much faster than indexing the memmap itself.
+        tile = np.asarray(np.memmap(filename, dtype=self._dtype, mode='r', shape=(self._N, self._N)))
+        self._open_tiles[key] = tile
+        if len(self._open_tiles) > self._cache_size:
+            self._open_tiles.popitem(last=False)
+        return tile
@@ -0,0 +1,182 @@
+"""Trims an aircraft over grids of flight conditions in parallel."""
+
+import copy
+import json
+
+import math as m
+import numpy as np
+import multiprocessing as mp
+
+from pylot.physics import load_headless_aircraft
+
+
+# Aircraft owned by each process in the pool
+_sweep_aircraft = None
+
+
+def trim_sweep(input_val, airspeeds, bank_angles=None, climb_angles=None, **kwargs):
+    """Trims the aircraft at every combination of the given airspeeds, bank angles,
+    and climb angles. The aircraft is loaded once on each process and the conditions
+    are divided among the processes such that each process solves neighboring
+    conditions in turn. Each trim is started from the solution at the nearest
+    condition which has already converged on that process.
+
+    Parameters
+    ----------
+    input_val : dict or str
+        Simulation input (or path to the input JSON) describing the aircraft. Any
+        initial condition given will be ignored.
+
+    airspeeds : list
+        Airspeeds at which to trim.
+
+    bank_angles : list, optional
+        Bank angles in degrees at which to trim. Defaults to [0.0].
+
+    climb_angles : list, optional
+        Climb angles in degrees at which to trim. Defaults to [0.0].
+
+    position : list, optional
+        Earth-fixed position at which to trim. Defaults to [0.0, 0.0, -1000.0], i.e. 1000
+        ft (or m) above the origin, so the landing gear is well clear of the ground. Note
+        the ground is at z = 0 and z is positive down.
+
+    trim_controls : list, optional
+        Controls used to trim the aircraft. See the "trim" input.
+
+    fixed_controls : dict, optional
+        Settings of the controls not used to trim the aircraft. See the "trim" input.
+
+    processes : int, optional
+        Number of processes to use. Defaults to the number of CPUs.
+
+    Returns
+    -------
+    ndarray
+        Structured array of shape (len(airspeeds), len(bank_angles), len(climb_angles)).
+        The fields are "airspeed", "bank_angle", "climb_angle", "alpha", "beta", one
+        field for each trim control, "theta", "residuals" (the six trim residuals),
+        and "converged". All angles are in degrees.
+    """
+
+    # Get conditions
+    if bank_angles is None:
+        bank_angles = [0.0]
+    if climb_angles is None:
+        climb_angles = [0.0]
+
+    # Load input
+    if isinstance(input_val, str):
+        with open(input_val, 'r') as input_handle:
+            input_dict = json.load(input_handle)
+    else:
+        input_dict = copy.deepcopy(input_val)
+
+    # Set up a plain initial state so the aircraft doesn't trim while loading. By default, this is high enough that no gear touches the ground.
+    position = kwargs.get("position", None)
+    if position is None:
+        position = [0.0, 0.0, -1000.0]
+    position = list(position)
+    if not isinstance(input_dict["aircraft"], dict):
+        raise IOError("Trim sweeps can only be run for a single aircraft.")
+    aircraft_dict = input_dict["aircraft"]
+    for key in ["trim", "initial_state", "landed", "elastic_launch", "state_output", "control_output", "controller"]:
+        aircraft_dict.pop(key, None)
+    aircraft_dict["initial_state"] = {
+        "position" : position,
+        "velocity" : [float(airspeeds[0]), 0.0, 0.0]
+    }
+
+    # Order the conditions so each one neighbors the last (snaking back and forth through the grid)
+    grid_shape = (len(airspeeds), len(bank_angles), len(climb_angles))
+    order = []
+    for i in range(grid_shape[0]):
+        J = range(grid_shape[1]) if i%2 == 0 else reversed(range(grid_shape[1]))
+        for n, j in enumerate(J):
+            K = range(grid_shape[2]) if (i*grid_shape[1]+n)%2 == 0 else reversed(range(grid_shape[2]))
+            for k in K:
+                order.append((i, j, k))
+
+    # Scale the conditions so distances in each direction are comparable
+    conditions = []
+    for i, j, k in order:
+        conditions.append((float(airspeeds[i]), float(bank_angles[j]), float(climb_angles[k])))
+    conditions = np.array(conditions)
+    scale = np.ptp(conditions, axis=0)
+    scale[scale == 0.0] = 1.0
+
+    # Split among processes
+    processes = kwargs.get("processes", None)
+    if processes is None:
+        processes = mp.cpu_count()
+    processes = max(1, min(processes, len(order)))
+    trim_dict = {
+        "position" : position,
+        "fixed_controls" : kwargs.get("fixed_controls", {}),
+        "cache" : False
+    }
+    if "trim_controls" in kwargs:
+        trim_dict["trim_controls"] = kwargs["trim_controls"]
+    chunks = [(conditions[c], scale, trim_dict) for c in np.array_split(np.arange(len(order)), processes) if len(c) > 0]
+
+    # Solve
+    if processes == 1:
+        _initialize_sweep_process(input_dict)
+        results = [_trim_chunk(chunk) for chunk in chunks]
+    else:
+        with mp.Pool(processes, initializer=_initialize_sweep_process, initargs=(input_dict,)) as pool:
+            results = pool.map(_trim_chunk, chunks)
+    control_names, results = results[0][0], [r for result in results for r in result[1]]
+
+    # Arrange results
+    dtype = [("airspeed", float), ("bank_angle", float), ("climb_angle", float), ("alpha", float), ("beta", float)]
+    dtype += [(name, float) for name in control_names]
+    dtype += [("theta", float), ("residuals", float, (6,)), ("converged", bool)]
+    table = np.zeros(grid_shape, dtype=dtype)
+    for (i, j, k), result in zip(order, results):
+        table[i,j,k] = result
+
+    return table
+
+
+def _initialize_sweep_process(input_dict):
+    # Loads the aircraft for a single process
+    global _sweep_aircraft
+    _sweep_aircraft = load_headless_aircraft(input_dict)
+
+
+def _trim_chunk(args):
+    # Trims the aircraft at a sequence of conditions on a single process
+
+    conditions, scale, base_trim_dict = args
+    aircraft = _sweep_aircraft
+    converged_conditions = []
+    converged_solutions = []
+    results = []
+
+    for V, bank, climb in conditions:
+
+        # Set up trim
+        trim_dict = copy.deepcopy(base_trim_dict)
+        trim_dict["airspeed"] = V
+        trim_dict["bank_angle"] = bank
+        trim_dict["climb_angle"] = climb
+
+        # Start from the nearest converged solution
+        if len(converged_conditions) > 0:
+            dist = np.linalg.norm((np.array(converged_conditions)-[V, bank, climb])/scale, axis=1)
+            guess = converged_solutions[np.argmin(dist)]
+        else:
+            guess = None
+
+        # Solve
+        x, residuals, converged = aircraft._trim(trim_dict, initial_guess=guess)
+        if converged:
+            converged_conditions.append([V, bank, climb])
+            converged_solutions.append(x)
+
+        # Store
+        theta = aircraft._get_elevation(x[0], x[1], m.radians(bank), m.radians(climb))
+        results.append((V, bank, climb, m.degrees(x[0]), m.degrees(x[1]), *x[2:], m.degrees(theta), residuals, converged))
+
+    return list(aircraft._avail_controls), results
@@ -0,0 +1,203 @@
+"""Defines the turbulence model. Gust velocities are generated ahead of time by shaping white
+noise to the Dryden or von Karman spectra and stored in a binary file, which is memory-mapped
+and indexed directly by time during the simulation."""
+
+import os
+import json
+
+import numpy as np
+
+from pylot.helpers import get_unit_factor
+from pylot.cache import DiskCache, hash_content, get_file_stamps
+
+
+def load_turbulence(input_dict, units):
+    """Returns the turbulence described by the "turbulence" object of the atmosphere input,
+    or None if there is no such object. If no file is given, the gusts are generated from
+    the given parameters and stored in the Pylot cache so they are only generated once."""
+
+    turbulence_dict = input_dict.get("atmosphere", {}).get("turbulence", None)
+    if turbulence_dict is None:
+        return None
+
+    # Get previously generated gusts
+    filename = turbulence_dict.get("file", None)
+    if filename is None:
+
+        # Get params
+        params = {
+            "duration" : turbulence_dict.get("duration", 600.0),
+            "timestep" : turbulence_dict.get("timestep", 0.01),
+            "intensity" : turbulence_dict["intensity"],
+            "scale_length" : turbulence_dict["scale_length"],
+            "airspeed" : turbulence_dict["airspeed"],
+            "model" : turbulence_dict.get("model", "dryden"),
+            "seed" : turbulence_dict.get("seed", 0),
+            "units" : turbulence_dict.get("units", "ft" if units == "English" else "m")
+        }
+
+        # Generate, unless this has been done before
+        cache = DiskCache("turbulence", max_size=1000.0, max_age=30.0)
+        filename = cache.path(hash_content(params), ext=".bin")
+        if os.path.isfile(filename):
+            os.utime(filename)
+        else:
+            write_turbulence(filename, **params)
+            cache.evict()
+
+    return Turbulence(filename, units, time_offset=turbulence_dict.get("time_offset", 0.0))
+
+
+def write_turbulence(filename, duration, timestep, intensity, scale_length, airspeed, **kwargs):
+    """Generates a time series of gust velocities and writes it to the given file.
+
+    White noise is shaped in the frequency domain by the square root of the turbulence
+    spectrum, so the series is periodic and can be repeated indefinitely without a
+    discontinuity. Spatial turbulence is turned into a time series assuming the aircraft
+    passes through a frozen field at the given airspeed.
+
+    Parameters
+    ----------
+    filename : str
+        File to write the gust velocities to.
+
+    duration : float
+        Length of the time series in seconds.
+
+    timestep : float
+        Time between samples in seconds.
+
+    intensity : float or list
+        RMS gust velocity. May be given for each of the body-fixed x, y, and z directions
+        as a list.
+
+    scale_length : float or list
+        Turbulence scale length. May be given for each of the body-fixed x, y, and z
+        directions as a list.
+
+    airspeed : float
+        Airspeed used to turn the spatial spectra into temporal ones.
+
+    model : str, optional
+        "dryden" or "von_karman". Defaults to "dryden".
+
+    seed : int, optional
+        Seed for the random number generator. Defaults to 0.
+
+    units : str, optional
+        Units of the intensity, scale length, and airspeed, e.g. "ft" or "m". Defaults to "ft".
+    """
+
+    # Get params
+    model = kwargs.get("model", "dryden")
+    seed = kwargs.get("seed", 0)
+    sigma = np.broadcast_to(np.asarray(intensity, dtype=float), (3,))
+    L = np.broadcast_to(np.asarray(scale_length, dtype=float), (3,))
+    N = int(np.ceil(duration/timestep))
+    N += N%2
+
+    # Get power spectral densities (one-sided, in terms of circular frequency) at each frequency
+    omega = 2.0*np.pi*np.fft.rfftfreq(N, timestep)
+    x = L[:,np.newaxis]*omega[np.newaxis,:]/airspeed
+    PSD = np.empty((3, omega.shape[0]))
+    if model == "dryden":
+        PSD[0] = 2.0/(1.0+x[0]*x[0])
+        PSD[1:] = (1.0+3.0*x[1:]*x[1:])/(1.0+x[1:]*x[1:])**2
+    elif model == "von_karman":
+        x *= 1.339
+        PSD[0] = 2.0/(1.0+x[0]*x[0])**(5.0/6.0)
+        PSD[1:] = (1.0+8.0/3.0*x[1:]*x[1:])/(1.0+x[1:]*x[1:])**(11.0/6.0)
+    else:
+        raise IOError("{0} is not a valid turbulence model.".format(model))
+    PSD *= (sigma*sigma*L/(np.pi*airspeed))[:,np.newaxis]
+
+    # Shape white noise. A filter gain of sqrt(pi*PSD/dt) gives unit-variance noise the desired spectrum.
+    rng = np.random.default_rng(seed)
+    noise = np.fft.rfft(rng.standard_normal((3, N)), axis=1)
+    gain = np.sqrt(np.pi*PSD/timestep)
+    gain[:,0] = 0.0
+    gusts = np.fft.irfft(noise*gain, n=N, axis=1).T
+
+    # Write header followed by the samples, to a temporary file first so other processes never see a partial file
+    header = {
+        "num_samples" : N,
+        "timestep" : timestep,
+        "units" : kwargs.get("units", "ft"),
+        "dtype" : "float32",
+        "model" : model,
+        "intensity" : sigma.tolist(),
+        "scale_length" : L.tolist(),
+        "airspeed" : airspeed,
+        "seed" : seed
+    }
+    directory = os.path.dirname(filename)
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+    temp_filename = "{0}.{1}.tmp".format(filename, os.getpid())
+    with open(temp_filename, 'wb') as gust_handle:
+        gust_handle.write((json.dumps(header)+"\n").encode())
+        np.ascontiguousarray(gusts, dtype=np.float32).tofile(gust_handle)
+    os.replace(temp_filename, filename)
+
+
+class Turbulence:
+    """A time series of gust velocities, as written by write_turbulence(). The series is
+    memory-mapped and linearly interpolated. Times past the end of the series wrap around
+    to the beginning.
+
+    Parameters
+    ----------
+    filename : str
+        File containing the gust velocities.
+
+    units : str
+        Unit system of the simulation.
+
+    time_offset : float, optional
+        Time added to the simulation time before looking up gusts. Defaults to 0.0.
+    """
+
+    def __init__(self, filename, units, **kwargs):
+
+        # Read header
+        self._filename = filename
+        with open(filename, 'rb') as gust_handle:
+            header_line = gust_handle.readline()
+        header = json.loads(header_line.decode())
+
+        # Store params
+        self._offset = len(header_line)
+        self._N = header["num_samples"]
+        self._dtype = np.dtype(header.get("dtype", "float32"))
+        self._sample_rate = 1.0/header["timestep"]
+        self._factor = get_unit_factor(header.get("units", "ft"), units)
+        self._time_offset = kwargs.get("time_offset", 0.0)
+        self._gusts = None
+
+
+    def __getstate__(self):
+        # Memory maps are not passed between processes; the file is reopened as needed
+        state = self.__dict__.copy()
+        state["_gusts"] = None
+        return state
+
+
+    def get_stamp(self):
+        """Returns the stamp of the gust file and the time offset, which change if these
+        gusts do. Used to key cached results which depend on the gusts."""
+        return [get_file_stamps(self._filename), self._time_offset]
+
+
+    def get_gust(self, t):
+        """Returns the gust velocity in body-fixed coordinates at the given time."""
+
+        # Open
+        if self._gusts is None:
+            self._gusts = np.asarray(np.memmap(self._filename, dtype=self._dtype, mode='r', offset=self._offset, shape=(self._N, 3)))
+
+        # Interpolate between the neighboring samples
+        s = ((t+self._time_offset)*self._sample_rate)%self._N
+        i = min(int(s), self._N-1)
+        j = i+1 if i+1 < self._N else 0
+        s -= i
+        return self._factor*((1.0-s)*self._gusts[i].astype(float)+s*self._gusts[j].astype(float))
@@ -0,0 +1,227 @@
+"""Defines the wind field model. Steady or time-varying winds are given on a regular grid of
+points in Earth-fixed coordinates, stored in a binary file which is memory-mapped, and found
+between the grid points by trilinear interpolation."""
+
+import os
+import json
+
+import math as m
+import numpy as np
+
+from pylot.helpers import get_unit_factor
+from pylot.cache import get_file_stamps
+
+
+def load_wind_field(input_dict, units):
+    """Returns the wind field described by the "wind_field" object of the atmosphere input,
+    or None if there is no such object (i.e. there is no steady wind)."""
+
+    wind_dict = input_dict.get("atmosphere", {}).get("wind_field", None)
+    if wind_dict is None:
+        return None
+    return WindField(wind_dict["file"], units)
+
+
+def write_wind_field(filename, wind, spacing, **kwargs):
+    """Writes the given grid of wind velocities to a file which can be used as a wind field.
+
+    Parameters
+    ----------
+    filename : str
+        File to write the wind field to.
+
+    wind : ndarray
+        Wind velocities in Earth-fixed coordinates at each grid point, shape (N_x, N_y, N_z, 3).
+        If "times" is given, the wind at each time, shape (N_t, N_x, N_y, N_z, 3). A grid may
+        have a single point in any direction, in which case the wind does not vary in that
+        direction (e.g. a vertical profile can be given with N_x = N_y = 1).
+
+    spacing : float or list
+        Distance between grid points. May be given for each of the x, y, and z directions as a list.
+
+    origin : list, optional
+        Earth-fixed coordinates of the first grid point. Note z is positive down. Defaults
+        to [0.0, 0.0, 0.0].
+
+    times : list, optional
+        Times in seconds at which the wind is given, in increasing order. Defaults to a
+        steady wind field.
+
+    units : str, optional
+        Units of the spacing, origin, and wind velocities, e.g. "ft" or "m". Defaults to "ft".
+    """
+
+    # Get params
+    wind = np.asarray(wind, dtype=np.float32)
+    times = kwargs.get("times", None)
+    if times is None:
+        wind = wind[np.newaxis]
+        times = [0.0]
+    if wind.ndim != 5 or wind.shape[-1] != 3 or wind.shape[0] != len(times):
+        raise IOError("Wind grid of shape {0} does not match {1} times.".format(wind.shape, len(times)))
+
+    # Write header followed by the grid, to a temporary file first so other processes never see a partial file
+    header = {
+        "shape" : list(wind.shape[1:4]),
+        "spacing" : np.broadcast_to(np.asarray(spacing, dtype=float), (3,)).tolist(),
+        "origin" : list(kwargs.get("origin", [0.0, 0.0, 0.0])),
+        "times" : list(times),
+        "units" : kwargs.get("units", "ft"),
+        "dtype" : "float32"
+    }
+    directory = os.path.dirname(filename)
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+    temp_filename = "{0}.{1}.tmp".format(filename, os.getpid())
+    with open(temp_filename, 'wb') as wind_handle:
+        wind_handle.write((json.dumps(header)+"\n").encode())
+        np.ascontiguousarray(wind).tofile(wind_handle)
+    os.replace(temp_filename, filename)
+
+
+class WindField:
+    """Wind velocities given on a regular grid, as written by write_wind_field(). The wind is
+    found by trilinear interpolation in space and linear interpolation in time. Outside of the
+    grid (or the times given), the wind at the nearest edge is used.
+
+    Parameters
+    ----------
+    filename : str
+        File containing the wind field.
+
+    units : str
+        Unit system of the simulation.
+    """
+
+    def __init__(self, filename, units):
+
+        # Read header
+        self._filename = filename
+        with open(filename, 'rb') as wind_handle:
+            header_line = wind_handle.readline()
+        header = json.loads(header_line.decode())
+
+        # Get geometry of the grid, converted to the simulation units
+        self._factor = get_unit_factor(header.get("units", "ft"), units)
+        self._offset = len(header_line)
+        self._dtype = np.dtype(header.get("dtype", "float32"))
+        self._times = np.asarray(header["times"], dtype=float)
+        self._shape = np.asarray([len(self._times)]+header["shape"])
+        self._spacing = np.asarray(header["spacing"], dtype=float)*self._factor
+        self._origin = np.asarray(header.get("origin", [0.0, 0.0, 0.0]), dtype=float)*self._factor
+        self._time_indices = np.arange(len(self._times), dtype=float)
+
+        # Plain lists are faster for the scalar lookups
+        self._shape_list = self._shape.tolist()
+        self._max_index = np.maximum(self._shape-2, 0).tolist()
+        self._origin_list = self._origin.tolist()
+        self._spacing_list = self._spacing.tolist()
+
+        # Initialize grid and current cell
+        self._grid = None
+        self._cell_key = None
+        self._cell = None
+
+
+    def __getstate__(self):
+        # Memory maps are not passed between processes; the file is reopened as needed
+        state = self.__dict__.copy()
+        state["_grid"] = None
+        state["_cell_key"] = None
+        state["_cell"] = None
+        return state
+
+
+    def _get_grid(self):
+        # Returns the grid of wind velocities, opening it if necessary
+
+        # Indexing a plain array view of the map is much faster than indexing the memmap itself
+        if self._grid is None:
+            self._grid = np.asarray(np.memmap(self._filename, dtype=self._dtype, mode='r', offset=self._offset, shape=tuple(self._shape)+(3,)))
+        return self._grid
+
+
+    def _locate(self, t, points):
+        # Gives the indices of the grid points (and times) on either side of the given points and the fractions of the way between them
+
+        # Get fractional indices along each dimension
+        s = np.empty((points.shape[0], 4))
+        if self._shape[0] > 1:
+            s[:,0] = np.interp(t, self._times, self._time_indices)
+        else:
+            s[:,0] = 0.0
+        s[:,1:] = (points-self._origin)/self._spacing
+
+        # Get indices, staying within the grid
+        i0 = np.clip(np.floor(s).astype(int), 0, np.maximum(self._shape-2, 0))
+        i1 = np.minimum(i0+1, self._shape-1)
+        f = np.clip(s-i0, 0.0, 1.0)
+        return i0, i1, f
+
+
+    def get_stamp(self):
+        """Returns the stamp of the wind field file, which changes if this wind field does.
+        Used to key cached results which depend on the wind."""
+        return get_file_stamps(self._filename)
+
+
+    def get_wind(self, x, y, z, t=0.0):
+        """Returns the wind velocity in Earth-fixed coordinates at the given Earth-fixed
+        coordinates and time. The grid values surrounding the last point queried are kept,
+        so repeated queries within the same cell do not read the grid."""
+
+        # Locate the point, working with scalars since this is called at every evaluation of the forces
+        if self._shape[0] > 1:
+            s = [float(np.interp(t, self._times, self._time_indices)), 0.0, 0.0, 0.0]
+        else:
+            s = [0.0, 0.0, 0.0, 0.0]
+        for k, (coord, origin, spacing) in enumerate(zip((x, y, z), self._origin_list, self._spacing_list)):
+            s[k+1] = (coord-origin)/spacing
+        i0 = [0, 0, 0, 0]
+        for k in range(4):
+            i0[k] = min(max(int(m.floor(s[k])), 0), self._max_index[k])
+            s[k] = min(max(s[k]-i0[k], 0.0), 1.0)
+
+        # Gather the cell if we've moved out of the last one
+        key = tuple(i0)
+        if key != self._cell_key:
+            indices = [[i, min(i+1, N-1)] for i, N in zip(i0, self._shape_list)]
+            self._cell = self._get_grid()[np.ix_(*indices)].astype(float)*self._factor
+            self._cell_key = key
+
+        # Interpolate one dimension at a time
+        cell = self._cell
+        for f in s:
+            cell = cell[0]+f*(cell[1]-cell[0])
+        return cell
+
+
+    def get_winds(self, points, t=0.0):
+        """Returns the wind velocities at many points at once.
+
+        Parameters
+        ----------
+        points : ndarray
+            Earth-fixed coordinates of the points, shape (N, 3).
+
+        t : float, optional
+            Time. Defaults to 0.0.
+
+        Returns
+        -------
+        ndarray
+            Wind velocities in Earth-fixed coordinates, shape (N, 3).
+        """
+
+        points = np.atleast_2d(points)
+        i0, i1, f = self._locate(t, points)
+        grid = self._get_grid()
+
+        # Sum the contributions of the 16 corners of each cell (8 in space, 2 in time)
+        winds = np.zeros((points.shape[0], 3))
+        for corner in range(16):
+            upper = np.array([(corner >> k) & 1 for k in range(4)], dtype=bool)
+            indices = np.where(upper, i1, i0)
+            weights = np.prod(np.where(upper, f, 1.0-f), axis=1)
+            winds += weights[:,np.newaxis]*grid[indices[:,0], indices[:,1], indices[:,2], indices[:,3]]
+        return winds*self._factor